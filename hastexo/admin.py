@@ -10,7 +10,7 @@ from .common import (
     VALID_STATES,
     get_xblock_settings
 )
-from .models import Stack, StackLog
+from .models import Stack, StackLog, recount_occupancy
 
 
 @admin.action(description="Mark selected stacks as SUSPEND_COMPLETE")
@@ -19,7 +19,9 @@ def mark_suspended(modeladmin, request, queryset):
     Mark selected stacks as successfully suspended.
 
     """
+    slots = set(queryset.values_list('course_id', 'provider'))
     queryset.update(status=SUSPEND_COMPLETE)
+    recount_occupancy(slots)
 
 
 @admin.action(description="Mark selected stacks as DELETE_COMPLETE")
@@ -28,7 +30,9 @@ def mark_deleted(modeladmin, request, queryset):
     Mark selected stacks as deleted, and reset the provider.
 
     """
+    slots = set(queryset.values_list('course_id', 'provider'))
     queryset.update(status=DELETE_COMPLETE, provider="")
+    recount_occupancy(slots)
 
 
 @admin.action(description="Clear stacklog for selected stacks")
@@ -1,5 +1,30 @@
+import copy
+import json
+
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+# Parsed discovery documents, by service name and API version
+discovery_documents = {}
+
+
+def get_discovery_document(service_name, api_version):
+    """
+    Return the parsed discovery document for a Google API, from the copy
+    that ships with the API client library, or None if it doesn't ship one.
+    Documents are only read and parsed once per process.
+
+    The API client library modifies the document while building a service,
+    so each caller gets its own copy.
+
+    """
+    key = (service_name, api_version)
+    if key not in discovery_documents:
+        document = get_static_doc(service_name, api_version)
+        discovery_documents[key] = json.loads(document) if document else None
+
+    return copy.deepcopy(discovery_documents[key])
 
 
 class GcloudService(object):
@@ -39,6 +64,11 @@ class GcloudService(object):
 
     def get_service(self):
         credentials = self.get_credentials()
+        document = get_discovery_document(self.service_name,
+                                          self.api_version)
+        if document:
+            return build_from_document(document, credentials=credentials)
+
         return build(self.service_name,
                      self.api_version,
                      credentials=credentials)
@@ -155,6 +155,12 @@ class HastexoXBlock(XBlock,
              "will never be displayed and setting this to True will have no "
              "effect."
     )
+    tests_parallel = Boolean(
+        default=False,
+        scope=Scope.settings,
+        help="Whether the tests are independent of each other, so that they "
+             "can be run in parallel on progress check."
+    )
     progress_check_result_heading = String(
         default='Progress check result',
         scope=Scope.settings,
@@ -249,6 +255,7 @@ class HastexoXBlock(XBlock,
         'ports',
         'providers',
         'tests',
+        'tests_parallel',
         'read_only',
         'hidden',
         'enable_fullscreen')
@@ -458,6 +465,7 @@ class HastexoXBlock(XBlock,
         node.set('progress_check_label', self.progress_check_label)
         node.set('show_hints_on_error', str(self.show_hints_on_error))
         node.set('show_feedback', str(self.show_feedback))
+        node.set('tests_parallel', str(self.tests_parallel))
         node.set('progress_check_result_heading',
                  self.progress_check_result_heading)
         node.set('weight', str(self.weight))
@@ -890,7 +898,8 @@ class HastexoXBlock(XBlock,
                 "stack_id": stack.id,
                 "reset": reset,
                 "learner_id": stack.learner.id,
-                "stack_key_type": self.stack_key_type
+                "stack_key_type": self.stack_key_type,
+                "launch_timeout": self.get_launch_timeout(settings)
             })
 
             # Update stack
@@ -1074,6 +1083,7 @@ class HastexoXBlock(XBlock,
 
             kwargs = {
                 "tests": self.tests,
+                "tests_parallel": self.tests_parallel,
                 "stack_ip": stack.ip,
                 "stack_user_name": self.stack_user_name,
                 "stack_key": stack.key
@@ -1,14 +1,21 @@
 from __future__ import print_function
 
+import heapq
 import sys
+import time
+import zlib
 
-from django.db import transaction, close_old_connections
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.db import connection, transaction, close_old_connections
+from django.db.models import DateTimeField, ExpressionWrapper, F, Q
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 from .models import Stack
 from .provider import Provider
 from .tasks import DeleteStackTask, SuspendStackTask
 from .common import (
+    get_suspend_times,
     UP_STATES,
     SUSPEND_PENDING,
     SUSPEND_RETRY,
@@ -21,15 +28,69 @@ from .common import (
 )
 
 
+def parse_shard(value):
+    """
+    Parse a shard specification of the form "N/M", meaning shard N out of M,
+    counting from 0.
+
+    """
+    try:
+        index, count = [int(v) for v in value.split('/')]
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid shard [%s], expected N/M." % value)
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Invalid shard [%s], expected 0 <= N < M." % value)
+
+    return (index, count)
+
+
+def get_skip_locked():
+    """
+    Whether to skip rows locked by another job when selecting stacks for
+    update, so that several job instances can run side by side.
+
+    """
+    return connection.features.has_select_for_update_skip_locked
+
+
 class AbstractJob(object):
     """
     Parent job class.
 
     """
     settings = {}
+    shard = None
 
-    def __init__(self, settings):
+    def __init__(self, settings, shard=None):
         self.settings = settings
+        self.shard = shard
+
+    def filter_shard(self, stacks):
+        """
+        Restrict a stack queryset to the stacks in this job's shard, by stack
+        id.
+
+        """
+        if not self.shard:
+            return stacks
+
+        index, count = self.shard
+        return stacks.annotate(
+            shard=F('id') % count
+        ).filter(shard=index)
+
+    def in_shard(self, provider_name):
+        """
+        Whether a provider belongs to this job's shard, by a stable hash of
+        its name.
+
+        """
+        if not self.shard:
+            return True
+
+        index, count = self.shard
+        return zlib.crc32(provider_name.encode('utf-8')) % count == index
 
     def log(self, msg):
         """
@@ -52,55 +113,285 @@ class SuspenderJob(AbstractJob):
     Suspends stacks.
 
     """
+    def __init__(self, settings, shard=None):
+        super(SuspenderJob, self).__init__(settings, shard)
+
+        # Scheduler state: a min-heap of (deadline, stack id) tuples, the ids
+        # of the stacks in it, and the rate limiter's token bucket.
+        self.heap = []
+        self.queued = set()
+        self.tokens = 0
+        self.tokens_updated = None
+
+        # Adaptive concurrency state: the current batch size, the overdue
+        # backlog, and when the batch size was last adjusted.
+        self.concurrency = settings.get("suspend_concurrency", 4)
+        self.backlog = 0
+        self.adapted = time.time()
+
+    def get_states(self):
+        # SUSPEND_RETRY is no longer needed: we always retry on a suspend
+        # failure.  It is, thus, deprecated.
+        return list(UP_STATES) + [SUSPEND_RETRY, SUSPEND_FAILED]
+
     def run(self):
+        if self.settings.get("suspend_concurrency_adaptive", False):
+            self.adapt()
+
+        # Suspend them
+        for stack in self.claim_stacks(self.concurrency):
+            self.suspend_stack(stack)
+
+    def get_due_stacks(self, lock=False):
+        """
+        Return the stacks that are due for suspension, most overdue first.
+
+        A stack is due when its effective deadline,
+        COALESCE(suspend_by, suspend_timestamp + suspend_timeout), has
+        passed.  The condition is expanded into one branch per column, so
+        that each can be looked up in the corresponding (status, column)
+        index.
+
+        If `lock` is set, the stacks are locked for update, skipping any
+        that are already locked by another suspender, so that several can
+        run side by side without blocking each other or suspending the same
+        stack twice.
+
+        """
         timeout = self.settings.get("suspend_timeout", 120)
-        concurrency = self.settings.get("suspend_concurrency", 4)
         timedelta = timezone.timedelta(seconds=timeout)
-        cutoff = timezone.now() - timedelta
-
-        # SUSPEND_RETRY is no longer needed: we always retry on a suspend
-        # failure.  It is, thus, deprecated.
-        states = list(UP_STATES) + [SUSPEND_RETRY, SUSPEND_FAILED]
+        now = timezone.now()
+        cutoff = now - timedelta
+
+        stacks = self.filter_shard(Stack.objects.all())
+        if lock:
+            stacks = stacks.select_for_update(skip_locked=get_skip_locked())
+
+        return stacks.filter(
+            status__in=self.get_states()
+        ).filter(
+            Q(suspend_by__isnull=False,
+              suspend_by__lt=now) |
+            Q(suspend_by__isnull=True,
+              suspend_timestamp__lt=cutoff)
+        ).filter(
+            suspend_timestamp__isnull=False
+        ).exclude(
+            provider__exact=''
+        ).annotate(
+            deadline=Coalesce(
+                'suspend_by',
+                ExpressionWrapper(F('suspend_timestamp') + timedelta,
+                                  output_field=DateTimeField()))
+        ).order_by('deadline')
+
+    def claim_stacks(self, limit):
+        """
+        Mark up to `limit` stacks that are due for suspension as
+        SUSPEND_PENDING, and return them.
 
+        """
         self.refresh_db()
 
         # Get stacks to suspend
         with transaction.atomic():
-            stacks_without_suspend_by = Stack.objects.select_for_update().filter(  # noqa: E501
-                suspend_timestamp__isnull=False
-            ).filter(
-                suspend_by__isnull=True
-            ).filter(
-                suspend_timestamp__lt=cutoff
-            ).filter(
-                status__in=states
-            ).exclude(
-                provider__exact=''
-            )
-
-            stacks_with_suspend_by = Stack.objects.select_for_update().filter(
-                suspend_timestamp__isnull=False
-            ).filter(
-                suspend_by__isnull=False
-            ).filter(
-                suspend_by__lt=timezone.now()
-            ).filter(
-                status__in=states
-            ).exclude(
-                provider__exact=''
-            )
-
-            stacks = stacks_without_suspend_by.union(
-                stacks_with_suspend_by).order_by(
-                    'suspend_timestamp')[:concurrency]
+            stacks = list(self.get_due_stacks(lock=True)[:limit])
 
             for stack in stacks:
                 stack.status = SUSPEND_PENDING
                 stack.save(update_fields=["status"])
 
-        # Suspend them
-        for stack in stacks:
-            self.suspend_stack(stack)
+        return stacks
+
+    def run_scheduler(self):
+        """
+        Suspend stacks as soon as they are due, rather than polling at fixed
+        intervals.  Upcoming deadlines are kept in an in-memory heap that is
+        refilled from the database every `suspend_interval` seconds; in
+        between, the scheduler sleeps until the next stack is due.
+
+        """
+        interval = self.settings.get("suspend_interval", 60)
+        next_refill = time.monotonic()
+        failures = 0
+
+        while True:
+            try:
+                if time.monotonic() >= next_refill:
+                    if self.settings.get("suspend_concurrency_adaptive",
+                                         False):
+                        self.adapt()
+
+                    self.refill(interval)
+                    next_refill = time.monotonic() + interval
+
+                    # Catch anything that became due without being queued,
+                    # e.g. because its suspend_by was moved forward.
+                    self.drain()
+                elif self.heap and self.heap[0][0] <= timezone.now():
+                    self.drain()
+            except Exception as e:
+                # Don't let a transient error, such as a lost database
+                # connection, bring the scheduler down: drop unusable
+                # connections, back off, and try again.
+                failures += 1
+                delay = min(2 ** failures, interval)
+                self.log("Suspender pass failed, retrying in %d seconds: "
+                         "%s" % (delay, e))
+                self.refresh_db()
+                time.sleep(delay)
+                continue
+
+            failures = 0
+            delay = next_refill - time.monotonic()
+            if self.heap:
+                due = (self.heap[0][0] - timezone.now()).total_seconds()
+                delay = min(delay, due)
+
+            if delay > 0:
+                time.sleep(delay)
+
+    def refill(self, lookahead):
+        """
+        Queue all stacks that will be due within the next `lookahead`
+        seconds, and that are not queued yet.
+
+        """
+        timeout = self.settings.get("suspend_timeout", 120)
+        horizon = timezone.now() + timezone.timedelta(seconds=lookahead)
+
+        self.refresh_db()
+
+        stacks = self.filter_shard(Stack.objects.all()).filter(
+            Q(suspend_by__isnull=True,
+              suspend_timestamp__lt=(
+                  horizon - timezone.timedelta(seconds=timeout))) |
+            Q(suspend_by__isnull=False,
+              suspend_by__lt=horizon)
+        ).filter(
+            suspend_timestamp__isnull=False
+        ).filter(
+            status__in=self.get_states()
+        ).exclude(
+            provider__exact=''
+        ).values_list('id', 'suspend_timestamp', 'suspend_by')
+
+        for stack_id, suspend_timestamp, suspend_by in stacks:
+            if stack_id in self.queued:
+                continue
+
+            if suspend_by:
+                deadline = suspend_by
+            else:
+                deadline = suspend_timestamp + timezone.timedelta(
+                    seconds=timeout)
+
+            heapq.heappush(self.heap, (deadline, stack_id))
+            self.queued.add(stack_id)
+
+    def drain(self):
+        """
+        Suspend stacks until none are overdue, as fast as the rate limit
+        allows.  The heap only decides when to wake up: which stacks are
+        actually due is always checked against the database, as learners
+        may have kept their stacks alive in the meantime.
+
+        """
+        now = timezone.now()
+        while self.heap and self.heap[0][0] <= now:
+            _, stack_id = heapq.heappop(self.heap)
+            self.queued.discard(stack_id)
+
+        while True:
+            limit = self.acquire()
+            stacks = self.claim_stacks(limit)
+            self.tokens -= len(stacks)
+
+            for stack in stacks:
+                self.suspend_stack(stack)
+
+            if len(stacks) < limit:
+                break
+
+    def acquire(self):
+        """
+        Wait until the rate limiter allows at least one stack to be
+        suspended, and return how many can be suspended right away.
+
+        The limiter is a token bucket that fills up at `suspend_rate` stacks
+        per second, up to `suspend_concurrency` stacks.  If no rate is set,
+        batches of `suspend_concurrency` stacks are suspended back-to-back.
+
+        """
+        rate = self.settings.get("suspend_rate", 1)
+        burst = max(1, self.concurrency)
+        if not rate:
+            return burst
+
+        while True:
+            now = time.monotonic()
+            if self.tokens_updated is None:
+                self.tokens = burst
+            else:
+                self.tokens = min(
+                    burst,
+                    self.tokens + (now - self.tokens_updated) * rate)
+            self.tokens_updated = now
+
+            if self.tokens >= 1:
+                return int(self.tokens)
+
+            time.sleep((1 - self.tokens) / rate)
+
+    def adapt(self):
+        """
+        Adjust the number of stacks suspended at once, between
+        `suspend_concurrency_min` and `suspend_concurrency_max`, with
+        additive increase and multiplicative decrease: halve it if any
+        provider throttled suspend tasks, or took longer than
+        `suspend_latency_target` seconds on average to suspend a stack since
+        the last adjustment; otherwise, increase it by one as long as the
+        backlog of overdue stacks keeps growing.
+
+        """
+        floor = max(1, self.settings.get("suspend_concurrency_min", 1))
+        ceiling = max(floor,
+                      self.settings.get("suspend_concurrency_max", 32))
+        target = self.settings.get("suspend_latency_target", 300)
+
+        congested = False
+        for provider in self.settings.get("providers", {}):
+            samples = get_suspend_times(provider, self.adapted)
+            durations = [d for _, d, throttled in samples if not throttled]
+            if any(throttled for _, _, throttled in samples):
+                self.log("Suspend tasks throttled by provider [%s]." %
+                         provider)
+                congested = True
+            elif (target and durations and
+                    sum(durations) / len(durations) > target):
+                self.log("Suspend tasks slowing down in provider [%s]." %
+                         provider)
+                congested = True
+        self.adapted = time.time()
+
+        self.refresh_db()
+        backlog = self.get_due_stacks().count()
+
+        if congested:
+            concurrency = self.concurrency // 2
+        elif backlog > self.concurrency and backlog >= self.backlog:
+            concurrency = self.concurrency + 1
+        else:
+            concurrency = self.concurrency
+        concurrency = min(ceiling, max(floor, concurrency))
+
+        if concurrency != self.concurrency:
+            self.log("Suspend concurrency changed from %d to %d, with %d "
+                     "overdue stacks." % (self.concurrency, concurrency,
+                                          backlog))
+
+        self.concurrency = concurrency
+        self.backlog = backlog
 
     def suspend_stack(self, stack):
         """
@@ -126,6 +417,8 @@ class ReaperJob(AbstractJob):
     Deletes old stacks.
 
     """
+    zombie_chunk_size = 500
+
     def run(self):
         dont_delete = [DELETE_PENDING,
                        DELETE_COMPLETE,
@@ -137,7 +430,9 @@ class ReaperJob(AbstractJob):
 
         # Get stacks to delete
         with transaction.atomic():
-            stacks = Stack.objects.select_for_update().filter(
+            stacks = self.filter_shard(Stack.objects.select_for_update(
+                skip_locked=get_skip_locked()
+            )).filter(
                 suspend_timestamp__isnull=False
             ).filter(
                 delete_by__isnull=False
@@ -157,40 +452,67 @@ class ReaperJob(AbstractJob):
         for stack in stacks:
             self.delete_stack(stack)
 
-        # Apocalypse pass: kill all zombie stacks
-        providers = self.settings.get("providers", {})
-        for provider_name in providers:
-            provider = Provider.init(provider_name)
-            try:
-                provider_stacks = provider.get_stacks()
-            except Exception as e:
-                error_msg = "Error listing stacks for provider [%s]: %s" % (
-                    provider_name, str(e))
-                self.log(error_msg)
-                continue
-
-            for provider_stack in provider_stacks:
-                stack_name = provider_stack["name"]
-
+        # Apocalypse pass: kill all zombie stacks.  List stacks in all
+        # providers in this shard concurrently, as that may take a while.
+        providers = [p for p in self.settings.get("providers", {})
+                     if self.in_shard(p)]
+        if not providers:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(providers)) as executor:
+            futures = {
+                executor.submit(self.get_provider_stacks, provider_name):
+                provider_name for provider_name in providers
+            }
+            for future in as_completed(futures):
+                provider_name = futures[future]
                 try:
-                    stack = Stack.objects.get(name=stack_name)
-                except Stack.DoesNotExist:
+                    provider_stacks = future.result()
+                except Exception as e:
+                    error_msg = ("Error listing stacks for provider [%s]: %s"
+                                 % (provider_name, str(e)))
+                    self.log(error_msg)
                     continue
 
-                if stack.status == DELETE_COMPLETE:
-                    error_msg = ("Zombie stack [%s] detected at provider [%s]"
-                                 % (stack_name, provider_name))
-                    self.log(error_msg)
-                    stack.provider = provider_name
-                    stack.status = DELETE_PENDING
-                    stack.error_msg = error_msg
-                    stack.save(update_fields=[
-                        "provider",
-                        "status",
-                        "error_msg"
-                    ])
-
-                    self.delete_stack(stack)
+                self.destroy_zombies(provider_name, provider_stacks)
+
+    def get_provider_stacks(self, provider_name):
+        """
+        List all stacks in a provider.
+
+        """
+        provider = Provider.init(provider_name)
+        return provider.get_stacks()
+
+    def destroy_zombies(self, provider_name, provider_stacks):
+        """
+        Delete stacks that still exist in the provider, even though they're
+        marked as deleted in the database.  Stacks are looked up in chunks,
+        with one query each.
+
+        """
+        stack_names = [s["name"] for s in provider_stacks]
+        for i in range(0, len(stack_names), self.zombie_chunk_size):
+            chunk = stack_names[i:i + self.zombie_chunk_size]
+            stacks = Stack.objects.filter(
+                name__in=chunk,
+                status=DELETE_COMPLETE
+            )
+
+            for stack in stacks:
+                error_msg = ("Zombie stack [%s] detected at provider [%s]"
+                             % (stack.name, provider_name))
+                self.log(error_msg)
+                stack.provider = provider_name
+                stack.status = DELETE_PENDING
+                stack.error_msg = error_msg
+                stack.save(update_fields=[
+                    "provider",
+                    "status",
+                    "error_msg"
+                ])
+
+                self.delete_stack(stack)
 
     def delete_stack(self, stack):
         """
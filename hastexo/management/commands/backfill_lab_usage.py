@@ -0,0 +1,69 @@
+from datetime import timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import (DurationField, ExpressionWrapper, F,
+                              OuterRef, Subquery, Sum)
+from django.db.models.functions import TruncDate
+
+from hastexo.common import SUSPEND_COMPLETE, get_xblock_settings
+from hastexo.models import LabUsage, Stack, StackLog, get_stacklog_fields
+
+# The stack log fields the ledger is rebuilt from
+REQUIRED_FIELDS = ("launch_timestamp", "suspend_timestamp")
+
+
+class Command(BaseCommand):
+    help = """Rebuilds the per-learner lab usage ledger from the stack log,
+    i.e. the time spent on every lab session that was suspended"""
+
+    def handle(self, *args, **options):
+        # Without these fields, sessions can't be told apart from missing
+        # data, and the rebuilt ledger would be empty.
+        settings = get_xblock_settings()
+        fields = get_stacklog_fields(settings.get("stacklog_fields"))
+        missing = [f for f in REQUIRED_FIELDS if f not in fields]
+        if missing:
+            raise CommandError(
+                "The stack log doesn't record %s (see stacklog_fields), so "
+                "lab usage can't be rebuilt from it." % ", ".join(missing))
+
+        learner = Stack.objects.filter(
+            id=OuterRef('stack_id')
+        ).values('learner_id')[:1]
+
+        with transaction.atomic():
+            # Lock all stacks, so that no lab session closes, and adds to
+            # the ledger, while it is being rebuilt.
+            stacks = Stack.objects.select_for_update()
+            list(stacks.values_list('id', flat=True))
+
+            sessions = StackLog.objects.filter(
+                status=SUSPEND_COMPLETE,
+                launch_timestamp__isnull=False,
+                suspend_timestamp__isnull=False
+            ).annotate(
+                learner_id=Subquery(learner),
+                date=TruncDate('launch_timestamp', tzinfo=dt_timezone.utc)
+            ).filter(
+                learner_id__isnull=False
+            ).values(
+                'learner_id', 'date'
+            ).annotate(
+                total=Sum(ExpressionWrapper(
+                    F('suspend_timestamp') - F('launch_timestamp'),
+                    output_field=DurationField()))
+            ).order_by()
+
+            ledger = [
+                LabUsage(learner_id=session['learner_id'],
+                         date=session['date'],
+                         seconds=session['total'].total_seconds())
+                for session in sessions
+            ]
+
+            LabUsage.objects.all().delete()
+            LabUsage.objects.bulk_create(ledger, batch_size=1000)
+
+        self.stdout.write("Lab usage recorded for %d learner days." %
+                          len(ledger))
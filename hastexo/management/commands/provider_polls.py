@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from hastexo.common import get_poll_counts, get_xblock_settings
+
+OPERATIONS = ("create", "resume", "suspend", "delete")
+
+
+class Command(BaseCommand):
+    help = """Shows how many status polls each provider operation took, on
+    average, and how long was spent waiting between them"""
+
+    def handle(self, *args, **options):
+        settings = get_xblock_settings()
+
+        for provider in settings.get("providers", {}):
+            for operation in OPERATIONS:
+                counts = get_poll_counts(provider, operation)
+                if not counts["operations"]:
+                    continue
+
+                self.stdout.write(
+                    "%s %s: %d operations, %.1f polls and %.1f seconds "
+                    "waited per operation." % (
+                        provider, operation, counts["operations"],
+                        counts["polls"] / counts["operations"],
+                        counts["seconds"] / counts["operations"]))
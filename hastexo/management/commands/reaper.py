@@ -1,21 +1,34 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from hastexo.common import get_xblock_settings
-from hastexo.jobs import ReaperJob
+from hastexo.jobs import ReaperJob, parse_shard
 
 
 class Command(BaseCommand):
     help = """Automates the deletion of stale stacks, i.e. those that have not
     been resumed in a configurable time period"""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--shard',
+            help="Only handle shard N out of M (e.g. 0/3), to run several "
+                 "instances side by side.")
+
     def handle(self, *args, **options):
         # Get configuration
         settings = get_xblock_settings()
 
+        shard = None
+        if options.get('shard'):
+            try:
+                shard = parse_shard(options['shard'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
         # Schedule
         scheduler = BlockingScheduler()
-        job = ReaperJob(settings)
+        job = ReaperJob(settings, shard)
         interval = settings.get("delete_interval", 3600)
         scheduler.add_job(job.run, 'interval', seconds=interval)
         scheduler.start()
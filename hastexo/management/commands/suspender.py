@@ -1,20 +1,39 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from hastexo.common import get_xblock_settings
-from hastexo.jobs import SuspenderJob
+from hastexo.jobs import SuspenderJob, parse_shard
 
 
 class Command(BaseCommand):
     help = 'Suspends stacks automatically'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--shard',
+            help="Only handle shard N out of M (e.g. 0/3), to run several "
+                 "instances side by side.")
+
     def handle(self, *args, **options):
         # Get configuration
         settings = get_xblock_settings()
 
+        shard = None
+        if options.get('shard'):
+            try:
+                shard = parse_shard(options['shard'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        suspender = SuspenderJob(settings, shard)
+
+        # Suspend stacks as soon as they're due, if so configured
+        if settings.get("suspend_scheduler", False):
+            suspender.run_scheduler()
+            return
+
         # Schedule
         scheduler = BlockingScheduler()
-        suspender = SuspenderJob(settings)
         interval = settings.get("suspend_interval", 60)
         scheduler.add_job(suspender.run, 'interval', seconds=interval)
         scheduler.start()
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('hastexo', '0012_add_suspend_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seconds', models.FloatField(default=0)),
+                ('learner', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('learner', 'date')},
+            },
+        ),
+    ]
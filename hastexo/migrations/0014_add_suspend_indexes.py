@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hastexo', '0013_add_lab_usage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stack',
+            index=models.Index(fields=['status', 'suspend_by'],
+                               name='hastexo_status_suspend_by_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stack',
+            index=models.Index(fields=['status', 'suspend_timestamp'],
+                               name='hastexo_status_suspend_ts_idx'),
+        ),
+    ]
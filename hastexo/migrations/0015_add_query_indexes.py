@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hastexo', '0014_add_suspend_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stack',
+            index=models.Index(fields=['course_id', 'provider', 'status'],
+                               name='hastexo_course_provider_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stack',
+            index=models.Index(fields=['delete_by', 'status', 'provider'],
+                               name='hastexo_delete_by_status_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+OCCUPANCY_STATES = [
+    'CREATE_COMPLETE',
+    'RESUME_COMPLETE',
+    'UPDATE_COMPLETE',
+    'ROLLBACK_COMPLETE',
+    'SNAPSHOT_COMPLETE',
+    'LAUNCH_PENDING',
+    'SUSPEND_PENDING',
+    'SUSPEND_ISSUED',
+    'SUSPEND_RETRY',
+    'SUSPEND_COMPLETE',
+    'DELETE_PENDING',
+]
+
+
+def count_occupancy(apps, schema_editor):
+    Stack = apps.get_model('hastexo', 'Stack')
+    ProviderOccupancy = apps.get_model('hastexo', 'ProviderOccupancy')
+
+    slots = Stack.objects.filter(
+        status__in=OCCUPANCY_STATES
+    ).exclude(
+        provider=''
+    ).values(
+        'course_id', 'provider'
+    ).annotate(
+        count=Count('id')
+    ).order_by()
+
+    ProviderOccupancy.objects.bulk_create([
+        ProviderOccupancy(course_id=slot['course_id'],
+                          provider=slot['provider'],
+                          count=slot['count'])
+        for slot in slots
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hastexo', '0015_add_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True,
+                                        serialize=False, verbose_name='ID')),
+                ('course_id', models.CharField(max_length=50)),
+                ('provider', models.CharField(max_length=32)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('course_id', 'provider')},
+            },
+        ),
+        migrations.RunPython(count_occupancy, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,21 @@
+import functools
+import logging
+import threading
+
 from django.conf import settings as django_settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from jsonfield.fields import JSONField
 
 SETTINGS_KEY = 'hastexo'
 DEFAULT_SETTINGS = {"delete_age": 14}
 
+logger = logging.getLogger(__name__)
 
-def default_delete_by_timestamp():
-    # load the default delete_age value from settings
+
+def get_settings():
     try:
         settings = django_settings.XBLOCK_SETTINGS.get(
             SETTINGS_KEY,
@@ -17,6 +24,13 @@ def default_delete_by_timestamp():
     except AttributeError:
         settings = DEFAULT_SETTINGS
 
+    return settings
+
+
+def default_delete_by_timestamp():
+    # load the default delete_age value from settings
+    settings = get_settings()
+
     # create a delete_by timestamp based on the delete_age from settings
     delete_by = timezone.now() + timezone.timedelta(
         days=settings.get("delete_age", 14))
@@ -24,6 +38,20 @@ def default_delete_by_timestamp():
     return delete_by
 
 
+def get_stacklog_fields(names=None):
+    """
+    Return the names of the stack fields to copy to the stack log.  By
+    default, these are all the common fields; the status is always included.
+
+    """
+    fields = [f.name for f in StackCommon._meta.get_fields()
+              if f.name != 'created_on']
+    if names:
+        fields = [f for f in fields if f in names or f == 'status']
+
+    return fields
+
+
 class StackCommon(models.Model):
     """
     Abstract class that defines a stack record's common fields.
@@ -64,6 +92,19 @@ class Stack(StackCommon):
     class Meta:
         app_label = 'hastexo'
         unique_together = (('student_id', 'course_id', 'name'),)
+        indexes = [
+            # Stacks due for suspension
+            models.Index(fields=['status', 'suspend_by'],
+                         name='hastexo_status_suspend_by_idx'),
+            models.Index(fields=['status', 'suspend_timestamp'],
+                         name='hastexo_status_suspend_ts_idx'),
+            # Provider occupancy
+            models.Index(fields=['course_id', 'provider', 'status'],
+                         name='hastexo_course_provider_idx'),
+            # Stacks due for deletion
+            models.Index(fields=['delete_by', 'status', 'provider'],
+                         name='hastexo_delete_by_status_idx'),
+        ]
 
     key = models.TextField(blank=True, null=True)
     password = models.CharField(max_length=128, blank=True, null=True)
@@ -75,24 +116,76 @@ class Stack(StackCommon):
     def __init__(self, *args, **kwargs):
         super(Stack, self).__init__(*args, **kwargs)
 
-        # Save previous status
+        # Save previous status, and the provider slot it occupied, if the
+        # stack is already stored
         self.prev_status = self.status
+        self.prev_occupancy = None
+        if self.pk is not None:
+            self.prev_occupancy = self.get_occupancy()
 
     def save(self, *args, **kwargs):
-        super(Stack, self).save(*args, **kwargs)
+        occupancy = self.get_occupancy()
+        if occupancy != self.prev_occupancy:
+            # Move the stack to its new provider slot, along with the save
+            with transaction.atomic():
+                super(Stack, self).save(*args, **kwargs)
+                update_occupancy(self.prev_occupancy, -1)
+                update_occupancy(occupancy, 1)
+            self.prev_occupancy = occupancy
+        else:
+            super(Stack, self).save(*args, **kwargs)
 
         # Populate the log if there was a status change
         if self.status and self.status != self.prev_status:
             self.prev_status = self.status
 
+            settings = get_settings()
             log_fields = {'stack_id': self.id}
-            for field in StackCommon._meta.get_fields():
-                if field.name == 'created_on':
-                    continue
-                log_fields[field.name] = getattr(self, field.name)
+            for field in get_stacklog_fields(settings.get("stacklog_fields")):
+                log_fields[field] = getattr(self, field)
 
             log = StackLog(**log_fields)
-            log.save()
+            if settings.get("stacklog_buffered", False):
+                stacklog_writer.add(log)
+            else:
+                log.save()
+
+            # Account for the lab session that just closed
+            if self.status == 'SUSPEND_COMPLETE':
+                self.update_lab_usage()
+
+    def get_occupancy(self):
+        """
+        Return the (course_id, provider) slot the stack counts toward, i.e.
+        the one it takes up capacity in, or None.
+
+        """
+        from .common import OCCUPANCY_STATES
+
+        if self.provider and self.status in OCCUPANCY_STATES:
+            return (self.course_id, self.provider)
+
+        return None
+
+    def update_lab_usage(self):
+        """
+        Add the time spent on the lab session between launch and suspend to
+        the learner's lab usage for the day the session was launched.
+
+        """
+        if (not self.learner_id or
+                not self.launch_timestamp or
+                not self.suspend_timestamp):
+            return
+
+        seconds = (self.suspend_timestamp -
+                   self.launch_timestamp).total_seconds()
+        usage, _ = LabUsage.objects.get_or_create(
+            learner_id=self.learner_id,
+            date=self.launch_timestamp.date()
+        )
+        LabUsage.objects.filter(id=usage.id).update(
+            seconds=models.F('seconds') + seconds)
 
 
 class StackLog(StackCommon):
@@ -104,3 +197,141 @@ class StackLog(StackCommon):
         app_label = 'hastexo'
 
     stack_id = models.IntegerField(null=True, db_index=True)
+
+
+class StackLogWriter(object):
+    """
+    Buffers stack log entries, and writes them with a single bulk insert
+    when the current transaction commits.  Outside a transaction, entries
+    are written immediately.
+
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    def add(self, log):
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            log.save()
+            return
+
+        # Keep a batch of entries per savepoint, each with its own commit
+        # hook, which Django drops if the savepoint is rolled back.  Forget
+        # batches whose hook already ran or was dropped.  Django has no
+        # public API for the current savepoint or the pending hooks, so if
+        # its internals don't look as expected, don't buffer.
+        try:
+            hooks = [hook[1] for hook in connection.run_on_commit]
+            key = tuple(connection.savepoint_ids)
+        except (AttributeError, IndexError, TypeError):
+            logger.warning("Can't buffer stack log entries with this "
+                           "version of Django, writing them immediately.")
+            log.save()
+            return
+
+        batches = dict((k, batch) for k, batch in
+                       getattr(self.local, 'batches', {}).items()
+                       if any(batch[1] is hook for hook in hooks))
+        self.local.batches = batches
+
+        if key not in batches:
+            pending = []
+            flush = functools.partial(self.flush, pending)
+            transaction.on_commit(flush)
+            batches[key] = (pending, flush)
+
+        batches[key][0].append(log)
+
+    def flush(self, pending):
+        # This runs after the transaction has committed, so don't fail the
+        # caller if the log can't be written.
+        try:
+            StackLog.objects.bulk_create(pending)
+        except Exception:
+            logger.exception("Error writing %d stack log entries." %
+                             len(pending))
+
+
+stacklog_writer = StackLogWriter()
+
+
+class LabUsage(models.Model):
+    """
+    A learner's total time spent on labs, in seconds, per day.
+
+    """
+    class Meta:
+        app_label = 'hastexo'
+        unique_together = (('learner', 'date'),)
+
+    learner = models.ForeignKey(django_settings.AUTH_USER_MODEL,
+                                on_delete=models.CASCADE)
+    date = models.DateField()
+    seconds = models.FloatField(default=0)
+
+
+class ProviderOccupancy(models.Model):
+    """
+    The number of stacks that count toward a provider's capacity, per
+    course.
+
+    """
+    class Meta:
+        app_label = 'hastexo'
+        unique_together = (('course_id', 'provider'),)
+
+    course_id = models.CharField(max_length=50)
+    provider = models.CharField(max_length=32)
+    count = models.IntegerField(default=0)
+
+
+def update_occupancy(slot, delta):
+    """
+    Atomically add delta to the stack count of a (course_id, provider) slot.
+
+    """
+    if not slot:
+        return
+
+    course_id, provider = slot
+    occupancy = ProviderOccupancy.objects.filter(course_id=course_id,
+                                                 provider=provider)
+    if not occupancy.update(count=models.F('count') + delta):
+        ProviderOccupancy.objects.get_or_create(course_id=course_id,
+                                                provider=provider)
+        occupancy.update(count=models.F('count') + delta)
+
+
+@receiver(post_delete, sender=Stack)
+def release_occupancy(sender, instance, **kwargs):
+    """
+    Free up the provider slot taken by a deleted stack.  This also runs for
+    stacks deleted in bulk.
+
+    """
+    update_occupancy(instance.prev_occupancy, -1)
+    instance.prev_occupancy = None
+
+
+def recount_occupancy(slots):
+    """
+    Recount the stacks in the given (course_id, provider) slots from the
+    stack table, for when stacks were updated in bulk.
+
+    """
+    from .common import OCCUPANCY_STATES
+
+    for course_id, provider in slots:
+        if not provider:
+            continue
+
+        count = Stack.objects.filter(
+            course_id=course_id,
+            provider=provider,
+            status__in=list(OCCUPANCY_STATES)
+        ).count()
+        ProviderOccupancy.objects.update_or_create(
+            course_id=course_id,
+            provider=provider,
+            defaults={'count': count}
+        )
@@ -1,8 +1,16 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.utils import timezone
 from keystoneauth1.identity import generic
 from keystoneauth1 import session as kssession
 from heatclient import client as heat_client
 from novaclient import client as nova_client
 
+# Stop reusing a cached token this many seconds before it expires
+TOKEN_EXPIRY_MARGIN = 300
+
 
 class OpenStackWrapper(object):
     """
@@ -36,7 +44,27 @@ class OpenStackWrapper(object):
         for os_option in self.os_options:
             self.options[os_option] = options.get(os_option)
 
+        self.token_cache = options.get('token_cache', False)
+        self.keystone_auth = options.get('keystone_auth')
+
+    def get_options_hash(self):
+        return hashlib.sha256(
+            json.dumps(self.options, sort_keys=True).encode()
+        ).hexdigest()
+
     def get_keystone_auth(self):
+        """
+        Return the keystone session and auth plugin this wrapper was given,
+        so that clients built from several wrappers can share it, or create
+        a new one.
+
+        """
+        if self.keystone_auth is None:
+            self.keystone_auth = self.create_keystone_auth()
+
+        return self.keystone_auth
+
+    def create_keystone_auth(self):
         keystone_session = kssession.Session(verify=True)
         if self.options['os_auth_token']:
             kwargs = {
@@ -61,8 +89,33 @@ class OpenStackWrapper(object):
             }
             keystone_auth = generic.Password(**kwargs)
 
+        if self.token_cache:
+            self.load_cached_token(keystone_session, keystone_auth)
+
         return (keystone_session, keystone_auth)
 
+    def load_cached_token(self, keystone_session, keystone_auth):
+        """
+        Reuse a token from the Django cache, shared between processes, or
+        authenticate and cache the new token until shortly before it
+        expires.
+
+        """
+        key = "hastexo.keystone_token.%s" % self.get_options_hash()
+        state = cache.get(key)
+        if state:
+            keystone_auth.set_auth_state(state)
+            return
+
+        access = keystone_auth.get_access(keystone_session)
+        if not access.expires:
+            return
+
+        timeout = (access.expires - timezone.now()).total_seconds()
+        timeout -= TOKEN_EXPIRY_MARGIN
+        if timeout > 0:
+            cache.set(key, keystone_auth.get_auth_state(), timeout)
+
 
 class HeatWrapper(OpenStackWrapper):
     """
@@ -1,11 +1,15 @@
 import time
+import asyncio
 import base64
 import binascii
 import hashlib
+import itertools
+import json
 import logging
 import paramiko
 import random
 import string
+import threading
 import yaml
 from cryptography.hazmat.primitives import serialization, asymmetric
 
@@ -23,9 +27,12 @@ from googleapiclient.errors import HttpError as GcloudApiHttpError
 from .common import (
     b,
     get_xblock_settings,
+    LRUCache,
+    record_polls,
     IN_PROGRESS,
     FAILED,
     CREATE_COMPLETE,
+    CREATE_IN_PROGRESS,
     DELETE_COMPLETE,
     DELETE_IN_PROGRESS,
     RESUME_COMPLETE,
@@ -33,12 +40,112 @@ from .common import (
     SUSPEND_COMPLETE,
     SUSPEND_IN_PROGRESS
 )
-from .openstack import HeatWrapper, NovaWrapper
+from .openstack import HeatWrapper, NovaWrapper, OpenStackWrapper
 from .gcloud import GcloudDeploymentManager, GcloudComputeEngine
 
 
 class ProviderException(Exception):
-    pass
+    @property
+    def throttled(self):
+        """
+        Whether the provider API rejected the request because of rate
+        limiting, as opposed to any other error.
+
+        """
+        cause = self.args[0] if self.args else None
+        status = (getattr(cause, 'http_status', None) or
+                  getattr(cause, 'code', None) or
+                  getattr(getattr(cause, 'resp', None), 'status', None))
+        return status in (413, 429)
+
+
+class ClientPool(object):
+    """
+    Keeps provider API clients around for reuse by later tasks in the same
+    worker, so that they don't have to authenticate and connect anew every
+    time.  Clients are kept per thread, as not all of them are thread-safe,
+    and are rebuilt once they're older than the given TTL.
+
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self, key, factory, ttl):
+        if not ttl:
+            return factory()
+
+        clients = self.local.__dict__.setdefault('clients', {})
+        now = time.monotonic()
+
+        # Evict expired clients, including those for stale configurations.
+        for k in [k for k, (t, _) in clients.items() if now - t >= ttl]:
+            del clients[k]
+
+        if key not in clients:
+            clients[key] = (now, factory())
+
+        return clients[key][1]
+
+    def clear(self):
+        self.local.__dict__.pop('clients', None)
+
+
+client_pool = ClientPool()
+
+# Parsed Gcloud deployment outputs, by project, deployment and manifest.  A
+# deployment only gets a new manifest when it's updated.
+manifest_outputs = LRUCache(1000)
+
+
+class PollingStrategy(object):
+    """
+    How long to wait between polls of a provider operation's status: the
+    first wait is `initial` seconds long, and every following one is
+    `multiplier` times longer, up to `cap` seconds.  Each wait is randomly
+    lengthened or shortened by up to `jitter` times its length, so that
+    operations started at the same time don't poll in lockstep.  Jitter is
+    clamped to between 0 and 1, so that waits are never negative.
+
+    """
+    def __init__(self, initial, multiplier=1, cap=None, jitter=0):
+        self.initial = initial
+        self.multiplier = multiplier
+        self.cap = cap
+        self.jitter = min(max(jitter, 0), 1)
+
+    def delays(self):
+        delay = self.initial
+        while True:
+            if self.cap is not None:
+                delay = min(delay, self.cap)
+
+            yield delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+            delay *= self.multiplier
+
+
+class Poller(object):
+    """
+    Waits between status polls of a provider operation, according to a
+    polling strategy, and counts them.  An operation that is being polled
+    across several tasks resumes from the number of polls done so far.
+
+    """
+    def __init__(self, provider, operation, strategy, polls=0):
+        self.provider = provider
+        self.operation = operation
+        self.delays = itertools.islice(strategy.delays(), polls, None)
+        if not polls:
+            record_polls(provider, operation, operations=1)
+
+    def next_delay(self):
+        delay = next(self.delays)
+        record_polls(self.provider, self.operation,
+                     polls=1, seconds=int(round(delay)))
+        return delay
+
+    def wait(self):
+        time.sleep(self.next_delay())
 
 
 class Provider(object):
@@ -48,11 +155,13 @@ class Provider(object):
     """
     default_credentials = None
     credentials = None
+    credentials_hash = None
     name = None
     capacity = None
     template = None
     environment = None
     sleep_seconds = None
+    status_chunk_size = 50
 
     @staticmethod
     def init(name):
@@ -81,11 +190,26 @@ class Provider(object):
             for key, default in self.default_credentials.items():
                 credentials[key] = config.get(key, default)
             self.credentials = credentials
+            self.credentials_hash = hashlib.sha256(
+                json.dumps(credentials, sort_keys=True).encode()
+            ).hexdigest()
         else:
             error_msg = ("No configuration provided for provider %s" %
                          self.name)
             raise ProviderException(error_msg)
 
+    def get_client(self, kind, factory):
+        """
+        Return a pooled API client of the given kind for this provider and
+        its credentials, calling factory to build one if necessary.
+
+        """
+        settings = get_xblock_settings()
+        ttl = settings.get("provider_client_ttl", 3600)
+        key = (self.name, kind, self.credentials_hash)
+
+        return client_pool.get(key, factory, ttl)
+
     def set_logger(self, logger):
         """Set a logger other than the standard one.
 
@@ -127,6 +251,28 @@ class Provider(object):
     def sleep(self):
         time.sleep(self.sleep_seconds)
 
+    def get_polling_strategy(self, operation):
+        """
+        Return the polling strategy for an operation ("create", "resume",
+        "suspend" or "delete"), from the `provider_polling` setting and its
+        per-operation overrides.  By default, wait `sleep_timeout` seconds
+        between polls.
+
+        """
+        settings = get_xblock_settings()
+        polling = dict(settings.get("provider_polling") or {})
+        overrides = polling.pop("operations", None) or {}
+        polling.update(overrides.get(operation, {}))
+
+        return PollingStrategy(polling.get("initial", self.sleep_seconds),
+                               polling.get("multiplier", 1),
+                               polling.get("cap"),
+                               polling.get("jitter", 0))
+
+    def get_poller(self, operation, polls=0):
+        return Poller(self.name, operation,
+                      self.get_polling_strategy(operation), polls)
+
     def generate_key_pair(self, encodeb64=False, key_type="rsa"):
         keypair = {}
 
@@ -170,6 +316,16 @@ class Provider(object):
     def get_stack(self):
         raise NotImplementedError()
 
+    def get_stacks_status(self, names):
+        """
+        Return the status of each of the named stacks, in a dictionary keyed
+        by name.  Stacks that don't exist in the provider are reported as
+        deleted.  Drivers override this to fetch the statuses with as few
+        API calls as possible.
+
+        """
+        return dict((name, self.get_stack(name)["status"]) for name in names)
+
     def create_stack(self):
         raise NotImplementedError()
 
@@ -182,6 +338,24 @@ class Provider(object):
     def resume_stack(self):
         raise NotImplementedError()
 
+    def finish_resume(self, name, outputs):
+        """
+        Run any actions due once a stack has resumed, for callers that
+        resumed it without waiting.
+
+        """
+        pass
+
+    def check_operation(self, name, operation):
+        """
+        Return the stack an operation ("create", "resume", "suspend" or
+        "delete") was started on without waiting, and whether the operation
+        has finished, by the same condition the driver waits for.
+
+        """
+        provider_stack = self.get_stack(name)
+        return (provider_stack, IN_PROGRESS not in provider_stack["status"])
+
 
 class OpenstackProvider(Provider):
     """
@@ -208,14 +382,32 @@ class OpenstackProvider(Provider):
     def __init__(self, provider, config, sleep):
         super(OpenstackProvider, self).__init__(provider, config, sleep)
 
-        self.heat_c = self._get_heat_client()
-        self.nova_c = self._get_nova_client()
+        keystone_auth = self._get_keystone_auth()
+        self.heat_c = self._get_heat_client(keystone_auth)
+        self.nova_c = self._get_nova_client(keystone_auth)
 
-    def _get_heat_client(self):
-        return HeatWrapper(**self.credentials).get_client()
-
-    def _get_nova_client(self):
-        return NovaWrapper(**self.credentials).get_client()
+    def _get_wrapper_options(self, **options):
+        settings = get_xblock_settings()
+        return dict(self.credentials,
+                    token_cache=settings.get("keystone_token_cache", False),
+                    **options)
+
+    def _get_keystone_auth(self):
+        # Pooled like the clients, so that it's never older than they are.
+        return self.get_client(
+            "keystone",
+            lambda: OpenStackWrapper(
+                **self._get_wrapper_options()).get_keystone_auth())
+
+    def _get_heat_client(self, keystone_auth):
+        options = self._get_wrapper_options(keystone_auth=keystone_auth)
+        return self.get_client(
+            "heat", lambda: HeatWrapper(**options).get_client())
+
+    def _get_nova_client(self, keystone_auth):
+        options = self._get_wrapper_options(keystone_auth=keystone_auth)
+        return self.get_client(
+            "nova", lambda: NovaWrapper(**options).get_client())
 
     def _get_stack_outputs(self, heat_stack):
         outputs = {}
@@ -262,7 +454,26 @@ class OpenstackProvider(Provider):
         return {"status": status,
                 "outputs": outputs}
 
-    def create_stack(self, name, run, key_type=""):
+    def get_stacks_status(self, names):
+        statuses = dict.fromkeys(names, DELETE_COMPLETE)
+        names = list(statuses)
+        for i in range(0, len(names), self.status_chunk_size):
+            chunk = names[i:i + self.status_chunk_size]
+            try:
+                heat_stacks = list(self.heat_c.stacks.list(
+                    filters={"name": chunk}))
+            except HTTPNotFound:
+                continue
+            except (HTTPException, HttpError) as e:
+                raise ProviderException(e)
+
+            for heat_stack in heat_stacks:
+                if heat_stack.stack_name in statuses:
+                    statuses[heat_stack.stack_name] = heat_stack.stack_status
+
+        return statuses
+
+    def create_stack(self, name, run, key_type="", wait=True):
         if not self.template:
             raise ProviderException("Template not set for provider %s." %
                                     self.name)
@@ -292,6 +503,14 @@ class OpenstackProvider(Provider):
 
         stack_id = res['stack']['id']
 
+        if not wait:
+            res = {"status": CREATE_IN_PROGRESS,
+                   "outputs": {}}
+            if keypair:
+                res["private_key"] = keypair["private_key"]
+
+            return res
+
         # Sleep to avoid throttling.
         self.sleep()
 
@@ -303,8 +522,9 @@ class OpenstackProvider(Provider):
         status = heat_stack.stack_status
 
         # Wait for stack creation
+        poller = self.get_poller("create")
         while IN_PROGRESS in status:
-            self.sleep()
+            poller.wait()
 
             try:
                 heat_stack = self.heat_c.stacks.get(stack_id=heat_stack.id)
@@ -326,7 +546,7 @@ class OpenstackProvider(Provider):
 
         return res
 
-    def resume_stack(self, name):
+    def resume_stack(self, name, wait=True):
         try:
             self.logger.info('Resuming OpenStack Heat stack [%s]' % name)
             self.heat_c.actions.resume(stack_id=name)
@@ -334,11 +554,15 @@ class OpenstackProvider(Provider):
             raise ProviderException(e)
 
         status = RESUME_IN_PROGRESS
+        if not wait:
+            return {"status": status,
+                    "outputs": {}}
 
         # Wait until resume finishes.
+        poller = self.get_poller("resume")
         while (FAILED not in status and
                status != RESUME_COMPLETE):
-            self.sleep()
+            poller.wait()
 
             try:
                 heat_stack = self.heat_c.stacks.get(
@@ -355,7 +579,29 @@ class OpenstackProvider(Provider):
             raise ProviderException("Failure resuming OpenStack Heat stack")
 
         outputs = self._get_stack_outputs(heat_stack)
+        self.finish_resume(name, outputs)
+
+        return {"status": status,
+                "outputs": outputs}
+
+    def check_operation(self, name, operation):
+        # Besides a failure, the statuses the wait for each operation ends
+        # on.  A stack that disappears ends them all.
+        finished = {
+            "resume": (RESUME_COMPLETE, DELETE_COMPLETE),
+            "suspend": (SUSPEND_COMPLETE, DELETE_COMPLETE),
+            "delete": (DELETE_COMPLETE,),
+        }
+        if operation not in finished:
+            return super(OpenstackProvider, self).check_operation(name,
+                                                                  operation)
 
+        provider_stack = self.get_stack(name)
+        status = provider_stack["status"]
+        return (provider_stack,
+                FAILED in status or status in finished[operation])
+
+    def finish_resume(self, name, outputs):
         # Reboot servers, if requested
         reboot_on_resume = outputs.get("reboot_on_resume")
         if (reboot_on_resume is not None and
@@ -368,9 +614,6 @@ class OpenstackProvider(Provider):
                 except ClientException as e:
                     raise ProviderException(e)
 
-        return {"status": status,
-                "outputs": outputs}
-
     def suspend_stack(self, name, wait=True):
         try:
             self.logger.info("Suspending OpenStack Heat stack [%s]" % name)
@@ -382,10 +625,11 @@ class OpenstackProvider(Provider):
 
         # Wait until suspend finishes.
         if wait:
+            poller = self.get_poller("suspend")
             while (FAILED not in status and
                    status != DELETE_COMPLETE and
                    status != SUSPEND_COMPLETE):
-                self.sleep()
+                poller.wait()
 
                 try:
                     heat_stack = self.heat_c.stacks.get(
@@ -421,9 +665,10 @@ class OpenstackProvider(Provider):
 
         # Wait until delete finishes.
         if wait:
+            poller = self.get_poller("delete")
             while (FAILED not in status and
                    status != DELETE_COMPLETE):
-                self.sleep()
+                poller.wait()
 
                 try:
                     heat_stack = self.heat_c.stacks.get(
@@ -465,19 +710,26 @@ class GcloudProvider(Provider):
     cs = None
     project = None
     deployment_name_prefix = 's-'
+    deployment_zones = None
 
     def __init__(self, provider, config, sleep):
         super(GcloudProvider, self).__init__(provider, config, sleep)
 
+        self.deployment_zones = {}
+
         self.ds = self._get_deployment_service()
         self.cs = self._get_compute_service()
         self.project = config.get("gc_project_id")
 
     def _get_deployment_service(self):
-        return GcloudDeploymentManager(**self.credentials).get_service()
+        return self.get_client(
+            "deploymentmanager",
+            lambda: GcloudDeploymentManager(**self.credentials).get_service())
 
     def _get_compute_service(self):
-        return GcloudComputeEngine(**self.credentials).get_service()
+        return self.get_client(
+            "compute",
+            lambda: GcloudComputeEngine(**self.credentials).get_service())
 
     def _get_deployment_outputs(self, deployment):
         name = deployment["name"]
@@ -491,6 +743,11 @@ class GcloudProvider(Provider):
             return {}
 
         manifest = manifest_url.split('/')[-1]
+        key = (self.project, name, manifest)
+        outputs = manifest_outputs.get(key)
+        if outputs is not None:
+            return dict(outputs)
+
         try:
             response = self.ds.manifests().get(
                 project=self.project,
@@ -526,40 +783,206 @@ class GcloudProvider(Provider):
 
                 outputs[name] = value
 
+        # Outputs may still be missing while the deployment is in progress.
+        if deployment.get("operation", {}).get("status") == "DONE":
+            manifest_outputs.set(key, dict(outputs))
+
         return outputs
 
+    def _get_server_zones(self, resources):
+        """
+        Return the names of the servers among a deployment's resources, by
+        zone.
+
+        """
+        zones = {}
+        for s in resources:
+            try:
+                p = yaml.safe_load(s["finalProperties"])
+                server_zone = p["zone"].split('/')[-1]
+                zones.setdefault(server_zone, []).append(s["name"])
+            except (KeyError, TypeError, yaml.error.YAMLError) as e:
+                raise ProviderException(e)
+
+        return zones
+
+    def _get_deployment_zones(self, deployment_name):
+        """
+        Return the names of a deployment's servers, by zone.  These don't
+        change after the deployment is created, so they're only looked up
+        once per deployment, unless none were found.
+
+        """
+        zones = self.deployment_zones.get(deployment_name)
+        if zones is None:
+            try:
+                response = self.ds.resources().list(
+                    project=self.project,
+                    deployment=deployment_name,
+                    filter='type = "compute.v1.instance"'
+                ).execute()
+            except GcloudApiError as e:
+                raise ProviderException(e)
+
+            zones = self._get_server_zones(response.get("resources", []))
+            if zones:
+                self.deployment_zones[deployment_name] = zones
+
+        return zones
+
     def _get_deployment_servers(self, deployment_name):
-        try:
-            response = self.ds.resources().list(
-                project=self.project,
-                deployment=deployment_name,
-                filter='type = "compute.v1.instance"'
-            ).execute()
-        except GcloudApiError as e:
-            raise ProviderException(e)
+        """
+        Fetch a deployment's servers, with one instance list per zone.
 
+        """
         servers = []
-        if "resources" in response:
-            for s in response["resources"]:
-                try:
-                    server_name = s["name"]
-                    p = yaml.safe_load(s["finalProperties"])
-                    server_zone = p["zone"]
-                    server = self.cs.instances().get(
-                        project=self.project,
-                        zone=server_zone,
-                        instance=server_name
-                    ).execute()
-                except (KeyError, yaml.error.YAMLError, GcloudApiError) as e:
-                    raise ProviderException(e)
+        zones = self._get_deployment_zones(deployment_name)
+        for zone, names in sorted(zones.items()):
+            try:
+                response = self.cs.instances().list(
+                    project=self.project,
+                    zone=zone,
+                    filter=" OR ".join('(name = "%s")' % name
+                                       for name in names)
+                ).execute()
+            except GcloudApiError as e:
+                raise ProviderException(e)
+
+            # Instances that don't exist are left out of the list, rather
+            # than reported as errors.
+            items = response.get("items", [])
+            if len(items) < len(names):
+                missing = set(names) - set(s.get("name") for s in items)
+                raise ProviderException(
+                    "Google Compute machines %s not found in zone %s." %
+                    (", ".join(sorted(missing)), zone))
+
+            servers.extend(items)
+
+        return servers
+
+    def _get_deployments_servers(self, deployment_names):
+        """
+        Return the servers of several deployments, in a dictionary keyed by
+        deployment name.  Deployment resources are listed in batch requests,
+        and servers fetched with aggregated instance lists, instead of with
+        one request per deployment and server.
+
+        """
+        errors = []
+        found = {}
+
+        def add_resources(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            else:
+                found[request_id] = self._get_server_zones(
+                    response.get("resources", []))
+
+        unknown = [name for name in deployment_names
+                   if name not in self.deployment_zones]
+        for i in range(0, len(unknown), self.status_chunk_size):
+            batch = self.ds.new_batch_http_request(callback=add_resources)
+            for deployment_name in unknown[i:i + self.status_chunk_size]:
+                batch.add(self.ds.resources().list(
+                    project=self.project,
+                    deployment=deployment_name,
+                    filter='type = "compute.v1.instance"'
+                ), request_id=deployment_name)
+
+            try:
+                batch.execute()
+            except GcloudApiError as e:
+                raise ProviderException(e)
 
-                servers.append(server)
+        if errors:
+            raise ProviderException(errors[0])
+
+        # Only remember deployments whose servers were found.
+        self.deployment_zones.update(
+            (name, zones) for name, zones in found.items() if zones)
+
+        # Map each server, by zone and name, to its deployment.
+        deployments = {}
+        for deployment_name in deployment_names:
+            zones = self.deployment_zones.get(deployment_name,
+                                              found.get(deployment_name, {}))
+            for server_zone, server_names in zones.items():
+                for server_name in server_names:
+                    deployments[(server_zone, server_name)] = deployment_name
+
+        servers = dict((name, []) for name in deployment_names)
+        keys = list(deployments)
+        for i in range(0, len(keys), self.status_chunk_size):
+            names = set(name for _, name in
+                        keys[i:i + self.status_chunk_size])
+            instances = self.cs.instances()
+            try:
+                request = instances.aggregatedList(
+                    project=self.project,
+                    filter=" OR ".join('(name = "%s")' % name
+                                       for name in sorted(names))
+                )
+                while request is not None:
+                    response = request.execute()
+                    for scope in response.get("items", {}).values():
+                        for server in scope.get("instances", []):
+                            key = (server["zone"].split('/')[-1],
+                                   server["name"])
+                            if key in deployments:
+                                servers[deployments[key]].append(server)
+
+                    request = instances.aggregatedList_next(request,
+                                                            response)
+            except GcloudApiError as e:
+                raise ProviderException(e)
 
         return servers
 
-    def _get_deployment_status(self, deployment):
+    def _execute_batch(self, requests):
+        """
+        Send Compute Engine API requests, such as those starting or stopping
+        a deployment's servers, in batch requests instead of one by one.
+
+        """
+        errors = []
+
+        def check_response(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+
+        for i in range(0, len(requests), self.status_chunk_size):
+            batch = self.cs.new_batch_http_request(callback=check_response)
+            for request in requests[i:i + self.status_chunk_size]:
+                batch.add(request)
+
+            try:
+                batch.execute()
+            except GcloudApiError as e:
+                raise ProviderException(e)
+
+        if errors:
+            raise ProviderException(errors[0])
+
+    def _get_deployment_status(self, deployment, servers=None):
         deployment_name = deployment["name"]
+        status = self._get_operation_status(deployment)
+
+        # Calculate suspend status
+        if status == CREATE_COMPLETE:
+            if servers is None:
+                servers = self._get_deployment_servers(deployment_name)
+            if servers:
+                if any(s.get("status") == "STOPPING" for s in servers):
+                    status = SUSPEND_IN_PROGRESS
+                elif any(s.get("status") == "STAGING" for s in servers):
+                    status = RESUME_IN_PROGRESS
+                elif all(s.get("status") == "TERMINATED" for s in servers):
+                    status = SUSPEND_COMPLETE
+
+        return status
 
+    def _get_operation_status(self, deployment):
         if "operation" not in deployment:
             raise ProviderException("Operation not found.")
 
@@ -583,20 +1006,7 @@ class GcloudProvider(Provider):
         else:
             raise ProviderException("Unknown operation status %s" % opstatus)
 
-        status = "%s_%s" % (optype, opstatus)
-
-        # Calculate suspend status
-        if status == CREATE_COMPLETE:
-            servers = self._get_deployment_servers(deployment_name)
-            if servers:
-                if any(s.get("status") == "STOPPING" for s in servers):
-                    status = SUSPEND_IN_PROGRESS
-                elif any(s.get("status") == "STAGING" for s in servers):
-                    status = RESUME_IN_PROGRESS
-                elif all(s.get("status") == "TERMINATED" for s in servers):
-                    status = SUSPEND_COMPLETE
-
-        return status
+        return "%s_%s" % (optype, opstatus)
 
     def _encode_name(self, name):
         """
@@ -663,8 +1073,47 @@ class GcloudProvider(Provider):
         return {"status": status,
                 "outputs": outputs}
 
-    def create_stack(self, name, run):
+    def get_stacks_status(self, names):
+        statuses = dict.fromkeys(names, DELETE_COMPLETE)
+        stack_names = dict((self._encode_name(name), name)
+                           for name in statuses)
+
+        # Look up deployments by name, with a regular expression filter.
+        deployments = []
+        deployment_names = list(stack_names)
+        for i in range(0, len(deployment_names), self.status_chunk_size):
+            chunk = deployment_names[i:i + self.status_chunk_size]
+            try:
+                response = self.ds.deployments().list(
+                    project=self.project,
+                    filter="name eq '(%s)'" % "|".join(chunk)
+                ).execute()
+            except GcloudApiHttpError as e:
+                if e.resp.status == 404:
+                    continue
+                else:
+                    raise ProviderException(e)
+            except GcloudApiError as e:
+                raise ProviderException(e)
+
+            deployments.extend(response.get("deployments", []))
+
+        # Only the status of created deployments depends on their servers.
+        created = [d["name"] for d in deployments
+                   if self._get_operation_status(d) == CREATE_COMPLETE]
+        servers = self._get_deployments_servers(created)
+
+        for deployment in deployments:
+            name = stack_names.get(deployment["name"])
+            if name is not None:
+                statuses[name] = self._get_deployment_status(
+                    deployment, servers.get(deployment["name"]))
+
+        return statuses
+
+    def create_stack(self, name, run, wait=True):
         deployment_name = self._encode_name(name)
+        self.deployment_zones.pop(deployment_name, None)
 
         properties = {"run": run}
 
@@ -732,8 +1181,12 @@ class GcloudProvider(Provider):
             operation = self.ds.deployments().insert(
                 project=self.project, body=body
             ).execute()
+            if not wait:
+                return {"status": CREATE_IN_PROGRESS,
+                        "outputs": {}}
 
             # Wait for operation to complete
+            poller = self.get_poller("create")
             while True:
                 response = self.ds.operations().get(
                     project=self.project,
@@ -750,7 +1203,7 @@ class GcloudProvider(Provider):
                         raise ProviderException(message)
                     break
 
-                self.sleep()
+                poller.wait()
         except GcloudApiError as e:
             raise ProviderException(e)
 
@@ -758,6 +1211,7 @@ class GcloudProvider(Provider):
 
     def delete_stack(self, name, wait=True):
         deployment_name = self._encode_name(name)
+        self.deployment_zones.pop(deployment_name, None)
 
         try:
             self.logger.info('Deleting Google Cloud deployment '
@@ -772,6 +1226,7 @@ class GcloudProvider(Provider):
 
         # Wait until delete finishes.
         if wait:
+            poller = self.get_poller("delete")
             while True:
                 try:
                     response = self.ds.operations().get(
@@ -799,7 +1254,7 @@ class GcloudProvider(Provider):
                 except GcloudApiError as e:
                     raise ProviderException(e)
 
-                self.sleep()
+                poller.wait()
 
         return {"status": status}
 
@@ -812,19 +1267,17 @@ class GcloudProvider(Provider):
         self.logger.info("Stopping servers in "
                          "Google Cloud deployment [%s]" % deployment_name)
 
+        requests = []
         for server in servers:
             status = server.get("status")
             if status == "RUNNING":
-                try:
-                    self.logger.info("Stopping Google Compute "
-                                     "machine %s" % server)
-                    self.cs.instances().stop(
-                        project=self.project,
-                        zone=server["zone"].split('/')[-1],
-                        instance=server["name"]
-                    ).execute()
-                except GcloudApiError as e:
-                    raise ProviderException(e)
+                self.logger.info("Stopping Google Compute "
+                                 "machine %s" % server)
+                requests.append(self.cs.instances().stop(
+                    project=self.project,
+                    zone=server["zone"].split('/')[-1],
+                    instance=server["name"]
+                ))
             elif (status != "STOPPING" and
                   status != "TERMINATED"):
                 raise ProviderException("Cannot not stop Google Compute "
@@ -832,12 +1285,14 @@ class GcloudProvider(Provider):
                                         "%s" % (server["name"],
                                                 server["status"]))
 
+        self._execute_batch(requests)
         status = SUSPEND_IN_PROGRESS
 
         # Wait until suspend finishes.
         if wait:
+            poller = self.get_poller("suspend")
             while True:
-                self.sleep()
+                poller.wait()
                 servers = self._get_deployment_servers(deployment_name)
                 if all(s.get("status") == "TERMINATED" for s in servers):
                     status = SUSPEND_COMPLETE
@@ -845,7 +1300,7 @@ class GcloudProvider(Provider):
 
         return {"status": status}
 
-    def resume_stack(self, name):
+    def resume_stack(self, name, wait=True):
         deployment_name = self._encode_name(name)
 
         # Start the servers
@@ -854,19 +1309,17 @@ class GcloudProvider(Provider):
         self.logger.info("Starting servers in "
                          "Google Cloud deployment [%s]" % deployment_name)
 
+        requests = []
         for server in servers:
             status = server.get("status")
             if status == "TERMINATED":
-                try:
-                    self.logger.info("Stopping Google Compute "
-                                     "machine %s" % server)
-                    self.cs.instances().start(
-                        project=self.project,
-                        zone=server["zone"].split('/')[-1],
-                        instance=server["name"]
-                    ).execute()
-                except GcloudApiError as e:
-                    raise ProviderException(e)
+                self.logger.info("Starting Google Compute "
+                                 "machine %s" % server)
+                requests.append(self.cs.instances().start(
+                    project=self.project,
+                    zone=server["zone"].split('/')[-1],
+                    instance=server["name"]
+                ))
             elif (status != "RUNNING" and
                   status != "STAGING"):
                 raise ProviderException("Cannot not stop Google Compute "
@@ -874,12 +1327,165 @@ class GcloudProvider(Provider):
                                         "%s" % (server["name"],
                                                 server["status"]))
 
+        self._execute_batch(requests)
+        if not wait:
+            return {"status": RESUME_IN_PROGRESS,
+                    "outputs": {}}
+
         # Wait until resume finishes.
+        poller = self.get_poller("resume")
         while True:
             servers = self._get_deployment_servers(deployment_name)
             if all(s.get("status") == "RUNNING" for s in servers):
                 break
 
-            self.sleep()
+            poller.wait()
 
         return self.get_stack(name)
+
+    def check_operation(self, name, operation):
+        # The deployment's status doesn't tell whether all of its servers
+        # have started or stopped.
+        if operation not in ("resume", "suspend"):
+            return super(GcloudProvider, self).check_operation(name,
+                                                               operation)
+
+        servers = self._get_deployment_servers(self._encode_name(name))
+        if operation == "suspend":
+            if all(s.get("status") == "TERMINATED" for s in servers):
+                return ({"status": SUSPEND_COMPLETE}, True)
+
+            return ({"status": SUSPEND_IN_PROGRESS}, False)
+
+        if all(s.get("status") == "RUNNING" for s in servers):
+            return (self.get_stack(name), True)
+
+        return ({"status": RESUME_IN_PROGRESS, "outputs": {}}, False)
+
+
+class AsyncProvider(object):
+    """
+    Asyncio interface to a provider driver, so that a single process can
+    drive many stacks concurrently.
+
+    The provider API clients are blocking, so each call runs in an
+    executor thread, on a provider initialized in that thread (its API
+    clients are pooled per thread).  Operations are started without
+    waiting, and waits between status polls happen in the event loop, so
+    they don't hold a thread.  Stack statuses are exactly those reported by
+    the provider driver.
+
+    """
+    def __init__(self, name, executor=None):
+        self.name = name
+        self.executor = executor
+        self.template = None
+        self.environment = None
+        self.logger = None
+        self.providers = ClientPool()
+
+    def set_logger(self, logger):
+        self.logger = logger
+
+    def set_template(self, template):
+        self.template = template
+
+    def set_environment(self, environment):
+        self.environment = environment
+
+    def get_provider(self):
+        settings = get_xblock_settings()
+        ttl = settings.get("provider_client_ttl", 3600)
+        provider = self.providers.get(self.name,
+                                      lambda: Provider.init(self.name), ttl)
+        if self.logger:
+            provider.set_logger(self.logger)
+        if self.template:
+            provider.set_template(self.template)
+        if self.environment:
+            provider.set_environment(self.environment)
+
+        return provider
+
+    def call(self, method, *args, **kwargs):
+        """
+        Run a provider driver method in the executor.
+
+        """
+        def run():
+            return getattr(self.get_provider(), method)(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, run)
+
+    async def wait(self, name, operation, provider_stack):
+        """
+        Poll the stack until the operation finishes, as the provider driver
+        would, and return the stack as last reported by the provider.
+
+        """
+        poller = await self.call("get_poller", operation)
+        finished = IN_PROGRESS not in provider_stack["status"]
+        while not finished:
+            await asyncio.sleep(poller.next_delay())
+            provider_stack, finished = await self.call("check_operation",
+                                                       name, operation)
+
+        if FAILED in provider_stack["status"]:
+            raise ProviderException("Failure waiting for stack [%s] to %s." %
+                                    (name, operation))
+
+        return provider_stack
+
+    async def get_stacks(self):
+        return await self.call("get_stacks")
+
+    async def get_stack(self, name):
+        return await self.call("get_stack", name)
+
+    async def get_stacks_status(self, names):
+        return await self.call("get_stacks_status", names)
+
+    async def create_stack(self, name, run, wait=True, **kwargs):
+        provider_stack = await self.call("create_stack", name, run,
+                                         wait=False, **kwargs)
+        if not wait:
+            return provider_stack
+
+        result = await self.wait(name, "create", provider_stack)
+        if result["status"] == DELETE_COMPLETE:
+            raise ProviderException("Stack [%s] disappeared during "
+                                    "creation." % name)
+        if "private_key" in provider_stack:
+            result["private_key"] = provider_stack["private_key"]
+
+        return result
+
+    async def resume_stack(self, name, wait=True):
+        provider_stack = await self.call("resume_stack", name, wait=False)
+        if not wait:
+            return provider_stack
+
+        result = await self.wait(name, "resume", provider_stack)
+        if result["status"] == DELETE_COMPLETE:
+            raise ProviderException("Stack [%s] disappeared during "
+                                    "resume." % name)
+        await self.call("finish_resume", name, result["outputs"])
+
+        return result
+
+    async def suspend_stack(self, name, wait=True):
+        provider_stack = await self.call("suspend_stack", name, wait=False)
+        if not wait:
+            return provider_stack
+
+        result = await self.wait(name, "suspend", provider_stack)
+        return {"status": result["status"]}
+
+    async def delete_stack(self, name, wait=True):
+        provider_stack = await self.call("delete_stack", name, wait=False)
+        if not wait:
+            return provider_stack
+
+        result = await self.wait(name, "delete", provider_stack)
+        return {"status": result["status"]}
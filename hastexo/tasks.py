@@ -3,8 +3,12 @@ import traceback
 import socket
 import logging
 import textwrap
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from django.db import connection, transaction
+from django.db.models import Sum
 from django.db.utils import OperationalError
 from django.utils import timezone
 
@@ -19,27 +23,32 @@ from tenacity import (
     before_sleep_log,
 )
 
-from .models import Stack, StackLog
+from .models import LabUsage, ProviderOccupancy, Stack
 from .provider import Provider, ProviderException
 from .common import (
     DELETE,
+    FAILED,
     IN_PROGRESS,
     UP_STATES,
-    OCCUPANCY_STATES,
     RESUME_COMPLETE,
     RESUME_FAILED,
     SUSPEND_COMPLETE,
     SUSPEND_FAILED,
+    SUSPEND_IN_PROGRESS,
     CREATE_FAILED,
     DELETE_COMPLETE,
     DELETE_IN_PROGRESS,
     DELETE_FAILED,
+    LAUNCH_ERROR,
     LAUNCH_TIMEOUT,
     get_xblock_settings,
+    record_suspend_time,
     update_stack_fields,
     ssh_to,
+    ssh_pool,
     read_from_contentstore,
     remote_exec,
+    remote_exec_batch,
     RemoteExecException,
     RemoteExecTimeout,
     _
@@ -78,6 +87,29 @@ class LaunchStackFailed(Exception):
             self.delete = True
 
 
+class LaunchStackPending(Exception):
+    """
+    Raised in non-blocking mode when a launch has to wait for a stack
+    operation, or for the stack to become reachable.
+
+    """
+    provider = None
+    operation = ""
+    was_resumed = False
+    private_key = None
+    cleanup = 0
+
+    def __init__(self, provider, operation, was_resumed=False,
+                 private_key=None, cleanup=0):
+        super(LaunchStackPending, self).__init__()
+
+        self.provider = provider
+        self.operation = operation
+        self.was_resumed = was_resumed
+        self.private_key = private_key
+        self.cleanup = cleanup
+
+
 class LabAccessRestricted(Exception):
     error_msg = ""
 
@@ -124,6 +156,38 @@ class HastexoTask(Task):
         update_stack_fields(stack, data)
         stack.save(update_fields=list(data.keys()))
 
+    def get_provider_stack_status(self, stack):
+        provider = Provider.init(stack.provider)
+        provider.set_logger(logger)
+        return provider.get_stack(stack.name)["status"]
+
+    def check_later(self, stack, operation, provider=None, **kwargs):
+        """
+        Instead of waiting in the worker for a provider operation to finish,
+        run this task again to check on it after the next polling delay.
+
+        """
+        polls = kwargs.get("polls", 0)
+        if provider is None:
+            provider = Provider.init(stack.provider)
+        delay = provider.get_poller(operation, polls).next_delay()
+
+        kwargs.update(stack_id=stack.id, polls=polls + 1)
+
+        # Give the next run the same time limits as this one.
+        options = {}
+        time_limit, soft_time_limit = self.request.timelimit or (None, None)
+        if time_limit:
+            options["time_limit"] = time_limit
+        if soft_time_limit:
+            options["soft_time_limit"] = soft_time_limit
+            options["expires"] = delay + soft_time_limit
+
+        logger.debug("Checking on stack [%s] again in %i seconds." %
+                     (stack.name, delay))
+        self.apply_async(kwargs=kwargs, countdown=delay, ignore_result=True,
+                         **options)
+
 
 class LaunchStackTask(HastexoTask):
     """
@@ -143,37 +207,57 @@ class LaunchStackTask(HastexoTask):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+        # Get the stack
+        stack = Stack.objects.get(id=self.stack_id)
+
+        # In non-blocking mode, don't wait for provider operations or for
+        # the stack to become reachable, but check on them in subsequent
+        # runs, which are passed the start time and the pending step.
+        settings = get_xblock_settings()
+        self.nonblocking = (settings.get("provider_nonblocking", False) or
+                            "started" in kwargs)
+        launch_task_id = kwargs.get("launch_task_id",
+                                    self.request.id or stack.launch_task_id)
+        if "started" not in kwargs:
+            return self.launch(stack, settings,
+                               **dict(kwargs, launch_task_id=launch_task_id))
+
+        if stack.launch_task_id != launch_task_id:
+            logger.info("Stack [%s] was relaunched, not checking on the "
+                        "previous launch." % stack.name)
+            return
+
+        # The XBlock only checks on the result of the first run, so record
+        # the failures of subsequent ones in the stack.
+        try:
+            self.launch(stack, settings, **kwargs)
+        except Exception as e:
+            logger.exception("Error checking on the launch of stack [%s]." %
+                             stack.name)
+            self.update_stack({
+                "status": LAUNCH_ERROR,
+                "error_msg": textwrap.shorten(repr(e), width=256)
+            })
+            raise
+
+    def launch(self, stack, settings, **kwargs):
+        """
+        Launch the stack, or check on a pending launch, and update it with
+        the result.
+
+        """
+        # The launch timeout can be overridden per block.
+        timeout = (kwargs.get("launch_timeout") or
+                   settings.get("launch_timeout", 900))
+        start = kwargs.get("started", time.time())
+
         # If a time limit is set for using labs,
         # check how much time learner has already spent
-        settings = get_xblock_settings()
         lab_usage_limit = settings.get("lab_usage_limit", None)
 
         policy_warn_message = None
         if lab_usage_limit:
-            # don't look further than 365 days for lab launch
-            cutoff = timezone.now() - timezone.timedelta(days=365)
-
-            # get all learner stacks across the platform
-            stacks = Stack.objects.filter(learner__id=self.learner_id
-                ).filter(launch_timestamp__gt=cutoff)
-
-            # add up total time spent on labs in seconds
-            total_time_spent = 0
-            for stack in stacks:
-                # A stacklog is saved each time the stack status changes,
-                # we only need to look at log entires with SUSPEND_COMPLETE
-                # status to get all records of active lab sessions with
-                # launch and suspend timestamps.
-                stacklog = StackLog.objects.filter(stack_id=stack.id
-                    ).filter(status="SUSPEND_COMPLETE")
-
-                # add up time spent on labs for one stack in seconds
-                time_spent = 0
-                for logentry in stacklog:
-                    time = (
-                        logentry.suspend_timestamp - logentry.launch_timestamp)
-                    time_spent += time.total_seconds()
-                total_time_spent += time_spent
+            total_time_spent = self.get_learner_lab_usage()
 
             if total_time_spent > lab_usage_limit:
                 policy = settings.get("lab_usage_limit_breach_policy",
@@ -181,7 +265,7 @@ class LaunchStackTask(HastexoTask):
 
                 if policy:
                     logger.error(
-                        f'Learner {stacks[0].learner.email} has gone over '
+                        f'Learner {stack.learner.email} has gone over '
                         'the lab usage limit!')
 
                 if policy == 'block':
@@ -194,9 +278,6 @@ class LaunchStackTask(HastexoTask):
                         "You've reached the time limit allocated to you "
                         "for using labs.")
 
-        # Get the stack
-        stack = Stack.objects.get(id=self.stack_id)
-
         # Initialize parameters
         self.protocol = stack.protocol
         self.port = stack.port
@@ -250,8 +331,25 @@ class LaunchStackTask(HastexoTask):
             raise ProviderException()
 
         try:
-            # Launch the stack and wait for it to complete.
-            stack_data = self.launch_stack(stack.provider)
+            try:
+                if "started" in kwargs:
+                    stack_data = self.check_launch(
+                        stack.provider,
+                        kwargs.get("step"),
+                        kwargs.get("was_resumed", False),
+                        kwargs.get("key_saved", False))
+                else:
+                    # Launch the stack and wait for it to complete.
+                    stack_data = self.launch_stack(stack.provider)
+            except LaunchStackPending as e:
+                if time.time() - start < timeout:
+                    kwargs.update(started=start, launch_timeout=timeout)
+                    self.launch_later(stack, e, **kwargs)
+                    return
+
+                error_msg = "Timeout launching stack [%s]." % self.stack_name
+                raise LaunchStackFailed(e.provider, LAUNCH_TIMEOUT, error_msg,
+                                        e.cleanup)
         except LaunchStackFailed as e:
             logger.error(e.error_msg)
 
@@ -280,6 +378,146 @@ class LaunchStackTask(HastexoTask):
             stack_data["error_msg"] = policy_warn_message
         self.update_stack(stack_data)
 
+    # If OperationalError is raised here, try again (max attempts = 3)
+    # Before every subsequent retry, wait
+    # Use before_sleep to close connection
+    # Use after_log to log attempts
+    # Reraise the exception from last attempt
+    @retry(retry=retry_if_exception_type(OperationalError),
+           stop=stop_after_attempt(3),
+           wait=wait_exponential(),
+           after=close_connection_on_retry,
+           before_sleep=before_sleep_log(logger, logging.WARNING),
+           reraise=True)
+    def get_learner_lab_usage(self):
+        """
+        Return the total time, in seconds, the learner has spent on labs
+        across the platform during the last 365 days.
+
+        Lab usage is accounted for in the per-learner daily ledger each time
+        a lab session closes, so this is a single indexed lookup that doesn't
+        depend on the size of the learner's history.
+
+        """
+        # don't look further than 365 days for lab launch
+        cutoff = timezone.now() - timezone.timedelta(days=365)
+
+        usage = LabUsage.objects.filter(
+            learner_id=self.learner_id,
+            date__gt=cutoff.date()
+        ).aggregate(total=Sum('seconds'))["total"]
+
+        return usage or 0
+
+    def launch_later(self, stack, e, **kwargs):
+        """
+        Run this task again to check on a pending launch.
+
+        """
+        key_saved = kwargs.get("key_saved", False)
+        if e.private_key:
+            # Keys generated by the provider only come back from the
+            # create call, so keep it for the following runs.
+            self.update_stack({"key": e.private_key})
+            key_saved = True
+
+        polls = 0
+        if e.operation == kwargs.get("step"):
+            polls = kwargs.get("polls", 0)
+
+        self.check_later(stack, e.operation, e.provider,
+                         started=kwargs["started"],
+                         polls=polls,
+                         step=e.operation,
+                         was_resumed=e.was_resumed,
+                         key_saved=key_saved,
+                         launch_task_id=kwargs["launch_task_id"],
+                         launch_timeout=kwargs["launch_timeout"],
+                         reset=self.reset,
+                         learner_id=self.learner_id,
+                         stack_key_type=self.stack_key_type)
+
+    def check_launch(self, provider_name, operation, was_resumed, key_saved):
+        """
+        Check on a launch left pending by an earlier run in non-blocking
+        mode, and carry on with it if the stack is ready.
+
+        """
+        provider = self.get_provider(provider_name)
+        if provider is None:
+            error_msg = ("Provider [%s] is no longer available to launch "
+                         "stack [%s] in." % (provider_name, self.stack_name))
+            raise LaunchStackFailed("", CREATE_FAILED, error_msg)
+
+        # The stack was changing state, or being reset, before this task got
+        # to it: start over, as launch_stack would.
+        if operation in ("wait", "delete"):
+            if self.reset:
+                self.try_provider(provider, True)
+                self.reset = False
+
+                return self.try_all_providers()
+
+            return self.try_provider(provider)
+
+        if was_resumed:
+            error_status = RESUME_FAILED
+            cleanup = CLEANUP_SUSPEND
+        else:
+            error_status = CREATE_FAILED
+            cleanup = CLEANUP_DELETE
+
+        try:
+            provider_stack = provider.get_stack(self.stack_name)
+        except ProviderException as e:
+            error_msg = ("Error retrieving [%s] stack information: %s" %
+                         (self.stack_name, e))
+            raise LaunchStackFailed(provider, error_status, error_msg,
+                                    cleanup)
+
+        status = provider_stack["status"]
+
+        # Servers may not have started right after a resume request.
+        if (IN_PROGRESS in status or
+                (operation == "resume" and status == SUSPEND_COMPLETE)):
+            raise LaunchStackPending(provider, operation, was_resumed,
+                                     cleanup=cleanup)
+
+        if FAILED in status or status == DELETE_COMPLETE:
+            error_msg = ("Stack [%s] failed to launch, with status [%s]." %
+                         (self.stack_name, status))
+            raise LaunchStackFailed(provider, error_status, error_msg,
+                                    cleanup)
+
+        if operation == "resume":
+            try:
+                provider.finish_resume(self.stack_name,
+                                       provider_stack["outputs"])
+            except ProviderException as e:
+                error_msg = ("Error resuming stack [%s]: %s" %
+                             (self.stack_name, e))
+                raise LaunchStackFailed(provider, RESUME_FAILED, error_msg,
+                                        CLEANUP_SUSPEND)
+
+        if key_saved:
+            provider_stack["private_key"] = self.stack_key
+
+        check_data = self.check_stack(provider_stack, was_resumed, provider,
+                                      ssh_checked=(operation == "rdp"))
+
+        return self.get_stack_data(provider, provider_stack, check_data)
+
+    def get_stack_data(self, provider, provider_stack, check_data):
+        return {
+            "status": provider_stack["status"],
+            "error_msg": "",
+            "ip": check_data["ip"],
+            "user": self.stack_user_name,
+            "key": check_data["key"],
+            "password": check_data["password"],
+            "provider": provider.name
+        }
+
     def get_provider(self, name):
         try:
             provider = next(p for p in self.providers if p.name == name)
@@ -301,6 +539,8 @@ class LaunchStackTask(HastexoTask):
             if self.reset:
                 self.try_provider(provider, True)
 
+                # Any later pending step is part of the new launch.
+                self.reset = False
                 stack_data = self.try_all_providers()
             else:
                 stack_data = self.try_provider(provider)
@@ -320,14 +560,31 @@ class LaunchStackTask(HastexoTask):
            after=close_connection_on_retry,
            before_sleep=before_sleep_log(logger, logging.WARNING),
            reraise=True)
-    def get_provider_stack_count(self, provider):
-        stack_count = Stack.objects.filter(
-            course_id__exact=self.course_id,
-            provider__exact=provider.name,
-            status__in=list(OCCUPANCY_STATES)
-        ).exclude(
-            name__exact=self.stack_name
-        ).count()
+    @transaction.atomic
+    def reserve_provider(self, provider):
+        """
+        Assign the stack to a provider, unless the provider is full.  The
+        provider's occupancy counter is locked meanwhile, so that concurrent
+        launches can't overshoot its capacity.  Returns the number of other
+        stacks in the provider.
+
+        """
+        stack = Stack.objects.select_for_update().get(id=self.stack_id)
+        ProviderOccupancy.objects.get_or_create(course_id=stack.course_id,
+                                                provider=provider.name)
+        occupancy = ProviderOccupancy.objects.select_for_update().get(
+            course_id=stack.course_id,
+            provider=provider.name
+        )
+
+        stack_count = occupancy.count
+        if stack.get_occupancy() == (stack.course_id, provider.name):
+            stack_count -= 1
+
+        if stack_count < provider.capacity:
+            stack.provider = provider.name
+            stack.save(update_fields=["provider"])
+
         return stack_count
 
     def try_all_providers(self):
@@ -335,13 +592,14 @@ class LaunchStackTask(HastexoTask):
 
         # Try launching the stack in all providers, in sequence
         for index, provider in enumerate(self.providers):
-            # Check if provider is full.  If it is, try the next one.
+            # Check if provider is full, reserving a slot in it if it isn't.
+            # If it is, try the next one.
             if provider.capacity == 0:
                 logger.info("Stack [%s]: provider [%s] is disabled." %
                             (self.stack_name, provider.name))
                 continue
             elif provider.capacity > 0:
-                stack_count = self.get_provider_stack_count(provider)
+                stack_count = self.reserve_provider(provider)
                 if stack_count >= provider.capacity:
                     logger.info("Stack [%s]: provider [%s] is full, "
                                 "with capacity [%d/%d]." %
@@ -388,9 +646,9 @@ class LaunchStackTask(HastexoTask):
         stack: just delete it.
 
         """
-        error_msg = ""
         was_resumed = False
         stack_data = {}
+        nowait = {"wait": False} if self.nonblocking else {}
 
         if not reset:
             logger.info("Trying to launch stack [%s] on provider [%s]." %
@@ -415,6 +673,9 @@ class LaunchStackTask(HastexoTask):
         # finishes.
         try:
             while IN_PROGRESS in provider_stack["status"]:
+                if self.nonblocking:
+                    raise LaunchStackPending(provider, "wait")
+
                 try:
                     # Sleep to avoid throttling.
                     self.sleep()
@@ -442,7 +703,10 @@ class LaunchStackTask(HastexoTask):
                     self.sleep()
 
                     logger.info("Resetting stack [%s]." % self.stack_name)
-                    provider_stack = provider.delete_stack(self.stack_name)
+                    provider_stack = provider.delete_stack(self.stack_name,
+                                                           **nowait)
+                    if IN_PROGRESS in provider_stack["status"]:
+                        raise LaunchStackPending(provider, "delete")
             except ProviderException as e:
                 error_msg = ("Error deleting stack [%s]: %s" %
                              (self.stack_name, e))
@@ -461,7 +725,13 @@ class LaunchStackTask(HastexoTask):
                     provider_stack = provider.create_stack(
                         self.stack_name,
                         self.stack_run,
-                        key_type=self.stack_key_type)
+                        key_type=self.stack_key_type,
+                        **nowait)
+                    if IN_PROGRESS in provider_stack["status"]:
+                        raise LaunchStackPending(
+                            provider, "create",
+                            private_key=provider_stack.get("private_key"),
+                            cleanup=CLEANUP_DELETE)
 
             except ProviderException as e:
                 error_msg = ("Error creating stack [%s]: %s" %
@@ -484,7 +754,11 @@ class LaunchStackTask(HastexoTask):
                     self.sleep()
 
                     logger.info("Resuming stack [%s]." % self.stack_name)
-                    provider_stack = provider.resume_stack(self.stack_name)
+                    provider_stack = provider.resume_stack(self.stack_name,
+                                                           **nowait)
+                    if IN_PROGRESS in provider_stack["status"]:
+                        raise LaunchStackPending(provider, "resume", True,
+                                                 cleanup=CLEANUP_SUSPEND)
             except ProviderException as e:
                 error_msg = ("Error resuming stack [%s]: %s" %
                              (self.stack_name, e))
@@ -510,15 +784,8 @@ class LaunchStackTask(HastexoTask):
                 raise LaunchStackFailed(provider, LAUNCH_TIMEOUT, error_msg,
                                         cleanup)
 
-            stack_data = {
-                "status": provider_stack["status"],
-                "error_msg": error_msg,
-                "ip": check_data["ip"],
-                "user": self.stack_user_name,
-                "key": check_data["key"],
-                "password": check_data["password"],
-                "provider": provider.name
-            }
+            stack_data = self.get_stack_data(provider, provider_stack,
+                                             check_data)
 
         return stack_data
 
@@ -548,18 +815,22 @@ class LaunchStackTask(HastexoTask):
                                      self.stack_name, e))
 
     def wait_for_ssh(self, stack_key, stack_ip, was_resumed, provider):
+        # Don't reuse connections made before the stack was suspended.
+        ssh_pool.discard(stack_ip)
+        if was_resumed:
+            error_status = RESUME_FAILED
+            cleanup = CLEANUP_SUSPEND
+        else:
+            error_status = CREATE_FAILED
+            cleanup = CLEANUP_DELETE
+
+        attempts = {"attempts": 1} if self.nonblocking else {}
         try:
-            ssh = ssh_to(self.stack_user_name, stack_ip, stack_key)
+            ssh = ssh_to(self.stack_user_name, stack_ip, stack_key,
+                         **attempts)
         except SoftTimeLimitExceeded:
             raise
         except Exception:
-            if was_resumed:
-                error_status = RESUME_FAILED
-                cleanup = CLEANUP_SUSPEND
-            else:
-                error_status = CREATE_FAILED
-                cleanup = CLEANUP_DELETE
-
             logger.error("Exception when checking SSH connection to stack "
                          "[%s]: %s" % (self.stack_name,
                                        traceback.format_exc()))
@@ -568,15 +839,25 @@ class LaunchStackTask(HastexoTask):
             raise LaunchStackFailed(provider, error_status, error_msg,
                                     cleanup)
 
+        if ssh is None:
+            raise LaunchStackPending(provider, "ssh", was_resumed,
+                                     cleanup=cleanup)
+
         return ssh
 
-    def wait_for_rdp(self, stack_ip):
+    def wait_for_rdp(self, stack_ip, attempts=None):
+        """
+        Wait until the stack accepts RDP connections, or until the given
+        number of attempts fail.  Returns whether it does.
+
+        """
         port = getattr(self, 'port', None)
         if not port:
             port = 3389
 
         connected = False
         conn = None
+        attempt = 0
         while not connected:
             try:
                 conn = socket.create_connection((stack_ip, port),
@@ -584,6 +865,9 @@ class LaunchStackTask(HastexoTask):
             except SoftTimeLimitExceeded:
                 raise
             except Exception:
+                attempt += 1
+                if attempts and attempt >= attempts:
+                    break
                 self.sleep()
             else:
                 connected = True
@@ -591,12 +875,15 @@ class LaunchStackTask(HastexoTask):
                 if conn:
                     conn.close()
 
-    def check_stack(self, provider_stack, was_resumed, provider):
+        return connected
+
+    def check_stack(self, provider_stack, was_resumed, provider,
+                    ssh_checked=False):
         """
         Fetch stack outputs, check that the stack has a public IP address, a
         private key, and is network accessible after rebooting any servers.
         Save its private key, and check that it is possible to SSH into the
-        stack using it.
+        stack using it, unless an earlier run already did.
 
         """
         stack_ip = None
@@ -618,50 +905,56 @@ class LaunchStackTask(HastexoTask):
             stack_key = provider_stack.get("private_key") or \
                 provider_stack["outputs"].get("private_key")
 
-        if stack_ip is None or not stack_key:
-            if was_resumed:
-                error_status = RESUME_FAILED
-                cleanup = CLEANUP_SUSPEND
-            else:
-                error_status = CREATE_FAILED
-                cleanup = CLEANUP_DELETE
+        if was_resumed:
+            error_status = RESUME_FAILED
+            cleanup = CLEANUP_SUSPEND
+        else:
+            error_status = CREATE_FAILED
+            cleanup = CLEANUP_DELETE
 
+        if stack_ip is None or not stack_key:
             error_msg = ("Stack [%s] did not provide "
                          "IP or private key." % self.stack_name)
             raise LaunchStackFailed(provider, error_status, error_msg, cleanup)
 
-        # Now wait until environment is fully provisioned.  One of the
-        # requirements for the Heat template is for it to disallow SSH
-        # access to the training user while provisioning is going on.
-        logger.info("Checking SSH connection "
-                    "for stack [%s] at [%s]" % (self.stack_name, stack_ip))
-        ssh = self.wait_for_ssh(stack_key, stack_ip, was_resumed, provider)
+        if not ssh_checked:
+            # Now wait until environment is fully provisioned.  One of the
+            # requirements for the Heat template is for it to disallow SSH
+            # access to the training user while provisioning is going on.
+            logger.info("Checking SSH connection for stack [%s] at [%s]" %
+                        (self.stack_name, stack_ip))
+            ssh = self.wait_for_ssh(stack_key, stack_ip, was_resumed,
+                                    provider)
 
-        try:
-            # If we're resuming and there's a resume hook, execute it.
-            if (was_resumed and
-                    self.hook_script and
-                    self.hook_events and
-                    isinstance(self.hook_events, dict) and
-                    self.hook_events.get("resume", False)):
-                logger.info("Executing post-resume hook for stack [%s] "
-                            "at [%s]" % (self.stack_name, stack_ip))
-                try:
-                    remote_exec(ssh, self.hook_script, params="resume")
-                except Exception as e:
-                    # We don't fail, as the user may have inadvertently broken
-                    # the stack.
-                    logger.error("Error running resume hook script on stack "
-                                 "[%s]: %s" % (self.stack_name, str(e)))
-        finally:
-            ssh.close()
+            try:
+                # If we're resuming and there's a resume hook, execute it.
+                if (was_resumed and
+                        self.hook_script and
+                        self.hook_events and
+                        isinstance(self.hook_events, dict) and
+                        self.hook_events.get("resume", False)):
+                    logger.info("Executing post-resume hook for stack [%s] "
+                                "at [%s]" % (self.stack_name, stack_ip))
+                    try:
+                        remote_exec(ssh, self.hook_script, params="resume")
+                    except Exception as e:
+                        # We don't fail, as the user may have inadvertently
+                        # broken the stack.
+                        logger.error("Error running resume hook script on "
+                                     "stack [%s]: %s" % (self.stack_name,
+                                                         str(e)))
+            finally:
+                ssh.close()
 
         # If the protocol is RDP, wait for xrdp to come up.
         protocol = getattr(self, 'protocol', None)
         if protocol and protocol == "rdp":
             logger.info("Checking RDP connection "
                         "for stack [%s] at [%s]" % (self.stack_name, stack_ip))
-            self.wait_for_rdp(stack_ip)
+            attempts = 1 if self.nonblocking else None
+            if not self.wait_for_rdp(stack_ip, attempts):
+                raise LaunchStackPending(provider, "rdp", was_resumed,
+                                         cleanup=cleanup)
 
         check_data = {
             "ip": stack_ip,
@@ -687,17 +980,42 @@ class SuspendStackTask(HastexoTask):
         stack = Stack.objects.get(id=self.stack_id)
         self.stack_name = stack.name
 
+        # In non-blocking mode, don't wait for the suspension to finish, but
+        # check on it in subsequent runs, which are passed the start time.
+        settings = get_xblock_settings()
+        nonblocking = (settings.get("provider_nonblocking", False) or
+                       "started" in kwargs)
+        timeout = settings.get("suspend_task_timeout", 900)
+        start = kwargs.get("started", time.time())
+
+        throttled = False
         try:
-            status = self.suspend_stack(stack)
+            if "started" in kwargs:
+                status = self.get_provider_stack_status(stack)
+            else:
+                status = self.suspend_stack(stack, wait=not nonblocking)
+
+            # Only keep track of a suspension this task started.
+            if nonblocking and status == SUSPEND_IN_PROGRESS:
+                if time.time() - start < timeout:
+                    self.check_later(stack, "suspend", started=start,
+                                     polls=kwargs.get("polls", 0))
+                    return
+
+                raise Exception("Timeout waiting for the stack to suspend.")
         except Exception as e:
             error_msg = "Error suspending stack [%s]: %s" % (
                 self.stack_name,
                 str(e))
             logger.error(error_msg)
             status = SUSPEND_FAILED
+            throttled = isinstance(e, ProviderException) and e.throttled
         else:
             error_msg = ""
 
+        # Let the suspender know how the provider is coping.
+        record_suspend_time(stack.provider, time.time() - start, throttled)
+
         # The suspender doesn't check task results, so just save status in the
         # database.
         stack_data = {
@@ -711,7 +1029,7 @@ class SuspendStackTask(HastexoTask):
 
         self.update_stack(stack_data)
 
-    def suspend_stack(self, stack):
+    def suspend_stack(self, stack, wait=True):
         provider = Provider.init(stack.provider)
         provider.set_logger(logger)
         provider_stack = provider.get_stack(stack.name)
@@ -730,7 +1048,8 @@ class SuspendStackTask(HastexoTask):
                                                     stack.hook_script)
                     logger.info("SSHing into stack [%s] at [%s]."
                                 % (stack.name, stack.ip))
-                    ssh = ssh_to(stack.user, stack.ip, stack.key)
+                    ssh = ssh_pool.get(stack.user, stack.ip, stack.key,
+                                       ssh_to)
                     logger.info("Executing pre-suspend hook for stack [%s]."
                                 % stack.name)
                     remote_exec(ssh, script, params="suspend")
@@ -742,11 +1061,12 @@ class SuspendStackTask(HastexoTask):
                                  "[%s]: %s" % (stack.name, error_msg))
                 finally:
                     if ssh:
-                        ssh.close()
+                        ssh_pool.release(ssh)
 
             # Suspend stack
+            ssh_pool.discard(stack.ip)
             logger.info("Suspending stack [%s]." % stack.name)
-            provider_stack = provider.suspend_stack(stack.name)
+            provider_stack = provider.suspend_stack(stack.name, wait=wait)
         else:
             logger.error("Cannot suspend stack with status [%s]." %
                          provider_stack["status"])
@@ -769,8 +1089,34 @@ class DeleteStackTask(HastexoTask):
         stack = Stack.objects.get(id=self.stack_id)
         self.stack_name = stack.name
 
+        # In non-blocking mode, don't wait for the deletion to finish, but
+        # check on it in subsequent runs, which are passed the start time and
+        # the current attempt.
+        settings = get_xblock_settings()
+        nonblocking = (settings.get("provider_nonblocking", False) or
+                       "started" in kwargs)
+        timeout = settings.get("delete_task_timeout", 900)
+        start = kwargs.get("started", time.time())
+        attempt = kwargs.get("attempt", 0)
+
         try:
-            status = self.delete_stack(stack)
+            if "started" in kwargs:
+                status = self.get_provider_stack_status(stack)
+                if FAILED in status:
+                    attempt += 1
+                    status = self.delete_stack(stack, False, attempt)
+            else:
+                status = self.delete_stack(stack, not nonblocking)
+
+            if nonblocking and status == DELETE_IN_PROGRESS:
+                if time.time() - start < timeout:
+                    self.check_later(stack, "delete", started=start,
+                                     polls=kwargs.get("polls", 0),
+                                     attempt=attempt)
+                    return
+
+                raise Exception("Timeout waiting for the stack to be "
+                                "deleted.")
         except Exception as e:
             status = DELETE_FAILED
             provider = stack.provider
@@ -791,9 +1137,9 @@ class DeleteStackTask(HastexoTask):
         }
         self.update_stack(stack_data)
 
-    def delete_stack(self, stack):
+    def delete_stack(self, stack, wait=True, attempt=0):
         """
-        Delete the stack.
+        Delete the stack, starting at the given attempt.
 
         """
         settings = get_xblock_settings()
@@ -801,11 +1147,11 @@ class DeleteStackTask(HastexoTask):
         provider = Provider.init(stack.provider)
         provider.set_logger(logger)
         provider_stack = provider.get_stack(stack.name)
-        attempt = 0
+        first_attempt = attempt
 
         while (provider_stack["status"] != DELETE_COMPLETE and
                attempt < attempts):
-            if attempt:
+            if attempt > first_attempt:
                 self.sleep()
 
             if provider_stack["status"] != DELETE_IN_PROGRESS:
@@ -841,7 +1187,8 @@ class DeleteStackTask(HastexoTask):
                         try:
                             script = read_from_contentstore(stack.course_id,
                                                             stack.hook_script)
-                            ssh = ssh_to(stack.user, stack.ip, stack.key)
+                            ssh = ssh_pool.get(stack.user, stack.ip,
+                                               stack.key, ssh_to)
                             remote_exec(ssh, script, params="delete")
                         except Exception as e:
                             # Again, we don't fail, as deleting the stack is
@@ -851,10 +1198,14 @@ class DeleteStackTask(HastexoTask):
                                          (stack.name, str(e)))
                         finally:
                             if ssh:
-                                ssh.close()
+                                ssh_pool.release(ssh)
+
+                if stack.ip:
+                    ssh_pool.discard(stack.ip)
 
                 try:
-                    provider_stack = provider.delete_stack(stack.name)
+                    provider_stack = provider.delete_stack(stack.name,
+                                                           wait=wait)
                 except SoftTimeLimitExceeded:
                     # Retry on any exception except a timeout.
                     raise
@@ -892,12 +1243,13 @@ class CheckStudentProgressTask(HastexoTask):
 
         ssh = None
         try:
-            # Open SSH connection to the public facing node
-            ssh = ssh_to(self.stack_user_name,
-                         self.stack_ip,
-                         self.stack_key)
+            # Open SSH connection to the public facing node, or reuse one
+            ssh = ssh_pool.get(self.stack_user_name,
+                               self.stack_ip,
+                               self.stack_key,
+                               ssh_to)
             # Run tests on the stack
-            res = self.run_tests(ssh)
+            res = self.run_tests(ssh, kwargs.get("tests_parallel", False))
         except (RemoteExecTimeout, SoftTimeLimitExceeded):
             res = {
                 'status': 'CHECK_PROGRESS_TIMEOUT',
@@ -905,12 +1257,20 @@ class CheckStudentProgressTask(HastexoTask):
             }
         finally:
             if ssh:
-                # Close the connection
-                ssh.close()
+                # Close the connection, unless it's pooled
+                ssh_pool.release(ssh)
 
         return res
 
-    def run_tests(self, ssh):
+    def run_tests(self, ssh, parallel=False):
+        settings = get_xblock_settings()
+        if settings.get("check_batched", False):
+            return self.run_tests_batched(ssh)
+
+        concurrency = settings.get("check_concurrency", 4)
+        if parallel and concurrency > 1 and len(self.tests) > 1:
+            return self.run_tests_parallel(ssh, concurrency)
+
         sftp = ssh.open_sftp()
 
         # Write scripts out, run them, and keep score.
@@ -939,6 +1299,92 @@ class CheckStudentProgressTask(HastexoTask):
             'errors': errors
         }
 
+    def run_tests_parallel(self, ssh, concurrency):
+        """
+        Run independent tests concurrently, each in its own channel of the
+        SSH connection, and keep score.  SFTP sessions aren't thread-safe,
+        so each thread opens its own.
+
+        """
+        local = threading.local()
+        sessions = []
+        lock = threading.Lock()
+
+        def run_test(test):
+            if not hasattr(local, "sftp"):
+                local.sftp = ssh.open_sftp()
+                with lock:
+                    sessions.append(local.sftp)
+
+            try:
+                remote_exec(ssh, test, reuse_sftp=local.sftp)
+            except RemoteExecException as e:
+                return e
+            return None
+
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            results = list(executor.map(run_test, self.tests))
+        except Exception:
+            # Don't wait for the tests that are still running, for example
+            # when the task hit its soft time limit.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        else:
+            executor.shutdown()
+        finally:
+            for sftp in sessions:
+                sftp.close()
+
+        score = 0
+        errors = []
+        for result in results:
+            if result is None:
+                score += 1
+            elif isinstance(result, RemoteExecTimeout):
+                logger.warning("Timeout when running test: %s" % result)
+                raise result
+            else:
+                msg = result.args[0]
+                hint = msg.decode() if isinstance(msg, bytes) else str(msg)
+                if hint:
+                    errors.append(hint)
+
+        return {
+            'status': 'CHECK_PROGRESS_COMPLETE',
+            'pass': score,
+            'total': len(self.tests),
+            'errors': errors
+        }
+
+    def run_tests_batched(self, ssh):
+        """
+        Run all tests in a single remote execution, and keep score.
+
+        """
+        try:
+            results = remote_exec_batch(ssh, self.tests)
+        except RemoteExecTimeout as e:
+            logger.warning("Timeout when running tests: %s" % e)
+            raise
+
+        score = 0
+        errors = []
+        for retval, stderr in results:
+            if retval == 0:
+                score += 1
+            else:
+                hint = stderr.decode()
+                if hint:
+                    errors.append(hint)
+
+        return {
+            'status': 'CHECK_PROGRESS_COMPLETE',
+            'pass': score,
+            'total': len(self.tests),
+            'errors': errors
+        }
+
 
 LaunchStackTask = current_app.register_task(LaunchStackTask())
 SuspendStackTask = current_app.register_task(SuspendStackTask())
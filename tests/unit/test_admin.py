@@ -21,7 +21,7 @@ try:
 except RuntimeError:
     from student.models import AnonymousUserId
 from hastexo.admin import StackAdmin
-from hastexo.models import Stack, StackLog
+from hastexo.models import ProviderOccupancy, Stack, StackLog
 
 
 class TestHastexoStackAdmin(TestCase):
@@ -108,6 +108,11 @@ class TestHastexoStackAdmin(TestCase):
         self.assertEqual(stack.status, "DELETE_COMPLETE")
         self.assertEqual(stack.provider, "")
 
+        # The stack no longer takes up a slot in the provider
+        occupancy = ProviderOccupancy.objects.get(course_id=self.course_id,
+                                                  provider=self.provider)
+        self.assertEqual(occupancy.count, 0)
+
     def test_name_in_changelist(self):
         response = self.client.get(reverse('admin:hastexo_stack_changelist'))
         self.assertContains(response, self.stack_name)
@@ -146,6 +151,11 @@ class TestHastexoStackAdmin(TestCase):
         self.assertEqual(stack.status, "DELETE_COMPLETE")
         self.assertEqual(stack.provider, "")
 
+        # The stack no longer takes up a slot in the provider
+        occupancy = ProviderOccupancy.objects.get(course_id=self.course_id,
+                                                  provider=self.provider)
+        self.assertEqual(occupancy.count, 0)
+
     def test_clear_stacklog(self):
         stack = Stack.objects.get(pk=self.stack.id)
         stack.status = 'CREATE_IN_PROGRESS'
@@ -1,5 +1,14 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.utils import timezone
+
+from hastexo.common import record_polls
+from hastexo.models import LabUsage, Stack, StackLog
 
 try:
     from unittest.mock import patch
@@ -19,6 +28,33 @@ class SuspenderTestCase(TestCase):
         # Did we create a new suspender job?
         self.assertEqual(mock_suspender.call_count, 1)
 
+    @patch('hastexo.management.commands.suspender.BlockingScheduler')
+    @patch('hastexo.management.commands.suspender.get_xblock_settings')
+    @patch('hastexo.management.commands.suspender.SuspenderJob')
+    def test_start_suspender_scheduler(self, mock_suspender, mock_settings,
+                                       mock_scheduler):
+        mock_settings.return_value = {"suspend_scheduler": True}
+        call_command('suspender')
+
+        # Did we run the scheduler instead of an interval job?
+        mock_suspender.return_value.run_scheduler.assert_called_once_with()
+        mock_scheduler.assert_not_called()
+
+    @patch('hastexo.management.commands.suspender.BlockingScheduler')
+    @patch('hastexo.management.commands.suspender.get_xblock_settings')
+    @patch('hastexo.management.commands.suspender.SuspenderJob')
+    def test_start_suspender_shard(self, mock_suspender, mock_settings,
+                                   mock_scheduler):
+        mock_settings.return_value = {}
+        call_command('suspender', shard='1/3')
+
+        # Did we create a suspender job for the shard?
+        mock_suspender.assert_called_once_with({}, (1, 3))
+
+    def test_start_suspender_invalid_shard(self):
+        with self.assertRaises(CommandError):
+            call_command('suspender', shard='3/3')
+
 
 class ReaperTestCase(TestCase):
 
@@ -29,3 +65,93 @@ class ReaperTestCase(TestCase):
 
         # Did we create a new reaper job?
         self.assertEqual(mock_reaper.call_count, 1)
+
+    @patch('hastexo.management.commands.reaper.BlockingScheduler')
+    @patch('hastexo.management.commands.reaper.get_xblock_settings')
+    @patch('hastexo.management.commands.reaper.ReaperJob')
+    def test_start_reaper_shard(self, mock_reaper, mock_settings,
+                                mock_scheduler):
+        mock_settings.return_value = {}
+        call_command('reaper', shard='0/2')
+
+        # Did we create a reaper job for the shard?
+        mock_reaper.assert_called_once_with({}, (0, 2))
+
+
+class ProviderPollsTestCase(TestCase):
+
+    @patch('hastexo.management.commands.provider_polls.get_xblock_settings')
+    def test_provider_polls(self, mock_settings):
+        mock_settings.return_value = {"providers": {"provider1": {},
+                                                    "provider2": {}}}
+        cache.clear()
+        record_polls("provider1", "create", operations=2, polls=10,
+                     seconds=100)
+        record_polls("provider1", "suspend", operations=1, polls=3,
+                     seconds=6)
+
+        out = StringIO()
+        call_command('provider_polls', stdout=out)
+
+        self.assertEqual(out.getvalue().splitlines(), [
+            "provider1 create: 2 operations, 5.0 polls and 50.0 seconds "
+            "waited per operation.",
+            "provider1 suspend: 1 operations, 3.0 polls and 6.0 seconds "
+            "waited per operation.",
+        ])
+
+
+class BackfillLabUsageTestCase(TestCase):
+
+    def test_backfill_lab_usage(self):
+        now = timezone.now().replace(hour=12)
+        learner = User.objects.create_user("fake_user",
+                                           "user@example.com",
+                                           "password")
+        stack = Stack.objects.create(student_id="bogus_student_id",
+                                     course_id="bogus_course_id",
+                                     name="bogus_stack_name",
+                                     learner=learner)
+        for days, seconds in ((0, 60), (0, 120), (1, 300)):
+            StackLog.objects.create(
+                stack_id=stack.id,
+                status="SUSPEND_COMPLETE",
+                launch_timestamp=now - timezone.timedelta(days=days,
+                                                          seconds=seconds),
+                suspend_timestamp=now - timezone.timedelta(days=days))
+
+        # Other states and stale ledger entries are ignored
+        StackLog.objects.create(
+            stack_id=stack.id,
+            status="RESUME_COMPLETE",
+            launch_timestamp=now - timezone.timedelta(seconds=1000),
+            suspend_timestamp=now)
+        LabUsage.objects.create(learner=learner,
+                                date=now.date(),
+                                seconds=9999)
+
+        out = StringIO()
+        call_command('backfill_lab_usage', stdout=out)
+
+        usage = LabUsage.objects.filter(learner=learner).order_by('date')
+        self.assertEqual(len(usage), 2)
+        self.assertEqual(usage[0].seconds, 300)
+        self.assertEqual(usage[1].seconds, 180)
+        self.assertIn("2 learner days", out.getvalue())
+
+    def test_backfill_lab_usage_without_timestamps(self):
+        learner = User.objects.create_user("fake_user",
+                                           "user@example.com",
+                                           "password")
+        LabUsage.objects.create(learner=learner,
+                                date=timezone.now().date(),
+                                seconds=60)
+
+        # The stack log doesn't record the session timestamps, so the
+        # ledger is left alone.
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"stacklog_fields": ["provider", "ip"]}):
+            with self.assertRaises(CommandError):
+                call_command('backfill_lab_usage', stdout=StringIO())
+
+        self.assertEqual(LabUsage.objects.get(learner=learner).seconds, 60)
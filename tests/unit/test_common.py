@@ -1,6 +1,8 @@
+import base64
 import ddt
 import errno
 
+from django.core.cache import cache
 from django.test import TestCase
 from unittest.mock import Mock, patch
 from pymongo.errors import (
@@ -10,14 +12,24 @@ from pymongo.errors import (
     ServerSelectionTimeoutError,
 )
 from hastexo.common import (
+    LRUCache,
+    SSHPool,
+    get_private_key,
+    get_private_key_types,
+    get_suspend_times,
+    private_keys,
     read_from_contentstore,
+    record_suspend_time,
     ssh_to,
     remote_exec,
+    remote_exec_batch,
     RemoteExecException,
     RemoteExecTimeout,
     _
 )
 
+from paramiko import RSAKey, Ed25519Key
+from paramiko.ssh_exception import SSHException
 from socket import timeout as SocketTimeout
 
 RETRY_SOCKET_ERRNOS = [
@@ -40,6 +52,7 @@ class TestHastexoCommon(TestCase):
         self.settings = {
             "sleep_timeout": 0,
             "remote_exec_timeout": 0.1,
+            "ssh_pool_size": 16,
         }
 
         patchers = {
@@ -54,6 +67,8 @@ class TestHastexoCommon(TestCase):
             self.mocks[mock_name] = patcher.start()
             self.addCleanup(patcher.stop)
 
+        private_keys.clear()
+
     def test_read_from_contentstore(self):
         # Setup
         asset_mock = Mock()
@@ -153,6 +168,67 @@ class TestHastexoCommon(TestCase):
                                                 pkey="pkey",
                                                 timeout=10)
 
+    def test_ssh_to_caches_key(self):
+        # Setup
+        with patch("paramiko.RSAKey.from_private_key") as get_key:
+            get_key.return_value = "pkey"
+
+            # Run
+            ssh_to("user", "ip", u"key")
+            ssh_to("user", "ip2", u"key")
+
+            # Assert
+            get_key.assert_called_once()
+            ssh_mock = self.mocks["paramiko"].SSHClient.return_value
+            ssh_mock.connect.assert_called_with("ip2",
+                                                username="user",
+                                                pkey="pkey",
+                                                timeout=10)
+
+    def test_get_private_key_falls_back(self):
+        # Setup
+        with patch("paramiko.RSAKey.from_private_key") as get_rsa_key, \
+                patch("paramiko.Ed25519Key.from_private_key") as get_ed_key:
+            get_rsa_key.side_effect = SSHException("not an RSA key")
+            get_ed_key.return_value = "pkey"
+
+            # Run
+            pkey = get_private_key(u"key")
+
+            # Assert
+            self.assertEqual(pkey, "pkey")
+            self.assertEqual(get_private_key(u"key"), "pkey")
+            get_rsa_key.assert_called_once()
+            get_ed_key.assert_called_once()
+
+    def test_get_private_key_invalid(self):
+        # Run
+        pkey = get_private_key(u"key")
+
+        # Assert
+        self.assertIsNone(pkey)
+        self.assertEqual(len(private_keys), 0)
+        self.assertIsNone(get_private_key(None))
+
+    @ddt.data(
+        ("RSA", b"", (RSAKey,)),
+        ("OPENSSH", b"openssh-key-v1\x00ssh-ed25519", (Ed25519Key,)),
+        ("OPENSSH", b"openssh-key-v1\x00ssh-rsa", (RSAKey,)),
+        ("OPENSSH", b"openssh-key-v1\x00ecdsa", (RSAKey, Ed25519Key)),
+        ("EC", b"", (RSAKey, Ed25519Key)),
+    )
+    @ddt.unpack
+    def test_get_private_key_types(self, header, body, key_types):
+        # Setup
+        key = "-----BEGIN %s PRIVATE KEY-----\n%s\n-----END %s PRIVATE " \
+              "KEY-----\n" % (header, base64.b64encode(body).decode(), header)
+
+        # Run
+        types = get_private_key_types(key)
+
+        # Assert
+        self.assertEqual(types, key_types)
+
     def test_ssh_to_retries(self):
         # Setup
         ssh_mock = Mock()
@@ -255,6 +331,8 @@ class TestHastexoCommon(TestCase):
         ssh_mock.open_sftp.return_value = sftp_mock
         stdout_mock = Mock()
         stdout_mock.channel.exit_status_ready.return_value = False
+        stdout_mock.channel.recv_ready.return_value = False
+        stdout_mock.channel.recv_stderr_ready.return_value = False
         ssh_mock.exec_command.return_value = (None, stdout_mock, None)
 
         # Run
@@ -263,6 +341,36 @@ class TestHastexoCommon(TestCase):
 
         sftp_mock.remove.assert_called()
 
+    def test_remote_exec_reads_output(self):
+        # Setup
+        ssh_mock = Mock()
+        sftp_mock = Mock()
+        ssh_mock.open_sftp.return_value = sftp_mock
+        channel_mock = Mock()
+        channel_mock.exit_status_ready.side_effect = [False, False, True]
+        channel_mock.recv_ready.side_effect = [True, True, False, False]
+        channel_mock.recv_stderr_ready.side_effect = [True, False, False]
+        channel_mock.recv_stderr.return_value = b"first error, "
+        channel_mock.recv_exit_status.return_value = 1
+        stdout_mock = Mock()
+        stdout_mock.channel = channel_mock
+        stderr_mock = Mock()
+        stderr_mock.read.return_value = b"last error"
+        ssh_mock.exec_command.return_value = (None, stdout_mock, stderr_mock)
+
+        # Run
+        with patch("hastexo.common.time.sleep") as mock_sleep:
+            with self.assertRaises(RemoteExecException) as cm:
+                remote_exec(ssh_mock, "script")
+
+        # Assert
+        # Output is read while the script runs, and completion is waited
+        # for on the channel, instead of by sleeping.
+        self.assertEqual(channel_mock.recv.call_count, 2)
+        self.assertEqual(cm.exception.args[0], b"first error, last error")
+        self.assertEqual(channel_mock.status_event.wait.call_count, 2)
+        mock_sleep.assert_not_called()
+
     def test_remote_exec_reuse_sftp(self):
         # Setup
         ssh_mock = Mock()
@@ -301,7 +409,276 @@ class TestHastexoCommon(TestCase):
 
         sftp_mock.remove.assert_called()
 
+    def test_remote_exec_output(self):
+        # Setup
+        ssh_mock = Mock()
+        channel_mock = Mock()
+        channel_mock.exit_status_ready.side_effect = [False, True]
+        channel_mock.recv_ready.side_effect = [True, False]
+        channel_mock.recv_stderr_ready.return_value = False
+        channel_mock.recv.return_value = b"first, "
+        channel_mock.recv_exit_status.return_value = 0
+        stdout_mock = Mock()
+        stdout_mock.channel = channel_mock
+        stdout_mock.read.return_value = b"last"
+        ssh_mock.exec_command.return_value = (None, stdout_mock, None)
+        output = []
+
+        # Run
+        retval = remote_exec(ssh_mock, "script", output=output)
+
+        # Assert
+        self.assertEqual(0, retval)
+        self.assertEqual(b"".join(output), b"first, last")
+
+    def test_remote_exec_batch(self):
+        # Setup
+        self.mocks["uuid"].uuid4.return_value.hex = "predictable"
+        scripts = [
+            "#!/bin/bash\nexit 0",
+            "#!/usr/bin/env python3\nimport sys\nsys.exit(1)\n"
+        ]
+
+        def mock_remote_exec(ssh, script, reuse_sftp=None, output=None,
+                             timeout=None):
+            output.append(b"0 0 0\n1 1 ")
+            output.append(b"   13\nline 1\nline 2")
+            return 0
+
+        # Run
+        with patch("hastexo.common.remote_exec") as mock_exec:
+            mock_exec.side_effect = mock_remote_exec
+            results = remote_exec_batch(Mock(), scripts)
+
+        # Assert
+        self.assertEqual(results, [(0, b""), (1, b"line 1\nline 2")])
+        bundle = mock_exec.call_args[0][1]
+        self.assertTrue(bundle.startswith("#!/bin/sh\n"))
+        self.assertIn("<<'HASTEXO_predictable'\n%s\nHASTEXO_predictable\n" %
+                      scripts[0], bundle)
+        self.assertIn("<<'HASTEXO_predictable'\n%sHASTEXO_predictable\n" %
+                      scripts[1], bundle)
+        self.assertIn("for i in 0 1; do", bundle)
+        # The scripts share one time limit, of remote_exec_timeout each.
+        self.assertEqual(mock_exec.call_args[1]["timeout"], 0.2)
+
+    def test_remote_exec_batch_incomplete(self):
+        # Setup
+        def mock_remote_exec(ssh, script, reuse_sftp=None, output=None,
+                             timeout=None):
+            output.append(b"0 0 0\n")
+            return 0
+
+        # Run
+        with patch("hastexo.common.remote_exec") as mock_exec:
+            mock_exec.side_effect = mock_remote_exec
+            with self.assertRaises(RemoteExecException):
+                remote_exec_batch(Mock(), ["script 1", "script 2"])
+
     def test__(self):
         test_string = 'string to be translated'
         string = _(test_string)
         self.assertEqual(test_string, string)
+
+    def test_lru_cache(self):
+        # Setup
+        lru = LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+
+        # Run
+        # Using "a" makes "b" the least recently used entry.
+        self.assertEqual(lru.get("a"), 1)
+        lru.set("c", 3)
+
+        # Assert
+        self.assertEqual(len(lru), 2)
+        self.assertIn("a", lru)
+        self.assertNotIn("b", lru)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("c"), 3)
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+    def test_suspend_times(self):
+        # Setup
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        # Run
+        with patch("hastexo.common.SUSPEND_TIMES_LENGTH", 3):
+            with patch("hastexo.common.time.time") as mock_time:
+                for i in range(4):
+                    mock_time.return_value = 1000 + i
+                    record_suspend_time("provider1", i, throttled=(i == 3))
+            samples = get_suspend_times("provider1")
+            recent = get_suspend_times("provider1", since=1002)
+
+        # Assert
+        # Only the last samples are kept, oldest first.
+        self.assertEqual(samples, [(1001, 1, False), (1002, 2, False),
+                                   (1003, 3, True)])
+        self.assertEqual(recent, [(1003, 3, True)])
+        self.assertEqual(get_suspend_times("provider2"), [])
+
+    def test_suspend_times_counter_evicted(self):
+        # Setup
+        cache.clear()
+        self.addCleanup(cache.clear)
+        record_suspend_time("provider1", 5)
+
+        # Run
+        with patch("hastexo.common.cache.incr", side_effect=ValueError):
+            record_suspend_time("provider1", 6)
+
+        # Assert
+        self.assertEqual([d for _, d, _ in get_suspend_times("provider1")],
+                         [6])
+
+    def test_ssh_pool(self):
+        # Setup
+        pool = SSHPool()
+        connect = Mock(side_effect=lambda user, ip, key: Mock())
+
+        # Run
+        ssh = pool.get("user", "127.0.0.1", "key", connect)
+        pool.release(ssh)
+        ssh2 = pool.get("user", "127.0.0.1", "key", connect)
+        pool.release(ssh2)
+        ssh3 = pool.get("user", "127.0.0.1", "other key", connect)
+
+        # Assert
+        self.assertIs(ssh, ssh2)
+        self.assertIsNot(ssh, ssh3)
+        self.assertEqual(connect.call_count, 2)
+        ssh.close.assert_not_called()
+        ssh.get_transport.return_value.open_session.assert_called_once_with(
+            timeout=10)
+
+    def test_ssh_pool_doesnt_share_connections_in_use(self):
+        # Setup
+        pool = SSHPool()
+        connect = Mock(side_effect=lambda user, ip, key: Mock())
+
+        # Run
+        ssh = pool.get("user", "127.0.0.1", "key", connect)
+        ssh2 = pool.get("user", "127.0.0.1", "key", connect)
+        pool.release(ssh)
+        pool.release(ssh2)
+
+        # Assert
+        # Only one of the connections is kept.
+        self.assertIsNot(ssh, ssh2)
+        ssh.close.assert_not_called()
+        ssh2.close.assert_called_once_with()
+        self.assertIs(pool.get("user", "127.0.0.1", "key", connect), ssh)
+
+    def test_ssh_pool_reconnects_if_unhealthy(self):
+        # Setup
+        pool = SSHPool()
+        connect = Mock(side_effect=lambda user, ip, key: Mock())
+        ssh = pool.get("user", "127.0.0.1", "key", connect)
+        pool.release(ssh)
+        ssh.get_transport.return_value.is_active.return_value = False
+
+        # Run
+        ssh2 = pool.get("user", "127.0.0.1", "key", connect)
+
+        # Assert
+        self.assertIsNot(ssh, ssh2)
+        ssh.close.assert_called_once_with()
+
+    def test_ssh_pool_closes_idle_connections(self):
+        # Setup
+        pool = SSHPool()
+        connect = Mock(side_effect=lambda user, ip, key: Mock())
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"ssh_pool_idle_timeout": 60}):
+            with patch("hastexo.common.time.monotonic") as mock_monotonic:
+                mock_monotonic.return_value = 1000
+                ssh = pool.get("user", "127.0.0.1", "key", connect)
+                pool.release(ssh)
+                mock_monotonic.return_value = 1060
+                ssh2 = pool.get("user", "127.0.0.2", "key", connect)
+
+        # Assert
+        ssh.close.assert_called_once_with()
+        ssh2.close.assert_not_called()
+
+    def test_ssh_pool_size(self):
+        # Setup
+        pool = SSHPool()
+        connect = Mock(side_effect=lambda user, ip, key: Mock())
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"ssh_pool_size": 2}):
+            ssh1 = pool.get("user", "127.0.0.1", "key", connect)
+            pool.release(ssh1)
+            ssh2 = pool.get("user", "127.0.0.2", "key", connect)
+            pool.release(ssh2)
+            ssh1 = pool.get("user", "127.0.0.1", "key", connect)
+            pool.release(ssh1)
+            ssh3 = pool.get("user", "127.0.0.3", "key", connect)
+            pool.release(ssh3)
+
+        # Assert
+        # The least recently used connection was closed.
+        ssh1.close.assert_not_called()
+        ssh2.close.assert_called_once_with()
+        ssh3.close.assert_not_called()
+        self.assertEqual(connect.call_count, 3)
+
+    def test_ssh_pool_discard(self):
+        # Setup
+        pool = SSHPool()
+        connect = Mock(side_effect=lambda user, ip, key: Mock())
+        ssh1 = pool.get("user", "127.0.0.1", "key", connect)
+        ssh2 = pool.get("user", "127.0.0.2", "key", connect)
+        pool.release(ssh2)
+
+        # Run
+        pool.discard("127.0.0.1")
+
+        # Assert
+        # The connection in use isn't closed until it's released.
+        ssh1.close.assert_not_called()
+        pool.release(ssh1)
+        ssh1.close.assert_called_once_with()
+        ssh2.close.assert_not_called()
+        self.assertIsNot(pool.get("user", "127.0.0.1", "key", connect), ssh1)
+
+    def test_ssh_pool_discard_in_other_worker(self):
+        # Setup
+        pool = SSHPool()
+        other_pool = SSHPool()
+        connect = Mock(side_effect=lambda user, ip, key: Mock())
+        ssh = pool.get("user", "127.0.0.1", "key", connect)
+        pool.release(ssh)
+
+        # Run
+        other_pool.discard("127.0.0.1")
+        ssh2 = pool.get("user", "127.0.0.1", "key", connect)
+
+        # Assert
+        self.assertIsNot(ssh, ssh2)
+        ssh.close.assert_called_once_with()
+        ssh.get_transport.assert_not_called()
+
+    def test_ssh_pool_disabled(self):
+        # Setup
+        pool = SSHPool()
+        connect = Mock(side_effect=lambda user, ip, key: Mock())
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"ssh_pool_size": 0}):
+            ssh = pool.get("user", "127.0.0.1", "key", connect)
+            pool.release(ssh)
+            ssh2 = pool.get("user", "127.0.0.1", "key", connect)
+
+        # Assert
+        self.assertIsNot(ssh, ssh2)
+        ssh.close.assert_called_once_with()
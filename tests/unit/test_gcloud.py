@@ -1,6 +1,7 @@
 from unittest import TestCase
 from unittest.mock import patch
-from hastexo.gcloud import GcloudDeploymentManager, GcloudComputeEngine
+from hastexo.gcloud import (GcloudDeploymentManager, GcloudComputeEngine,
+                            discovery_documents)
 
 
 class TestGcloudService(TestCase):
@@ -21,13 +22,21 @@ class TestGcloudService(TestCase):
         }
         patchers = {
             "service_account": patch("hastexo.gcloud.service_account"),
-            "build": patch("hastexo.gcloud.build")
+            "build": patch("hastexo.gcloud.build"),
+            "build_from_document":
+                patch("hastexo.gcloud.build_from_document"),
+            "get_static_doc": patch("hastexo.gcloud.get_static_doc",
+                                    return_value='{"name": "bogus"}')
         }
         self.mocks = {}
         for mock_name, patcher in patchers.items():
             self.mocks[mock_name] = patcher.start()
             self.addCleanup(patcher.stop)
 
+        # Don't reuse discovery documents across tests
+        discovery_documents.clear()
+        self.addCleanup(discovery_documents.clear)
+
 
 class TestGcloudDeploymentManager(TestGcloudService):
     def test_init(self):
@@ -65,9 +74,44 @@ class TestGcloudDeploymentManager(TestGcloudService):
     def test_get_service(self):
         service = GcloudDeploymentManager(**self.info)
         service.get_service()
+        service.get_service()
         self.mocks["service_account"].Credentials.from_service_account_info.\
             assert_called()
+
+        # The discovery document is only loaded once
+        self.mocks["get_static_doc"].assert_called_once_with(
+            "deploymentmanager", service.api_version)
+        self.assertEqual(
+            2, self.mocks["build_from_document"].call_count)
+        self.mocks["build_from_document"].assert_called_with(
+            {"name": "bogus"},
+            credentials=self.mocks["service_account"].Credentials.
+            from_service_account_info.return_value)
+        self.mocks["build"].assert_not_called()
+
+    def test_get_service_copies_discovery_document(self):
+        def build_from_document(document, credentials):
+            # The API client library adds to the document as it builds
+            document["methods"] = {}
+
+        self.mocks["build_from_document"].side_effect = build_from_document
+        service = GcloudDeploymentManager(**self.info)
+        service.get_service()
+        service.get_service()
+
+        # Each service is built from a pristine copy of the document
+        documents = [c.args[0]
+                     for c in self.mocks["build_from_document"].mock_calls]
+        self.assertIsNot(documents[0], documents[1])
+        self.assertEqual({"name": "bogus"},
+                         discovery_documents[("deploymentmanager", "v2")])
+
+    def test_get_service_without_discovery_document(self):
+        self.mocks["get_static_doc"].return_value = None
+        service = GcloudDeploymentManager(**self.info)
+        service.get_service()
         self.mocks["build"].assert_called()
+        self.mocks["build_from_document"].assert_not_called()
 
 
 class TestGcloudComputeEngine(TestGcloudService):
@@ -106,6 +150,24 @@ class TestGcloudComputeEngine(TestGcloudService):
     def test_get_service(self):
         service = GcloudComputeEngine(**self.info)
         service.get_service()
+        service.get_service()
         self.mocks["service_account"].Credentials.from_service_account_info.\
             assert_called()
+
+        # The discovery document is only loaded once
+        self.mocks["get_static_doc"].assert_called_once_with(
+            "compute", service.api_version)
+        self.assertEqual(
+            2, self.mocks["build_from_document"].call_count)
+        self.mocks["build_from_document"].assert_called_with(
+            {"name": "bogus"},
+            credentials=self.mocks["service_account"].Credentials.
+            from_service_account_info.return_value)
+        self.mocks["build"].assert_not_called()
+
+    def test_get_service_without_discovery_document(self):
+        self.mocks["get_static_doc"].return_value = None
+        service = GcloudComputeEngine(**self.info)
+        service.get_service()
         self.mocks["build"].assert_called()
+        self.mocks["build_from_document"].assert_not_called()
@@ -491,7 +491,8 @@ class TestHastexoXBlock(TestCase):
             {"stack_id": stack.id,
              "reset": False,
              "learner_id": stack.learner.id,
-             "stack_key_type": ""}
+             "stack_key_type": "",
+             "launch_timeout": 900}
         )
         self.assertEqual(response["status"], "LAUNCH_PENDING")
 
@@ -927,6 +928,7 @@ class TestHastexoXBlock(TestCase):
                 result = self.call_handler("get_check_status", {})
                 self.assertEqual(result, mock_result.result)
                 self.assertTrue(mock_task.called)
+                self.assertFalse(mock_task.call_args[1]["tests_parallel"])
                 mock_publish.assert_called_once_with(
                     self.block,
                     'grade',
@@ -1241,6 +1243,7 @@ class TestHastexoXBlock(TestCase):
 
         node = etree.Element(block_type)
         node.set('read_only', 'true')
+        node.set('tests_parallel', 'true')
         node.set('display_name', 'Fake Lab')
         node.append(etree.Comment(text="Fake Comment 123"))
 
@@ -1265,6 +1268,7 @@ class TestHastexoXBlock(TestCase):
 
         # assert that node attributes are still imported as xblock fields.
         self.assertEqual(block.read_only, True)
+        self.assertEqual(block.tests_parallel, True)
         self.assertEqual(block.display_name, 'Fake Lab')
 
         # assert that default values are present
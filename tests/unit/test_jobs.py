@@ -1,12 +1,16 @@
+from threading import Barrier
 from unittest.mock import patch
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection
 from django.test import TestCase
 from django.utils import timezone
 
-from hastexo.jobs import SuspenderJob, ReaperJob
-from hastexo.models import Stack, StackLog
+from hastexo.jobs import SuspenderJob, ReaperJob, parse_shard
+from hastexo.models import ProviderOccupancy, Stack, StackLog
 from hastexo.provider import ProviderException
 from hastexo.common import (
+    record_suspend_time,
     CREATE_COMPLETE,
     SUSPEND_PENDING,
     DELETE_PENDING,
@@ -331,6 +335,322 @@ class TestHastexoJobs(TestCase):
         stack3 = Stack.objects.get(name=stack3_name)
         self.assertEqual(stack3.status, state)
 
+    def test_suspend_most_overdue_stack_first(self):
+        # Setup
+        now = timezone.now()
+        stack1 = Stack(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name="bogus_stack_1",
+            suspend_timestamp=now - timezone.timedelta(seconds=5000),
+            suspend_by=now - timezone.timedelta(seconds=10),
+            provider="provider1",
+            status="CREATE_COMPLETE",
+            learner=self.learner
+        )
+        stack1.save()
+        stack2 = Stack(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name="bogus_stack_2",
+            suspend_timestamp=now - timezone.timedelta(seconds=1000),
+            provider="provider1",
+            status="CREATE_COMPLETE",
+            learner=self.learner
+        )
+        stack2.save()
+        mock_suspend_task = self.get_suspend_task_mock()
+
+        # Run
+        job = SuspenderJob(self.settings)
+        job.run()
+
+        # Assert
+        # The effective deadline of a stack without suspend_by is its last
+        # keepalive plus the suspend timeout.
+        mock_suspend_task.apply_async.assert_called_once_with(
+            kwargs={"stack_id": stack2.id},
+            soft_time_limit=900,
+            time_limit=930,
+            ignore_result=True
+        )
+        stack1 = Stack.objects.get(name="bogus_stack_1")
+        self.assertEqual(stack1.status, "CREATE_COMPLETE")
+        stack2 = Stack.objects.get(name="bogus_stack_2")
+        self.assertEqual(stack2.status, SUSPEND_PENDING)
+
+    def test_skip_locked_stacks(self):
+        job = SuspenderJob(self.settings)
+        with patch.object(connection.features,
+                          "has_select_for_update_skip_locked", True):
+            stacks = job.get_due_stacks(lock=True)
+
+        self.assertTrue(stacks.query.select_for_update)
+        self.assertTrue(stacks.query.select_for_update_skip_locked)
+        self.assertFalse(job.get_due_stacks().query.select_for_update)
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("0/1"), (0, 1))
+        self.assertEqual(parse_shard("2/3"), (2, 3))
+        for value in ("", "1", "a/b", "3/3", "-1/3", "0/0", "1/2/3"):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    def test_suspend_sharded(self):
+        # Setup
+        self.settings["suspend_concurrency"] = 10
+        self.create_due_stacks(6)
+        mock_suspend_task = self.get_suspend_task_mock()
+
+        # Run
+        job = SuspenderJob(self.settings, shard=(1, 3))
+        job.run()
+
+        # Assert
+        # Only stacks in this shard are claimed, leaving the others for
+        # the other instances.
+        suspended = Stack.objects.filter(status=SUSPEND_PENDING)
+        self.assertEqual(2, len(suspended))
+        self.assertEqual(2, len(mock_suspend_task.apply_async.mock_calls))
+        for stack in suspended:
+            self.assertEqual(stack.id % 3, 1)
+
+        # Run every shard
+        for index in (0, 2):
+            SuspenderJob(self.settings, shard=(index, 3)).run()
+
+        # Assert
+        # Together, the shards cover all stacks.
+        self.assertEqual(
+            6, Stack.objects.filter(status=SUSPEND_PENDING).count())
+
+    def create_due_stacks(self, count, due_in=-1, prefix="bogus_stack"):
+        timeout = self.settings.get("suspend_timeout")
+        suspend_timestamp = timezone.now() + timezone.timedelta(
+            seconds=due_in - timeout)
+        for i in range(count):
+            stack = Stack(
+                student_id=self.student_id,
+                course_id=self.course_id,
+                name="%s_%d" % (prefix, i),
+                suspend_timestamp=suspend_timestamp,
+                provider="provider1",
+                status="CREATE_COMPLETE",
+                learner=self.learner
+            )
+            stack.save()
+
+    def test_scheduler_refill(self):
+        # Setup
+        self.create_due_stacks(3, due_in=-10, prefix="overdue")
+        self.create_due_stacks(1, due_in=30, prefix="upcoming")
+        self.create_due_stacks(1, due_in=300, prefix="later")
+
+        # Run
+        job = SuspenderJob(self.settings)
+        job.refill(60)
+        job.refill(60)
+
+        # Assert
+        # Stacks due within the lookahead are queued once, earliest first.
+        self.assertEqual(len(job.heap), 4)
+        self.assertEqual(len(job.queued), 4)
+        upcoming = Stack.objects.get(name="upcoming_0")
+        self.assertEqual(max(job.heap)[1], upcoming.id)
+
+    def test_scheduler_drains_all_overdue_stacks(self):
+        # Setup
+        self.settings["suspend_concurrency"] = 2
+        self.settings["suspend_rate"] = None
+        self.create_due_stacks(5, due_in=-10, prefix="overdue")
+        self.create_due_stacks(1, due_in=30, prefix="upcoming")
+        mock_suspend_task = self.get_suspend_task_mock()
+
+        # Run
+        job = SuspenderJob(self.settings)
+        job.refill(60)
+        job.drain()
+
+        # Assert
+        # All overdue stacks are suspended in one go, regardless of
+        # concurrency, and only the upcoming one is left in the heap.
+        self.assertEqual(5, len(mock_suspend_task.apply_async.mock_calls))
+        self.assertEqual(
+            Stack.objects.filter(status=SUSPEND_PENDING).count(), 5)
+        upcoming = Stack.objects.get(name="upcoming_0")
+        self.assertEqual(upcoming.status, "CREATE_COMPLETE")
+        self.assertEqual([stack_id for _, stack_id in job.heap],
+                         [upcoming.id])
+
+    @patch("hastexo.jobs.time")
+    def test_scheduler_rate_limit(self, mock_time):
+        # Setup
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        mock_time.monotonic.side_effect = lambda: clock[0]
+        mock_time.sleep.side_effect = sleep
+        self.settings["suspend_concurrency"] = 2
+        self.settings["suspend_rate"] = 0.5
+        self.create_due_stacks(6, due_in=-10, prefix="overdue")
+        mock_suspend_task = self.get_suspend_task_mock()
+
+        # Run
+        job = SuspenderJob(self.settings)
+        job.drain()
+
+        # Assert
+        # A burst of 2 stacks, then one stack every 2 seconds, plus one more
+        # token to find out there is nothing left to suspend.
+        self.assertEqual(6, len(mock_suspend_task.apply_async.mock_calls))
+        self.assertAlmostEqual(clock[0], 10)
+
+    @patch("hastexo.jobs.time")
+    def test_run_scheduler(self, mock_time):
+        # Setup
+        self.settings["suspend_interval"] = 60
+        self.settings["suspend_rate"] = None
+        self.create_due_stacks(2, due_in=-10, prefix="overdue")
+        self.create_due_stacks(1, due_in=30, prefix="upcoming")
+        mock_time.monotonic.return_value = 0
+        mock_time.sleep.side_effect = [None, KeyboardInterrupt]
+        mock_suspend_task = self.get_suspend_task_mock()
+
+        # Run
+        job = SuspenderJob(self.settings)
+        with self.assertRaises(KeyboardInterrupt):
+            job.run_scheduler()
+
+        # Assert
+        # The scheduler sleeps until the upcoming stack is due, instead of a
+        # full suspend interval.
+        self.assertEqual(2, len(mock_suspend_task.apply_async.mock_calls))
+        delay = mock_time.sleep.mock_calls[0].args[0]
+        self.assertGreater(delay, 25)
+        self.assertLess(delay, 31)
+
+    @patch("hastexo.jobs.time")
+    def test_run_scheduler_survives_errors(self, mock_time):
+        # Setup
+        self.settings["suspend_interval"] = 60
+        self.settings["suspend_rate"] = None
+        self.create_due_stacks(2, due_in=-10, prefix="overdue")
+        mock_time.monotonic.return_value = 0
+        mock_time.sleep.side_effect = [None, None, KeyboardInterrupt]
+        mock_suspend_task = self.get_suspend_task_mock()
+        job = SuspenderJob(self.settings)
+        refill = job.refill
+        errors = [OperationalError("server closed the connection"),
+                  OperationalError("server closed the connection")]
+
+        calls = []
+
+        def flaky_refill(lookahead):
+            calls.append("refill")
+            if errors:
+                raise errors.pop()
+            refill(lookahead)
+
+        # Run
+        with patch.object(job, "refill", side_effect=flaky_refill):
+            with patch.object(job, "refresh_db",
+                              side_effect=lambda: calls.append("refresh")):
+                with self.assertRaises(KeyboardInterrupt):
+                    job.run_scheduler()
+
+        # Assert
+        # Failed passes are retried after a growing delay, with fresh
+        # database connections.
+        self.assertEqual(calls[:5],
+                         ["refill", "refresh", "refill", "refresh", "refill"])
+        delays = [c.args[0] for c in mock_time.sleep.mock_calls]
+        self.assertEqual(delays[:2], [2, 4])
+        self.assertEqual(2, len(mock_suspend_task.apply_async.mock_calls))
+
+    def test_adaptive_concurrency_ramps_up_with_backlog(self):
+        # Setup
+        cache.clear()
+        self.settings["suspend_concurrency"] = 1
+        self.settings["suspend_concurrency_max"] = 3
+        self.settings["providers"] = {"provider1": {}}
+        self.create_due_stacks(10, due_in=-10, prefix="overdue")
+
+        # Run
+        job = SuspenderJob(self.settings)
+        concurrency = []
+        for _ in range(4):
+            job.adapt()
+            concurrency.append(job.concurrency)
+
+        # Assert
+        self.assertEqual(concurrency, [2, 3, 3, 3])
+        self.assertEqual(job.backlog, 10)
+
+    def test_adaptive_concurrency_backs_off_when_throttled(self):
+        # Setup
+        cache.clear()
+        self.settings["suspend_concurrency"] = 8
+        self.settings["suspend_concurrency_min"] = 3
+        self.settings["providers"] = {"provider1": {}, "provider2": {}}
+        self.create_due_stacks(10, due_in=-10, prefix="overdue")
+        job = SuspenderJob(self.settings)
+        job.adapted = 0
+
+        # Run
+        record_suspend_time("provider1", 5)
+        record_suspend_time("provider2", 5, throttled=True)
+        job.adapt()
+        halved = job.concurrency
+        record_suspend_time("provider2", 5, throttled=True)
+        job.adapt()
+        floored = job.concurrency
+
+        # Only new samples are taken into account.
+        job.adapt()
+
+        # Assert
+        self.assertEqual(halved, 4)
+        self.assertEqual(floored, 3)
+        self.assertEqual(job.concurrency, 4)
+
+    def test_adaptive_concurrency_backs_off_when_slow(self):
+        # Setup
+        cache.clear()
+        self.settings["suspend_concurrency"] = 8
+        self.settings["suspend_latency_target"] = 60
+        self.settings["providers"] = {"provider1": {}}
+        job = SuspenderJob(self.settings)
+        job.adapted = 0
+
+        # Run
+        record_suspend_time("provider1", 30)
+        job.adapt()
+        unchanged = job.concurrency
+        record_suspend_time("provider1", 200)
+        job.adapt()
+
+        # Assert
+        self.assertEqual(unchanged, 8)
+        self.assertEqual(job.concurrency, 4)
+
+    def test_adaptive_concurrency_run(self):
+        # Setup
+        cache.clear()
+        self.settings["suspend_concurrency"] = 2
+        self.settings["suspend_concurrency_adaptive"] = True
+        self.settings["providers"] = {"provider1": {}}
+        self.create_due_stacks(5, due_in=-10, prefix="overdue")
+        mock_suspend_task = self.get_suspend_task_mock()
+
+        # Run
+        job = SuspenderJob(self.settings)
+        job.run()
+
+        # Assert
+        self.assertEqual(3, len(mock_suspend_task.apply_async.mock_calls))
+
     def test_delete_old_stacks(self):
         # Setup
         delete_age = self.settings.get("delete_age") * 86400
@@ -608,6 +928,93 @@ class TestHastexoJobs(TestCase):
         stack = Stack.objects.get(name=stack_names[4])
         self.assertEqual(stack.status, CREATE_COMPLETE)
 
+    def test_destroy_zombies_in_chunks(self):
+        # Setup
+        stack_names = ["zombie_stack_%d" % i for i in range(5)]
+        for stack_name in stack_names:
+            _stack = Stack(
+                student_id=self.student_id,
+                course_id=self.course_id,
+                name=stack_name,
+                status=DELETE_COMPLETE,
+                learner=self.learner
+            )
+            _stack.save()
+
+        mock_provider = self.mocks["Provider"].init.return_value
+        mock_provider.get_stacks.return_value = [
+            {"name": stack_name, "status": CREATE_COMPLETE}
+            for stack_name in stack_names + ["unknown"]
+        ]
+        self.settings["providers"] = {"provider1": {}}
+        mock_delete_task = self.get_delete_task_mock()
+
+        # Run
+        job = ReaperJob(self.settings)
+        job.zombie_chunk_size = 2
+        ProviderOccupancy.objects.create(course_id=self.course_id,
+                                         provider="provider1")
+        # One lookup per chunk, then for each stack: an update, a stack log
+        # entry, and an occupancy counter update, within a savepoint.
+        with self.assertNumQueries(3 + 5 * 5, using='default'):
+            job.destroy_zombies("provider1",
+                                mock_provider.get_stacks.return_value)
+
+        # Assert
+        self.assertEqual(5, len(mock_delete_task.apply_async.mock_calls))
+        for stack_name in stack_names:
+            stack = Stack.objects.get(name=stack_name)
+            self.assertEqual(stack.status, DELETE_PENDING)
+            self.assertEqual(stack.provider, "provider1")
+
+    def test_list_provider_stacks_concurrently(self):
+        # Setup
+        # Each provider waits for all others to be listing stacks at the
+        # same time, which would never happen if they were listed serially.
+        barrier = Barrier(3, timeout=5)
+
+        def get_stacks():
+            barrier.wait()
+            return []
+
+        mock_provider = self.mocks["Provider"].init.return_value
+        mock_provider.get_stacks.side_effect = get_stacks
+        self.settings["providers"] = {
+            "provider1": {},
+            "provider2": {},
+            "provider3": {}
+        }
+
+        # Run
+        job = ReaperJob(self.settings)
+        with patch.object(job, "log") as mock_log:
+            job.run()
+
+        # Assert
+        self.assertEqual(3, len(mock_provider.get_stacks.mock_calls))
+        mock_log.assert_not_called()
+
+    def test_destroy_zombies_sharded(self):
+        # Setup
+        mock_provider = self.mocks["Provider"].init.return_value
+        mock_provider.get_stacks.return_value = []
+        providers = ["provider%d" % i for i in range(6)]
+        self.settings["providers"] = {p: {} for p in providers}
+
+        # Run
+        listed = []
+        for index in range(3):
+            job = ReaperJob(self.settings, shard=(index, 3))
+            with patch.object(job, "get_provider_stacks",
+                              return_value=[]) as mock_get_provider_stacks:
+                job.run()
+            listed.append([c[1][0] for c in
+                           mock_get_provider_stacks.mock_calls])
+
+        # Assert
+        # Every provider is listed by exactly one shard.
+        self.assertEqual(sorted(sum(listed, [])), providers)
+
     def test_exception_destroying_zombies(self):
         # Setup
         mock_provider = self.mocks["Provider"].init.return_value
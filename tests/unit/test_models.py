@@ -1,9 +1,18 @@
+from unittest.mock import Mock, patch
+
 from django.contrib.auth.models import User
+from django.db import DatabaseError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from common.djangoapps.student.models import AnonymousUserId
 
-from hastexo.models import Stack, StackLog
+from hastexo.common import get_stack
+from hastexo.jobs import ReaperJob, SuspenderJob
+from hastexo.models import (LabUsage, ProviderOccupancy, Stack, StackLog,
+                            recount_occupancy)
+from hastexo.tasks import LaunchStackTask
 
 
 class TestHastexoModels(TestCase):
@@ -70,3 +79,375 @@ class TestHastexoModels(TestCase):
         self.assertEqual(log[5].status, 'SUSPEND_FAILED')
         self.assertEqual(log[6].status, 'SUSPEND_PENDING')
         self.assertEqual(log[7].status, 'SUSPEND_COMPLETE')
+
+    def get_occupancy(self, provider):
+        try:
+            return ProviderOccupancy.objects.get(course_id=self.course_id,
+                                                 provider=provider).count
+        except ProviderOccupancy.DoesNotExist:
+            return 0
+
+    def test_occupancy(self):
+        stack = Stack.objects.create(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name=self.stack_name,
+            provider="provider1",
+            status='CREATE_COMPLETE',
+            learner=self.learner
+        )
+        self.assertEqual(self.get_occupancy("provider1"), 1)
+
+        # A suspended stack still takes up its slot
+        for status in ('SUSPEND_PENDING', 'SUSPEND_COMPLETE',
+                       'LAUNCH_PENDING'):
+            stack.status = status
+            stack.save()
+        self.assertEqual(self.get_occupancy("provider1"), 1)
+
+        # Moving to another provider moves the slot
+        stack.provider = "provider2"
+        stack.save(update_fields=["provider"])
+        self.assertEqual(self.get_occupancy("provider1"), 0)
+        self.assertEqual(self.get_occupancy("provider2"), 1)
+
+        # Reloading the stack doesn't count it twice
+        stack = Stack.objects.get(id=stack.id)
+        stack.status = 'CREATE_COMPLETE'
+        stack.save()
+        self.assertEqual(self.get_occupancy("provider2"), 1)
+
+        stack.status = 'DELETE_COMPLETE'
+        stack.save()
+        self.assertEqual(self.get_occupancy("provider2"), 0)
+
+    def test_occupancy_delete(self):
+        for i in range(3):
+            Stack.objects.create(
+                student_id="student_%d" % i,
+                course_id=self.course_id,
+                name=self.stack_name,
+                provider="provider1",
+                status='CREATE_COMPLETE'
+            )
+        self.assertEqual(self.get_occupancy("provider1"), 3)
+
+        Stack.objects.get(student_id="student_0").delete()
+        self.assertEqual(self.get_occupancy("provider1"), 2)
+
+        Stack.objects.all().delete()
+        self.assertEqual(self.get_occupancy("provider1"), 0)
+
+    def test_recount_occupancy(self):
+        for i, status in enumerate(('CREATE_COMPLETE', 'SUSPEND_COMPLETE',
+                                    'DELETE_COMPLETE')):
+            Stack.objects.create(
+                student_id="student_%d" % i,
+                course_id=self.course_id,
+                name=self.stack_name,
+                provider="provider1",
+                status=status
+            )
+        Stack.objects.update(status='CREATE_COMPLETE')
+        self.assertEqual(self.get_occupancy("provider1"), 2)
+
+        recount_occupancy([(self.course_id, "provider1")])
+        self.assertEqual(self.get_occupancy("provider1"), 3)
+
+    def test_lab_usage(self):
+        now = timezone.now().replace(hour=12)
+        stack, _ = Stack.objects.get_or_create(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name=self.stack_name,
+            learner=self.learner
+        )
+
+        # Two sessions on the same day, and one the day before
+        for days, seconds in ((0, 60), (0, 120), (1, 300)):
+            stack.status = 'RESUME_COMPLETE'
+            stack.launch_timestamp = now - timezone.timedelta(
+                days=days, seconds=seconds)
+            stack.suspend_timestamp = now - timezone.timedelta(days=days)
+            stack.save()
+            stack.status = 'SUSPEND_COMPLETE'
+            stack.save()
+
+            # Saving without a status change doesn't count the session twice
+            stack.save()
+
+        usage = LabUsage.objects.filter(learner=self.learner).order_by('date')
+        self.assertEqual(len(usage), 2)
+        self.assertEqual(usage[0].seconds, 300)
+        self.assertEqual(usage[1].seconds, 180)
+
+    def test_lab_usage_without_learner(self):
+        now = timezone.now()
+        stack, _ = Stack.objects.get_or_create(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name=self.stack_name,
+            launch_timestamp=now - timezone.timedelta(seconds=60),
+            suspend_timestamp=now
+        )
+        stack.status = 'SUSPEND_COMPLETE'
+        stack.save()
+
+        self.assertEqual(LabUsage.objects.count(), 0)
+
+    def test_logging_selected_fields(self):
+        settings = {"stacklog_fields": ["provider", "ip"]}
+        with patch.dict("hastexo.models.DEFAULT_SETTINGS", settings):
+            stack, _ = Stack.objects.get_or_create(
+                student_id=self.student_id,
+                course_id=self.course_id,
+                name=self.stack_name,
+                learner=self.learner,
+                provider="provider1",
+                ip="127.0.0.1",
+                user="training"
+            )
+            stack.status = 'CREATE_COMPLETE'
+            stack.save(update_fields=["status"])
+
+        log = StackLog.objects.get()
+        self.assertEqual(log.stack_id, stack.id)
+        self.assertEqual(log.status, 'CREATE_COMPLETE')
+        self.assertEqual(log.provider, "provider1")
+        self.assertEqual(log.ip, "127.0.0.1")
+        self.assertEqual(log.name, "")
+        self.assertEqual(log.user, "")
+
+    def test_buffered_logging(self):
+        stacks = []
+        for i in range(3):
+            stack, _ = Stack.objects.get_or_create(
+                student_id=self.student_id,
+                course_id=self.course_id,
+                name="%s_%d" % (self.stack_name, i),
+                learner=self.learner
+            )
+            stacks.append(stack)
+
+        settings = {"stacklog_buffered": True}
+        with patch.dict("hastexo.models.DEFAULT_SETTINGS", settings):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with transaction.atomic():
+                    for stack in stacks:
+                        stack.status = 'SUSPEND_PENDING'
+                        stack.save(update_fields=["status"])
+
+                    # Nothing is written until the transaction commits
+                    self.assertEqual(StackLog.objects.count(), 0)
+
+        # A single commit hook wrote all entries
+        self.assertEqual(len(callbacks), 1)
+        log = StackLog.objects.all()
+        self.assertEqual(len(log), 3)
+        self.assertEqual([entry.stack_id for entry in log],
+                         [stack.id for stack in stacks])
+        self.assertTrue(all(entry.status == 'SUSPEND_PENDING'
+                            for entry in log))
+
+    def test_buffered_logging_rollback(self):
+        stack, _ = Stack.objects.get_or_create(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name=self.stack_name,
+            learner=self.learner
+        )
+
+        settings = {"stacklog_buffered": True}
+        with patch.dict("hastexo.models.DEFAULT_SETTINGS", settings):
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        stack.status = 'SUSPEND_PENDING'
+                        stack.save(update_fields=["status"])
+                        raise RuntimeError()
+                except RuntimeError:
+                    pass
+
+                with transaction.atomic():
+                    stack.status = 'SUSPEND_COMPLETE'
+                    stack.save(update_fields=["status"])
+
+        # Only the entry from the committed transaction was written
+        log = StackLog.objects.all()
+        self.assertEqual(len(log), 1)
+        self.assertEqual(log[0].status, 'SUSPEND_COMPLETE')
+
+    def test_buffered_logging_savepoint_rollback(self):
+        stack, _ = Stack.objects.get_or_create(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name=self.stack_name,
+            learner=self.learner
+        )
+
+        settings = {"stacklog_buffered": True}
+        with patch.dict("hastexo.models.DEFAULT_SETTINGS", settings):
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    stack.status = 'SUSPEND_PENDING'
+                    stack.save(update_fields=["status"])
+                    try:
+                        with transaction.atomic():
+                            stack.status = 'SUSPEND_FAILED'
+                            stack.save(update_fields=["status"])
+                            raise RuntimeError()
+                    except RuntimeError:
+                        pass
+
+                    stack.status = 'SUSPEND_COMPLETE'
+                    stack.save(update_fields=["status"])
+
+        # The entry from the rolled back savepoint was discarded
+        log = StackLog.objects.all()
+        self.assertEqual([entry.status for entry in log],
+                         ['SUSPEND_PENDING', 'SUSPEND_COMPLETE'])
+
+    def test_buffered_logging_transaction_internals(self):
+        # The writer relies on these Django internals, which aren't part of
+        # its public API: check them with every supported version.
+        with transaction.atomic():
+            connection = transaction.get_connection()
+            hook = Mock()
+            transaction.on_commit(hook)
+            savepoints = len(connection.savepoint_ids)
+            with transaction.atomic():
+                self.assertIsInstance(connection.savepoint_ids, list)
+                self.assertEqual(len(connection.savepoint_ids),
+                                 savepoints + 1)
+            self.assertIs(connection.run_on_commit[-1][1], hook)
+
+    def test_buffered_logging_unknown_internals(self):
+        stack, _ = Stack.objects.get_or_create(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name=self.stack_name,
+            learner=self.learner
+        )
+
+        settings = {"stacklog_buffered": True}
+        with patch.dict("hastexo.models.DEFAULT_SETTINGS", settings):
+            with transaction.atomic():
+                connection = transaction.get_connection()
+                with patch.object(connection, "run_on_commit", [()]):
+                    with self.assertLogs("hastexo.models", level="WARNING"):
+                        stack.status = 'SUSPEND_PENDING'
+                        stack.save(update_fields=["status"])
+
+                # The entry was written straight away.
+                self.assertEqual(StackLog.objects.count(), 1)
+
+    def test_buffered_logging_write_error(self):
+        stack, _ = Stack.objects.get_or_create(
+            student_id=self.student_id,
+            course_id=self.course_id,
+            name=self.stack_name,
+            learner=self.learner
+        )
+
+        settings = {"stacklog_buffered": True}
+        with patch.dict("hastexo.models.DEFAULT_SETTINGS", settings):
+            with patch("hastexo.models.StackLog.objects.bulk_create") as \
+                    mock_bulk_create:
+                mock_bulk_create.side_effect = DatabaseError()
+
+                # The error is logged, not raised after the commit.
+                with self.assertLogs("hastexo.models", level="ERROR"):
+                    with self.captureOnCommitCallbacks(execute=True):
+                        with transaction.atomic():
+                            stack.status = 'SUSPEND_PENDING'
+                            stack.save(update_fields=["status"])
+
+        self.assertEqual(Stack.objects.get(id=stack.id).status,
+                         'SUSPEND_PENDING')
+
+
+class TestQueryPlans(TestCase):
+    """
+    Check that the hot stack queries are served by an index, instead of a
+    full table scan.
+
+    """
+    stack_count = 5000
+
+    def setUp(self):
+        if connection.vendor not in ("sqlite", "postgresql"):
+            self.skipTest("No query plan check for %s." % connection.vendor)
+
+        # Seed a table of stacks in a variety of states, none of which are
+        # due for suspension or deletion.
+        now = timezone.now()
+        statuses = ["CREATE_COMPLETE", "RESUME_COMPLETE", "SUSPEND_COMPLETE",
+                    "DELETE_COMPLETE", "LAUNCH_PENDING"]
+        Stack.objects.bulk_create([
+            Stack(student_id="student_%d" % (i % 1000),
+                  course_id="course_%d" % (i % 50),
+                  name="stack_%d" % (i // 1000),
+                  provider="provider_%d" % (i % 3),
+                  status=statuses[i % len(statuses)],
+                  suspend_timestamp=now,
+                  delete_by=now + timezone.timedelta(days=14))
+            for i in range(self.stack_count)
+        ], batch_size=1000)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def get_plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                cursor.execute("EXPLAIN QUERY PLAN %s" % sql)
+                return "\n".join(row[-1] for row in cursor.fetchall())
+            else:
+                cursor.execute("EXPLAIN %s" % sql)
+                return "\n".join(row[0] for row in cursor.fetchall())
+
+    def assertNoFullScan(self, queries):
+        selects = [q["sql"] for q in queries
+                   if q["sql"].startswith("SELECT")]
+        self.assertTrue(selects)
+        for sql in selects:
+            plan = self.get_plan(sql)
+            for scan in ("SCAN hastexo_stack", "SCAN TABLE hastexo_stack",
+                         "Seq Scan on hastexo_stack"):
+                self.assertNotIn(scan, plan, "%s\n%s" % (sql, plan))
+
+    def test_get_stack(self):
+        with CaptureQueriesContext(connection) as queries:
+            get_stack("stack_1", "course_1", "student_1")
+
+        self.assertNoFullScan(queries)
+
+    def test_reserve_provider(self):
+        stack = Stack.objects.get(student_id="student_1",
+                                  course_id="course_1",
+                                  name="stack_0")
+        provider = Mock()
+        provider.name = "provider_1"
+        provider.capacity = 10
+
+        with patch.multiple(LaunchStackTask, create=True,
+                            stack_id=stack.id):
+            with CaptureQueriesContext(connection) as queries:
+                LaunchStackTask.reserve_provider(provider)
+
+        self.assertNoFullScan(queries)
+
+    def test_suspender(self):
+        job = SuspenderJob({"suspend_timeout": 120,
+                            "suspend_concurrency": 4})
+        with CaptureQueriesContext(connection) as queries:
+            job.run()
+
+        self.assertNoFullScan(queries)
+
+    def test_reaper(self):
+        job = ReaperJob({"delete_age": 14})
+        with CaptureQueriesContext(connection) as queries:
+            job.run()
+
+        self.assertNoFullScan(queries)
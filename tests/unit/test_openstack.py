@@ -1,5 +1,10 @@
+from datetime import timedelta
 from unittest import TestCase
 from unittest.mock import patch, Mock
+
+from django.core.cache import cache
+from django.utils import timezone
+
 from hastexo.openstack import OpenStackWrapper, HeatWrapper, NovaWrapper
 
 
@@ -30,6 +35,9 @@ class TestOpenStackWrapper(TestCase):
             self.mocks[mock_name] = patcher.start()
             self.addCleanup(patcher.stop)
 
+        # Don't share keystone tokens across tests
+        self.addCleanup(cache.clear)
+
     def test_init(self):
         wrapper = OpenStackWrapper(**self.credentials)
         for key in self.credentials:
@@ -87,6 +95,53 @@ class TestOpenStackWrapper(TestCase):
             project_domain_name=self.credentials['os_project_domain_name'],
         )
 
+    def test_share_keystone_auth(self):
+        keystone_auth = OpenStackWrapper(
+            **self.credentials).get_keystone_auth()
+        heat_wrapper = HeatWrapper(keystone_auth=keystone_auth,
+                                   **self.credentials)
+        nova_wrapper = NovaWrapper(keystone_auth=keystone_auth,
+                                   **self.credentials)
+        self.assertEqual(keystone_auth, heat_wrapper.get_keystone_auth())
+        self.assertEqual(keystone_auth, nova_wrapper.get_keystone_auth())
+        self.mocks["kssession"].Session.assert_called_once()
+
+        # Wrappers that aren't given one create their own
+        OpenStackWrapper(**self.credentials).get_keystone_auth()
+        self.assertEqual(2, self.mocks["kssession"].Session.call_count)
+
+    def test_token_cache(self):
+        self.credentials["os_auth_token"] = ""
+        mock_auth = self.mocks["generic"].Password.return_value
+        mock_auth.get_access.return_value.expires = (
+            timezone.now() + timedelta(hours=1))
+        mock_auth.get_auth_state.return_value = "bogus_auth_state"
+
+        # Authenticate once, and cache the token
+        OpenStackWrapper(token_cache=True,
+                         **self.credentials).get_keystone_auth()
+        mock_auth.get_access.assert_called_once()
+        mock_auth.set_auth_state.assert_not_called()
+
+        # Another process reuses it
+        OpenStackWrapper(token_cache=True,
+                         **self.credentials).get_keystone_auth()
+        mock_auth.get_access.assert_called_once()
+        mock_auth.set_auth_state.assert_called_once_with("bogus_auth_state")
+
+    def test_token_cache_expiring_token(self):
+        self.credentials["os_auth_token"] = ""
+        mock_auth = self.mocks["generic"].Password.return_value
+        mock_auth.get_access.return_value.expires = (
+            timezone.now() + timedelta(seconds=60))
+
+        # A token that's about to expire isn't cached
+        for i in range(2):
+            OpenStackWrapper(token_cache=True,
+                             **self.credentials).get_keystone_auth()
+        self.assertEqual(2, mock_auth.get_access.call_count)
+        mock_auth.set_auth_state.assert_not_called()
+
 
 class TestHeatWrapper(TestOpenStackWrapper):
     def test_init(self):
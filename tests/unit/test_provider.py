@@ -1,17 +1,25 @@
+import asyncio
 import ddt
+import itertools
+import time
 import yaml
 import base64
 
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
-from unittest.mock import Mock, patch, call
+from unittest.mock import AsyncMock, Mock, patch, call
 from heatclient import exc as heat_exc
 from keystoneauth1.exceptions import http as keystone_exc
 from novaclient import exceptions as nova_exc
 from googleapiclient import errors as gcloud_exc
 
-from hastexo.common import b
+from django.core.cache import cache
+
+from hastexo.common import b, get_poll_counts
 from hastexo.provider import (Provider, OpenstackProvider, GcloudProvider,
-                              ProviderException)
+                              AsyncProvider, PollingStrategy,
+                              ProviderException, client_pool,
+                              manifest_outputs)
 
 
 HEAT_EXCEPTIONS = [
@@ -152,6 +160,7 @@ class TestOpenstackProvider(TestCase):
         patchers = {
             "HeatWrapper": patch("hastexo.provider.HeatWrapper"),
             "NovaWrapper": patch("hastexo.provider.NovaWrapper"),
+            "OpenStackWrapper": patch("hastexo.provider.OpenStackWrapper"),
             "settings": patch.dict("hastexo.common.DEFAULT_SETTINGS",
                                    self.settings),
         }
@@ -160,6 +169,10 @@ class TestOpenstackProvider(TestCase):
             self.mocks[mock_name] = patcher.start()
             self.addCleanup(patcher.stop)
 
+        # Don't reuse clients across tests
+        client_pool.clear()
+        self.addCleanup(client_pool.clear)
+
     def test_init(self):
         # Run
         provider = Provider.init(self.provider_name)
@@ -169,6 +182,78 @@ class TestOpenstackProvider(TestCase):
         self.assertNotEqual(provider.heat_c, None)
         self.assertNotEqual(provider.nova_c, None)
 
+    def test_init_reuses_clients(self):
+        # Run
+        provider1 = Provider.init(self.provider_name)
+        provider2 = Provider.init(self.provider_name)
+
+        # Assert
+        self.assertIs(provider1.heat_c, provider2.heat_c)
+        self.assertIs(provider1.nova_c, provider2.nova_c)
+        self.assertEqual(
+            1, self.mocks["HeatWrapper"].return_value.get_client.call_count)
+        self.assertEqual(
+            1, self.mocks["NovaWrapper"].return_value.get_client.call_count)
+
+    def test_init_shares_keystone_auth(self):
+        # Setup
+        mock_keystone = self.mocks["OpenStackWrapper"]
+        keystone_auth = mock_keystone.return_value.get_keystone_auth
+        Provider.init(self.provider_name)
+
+        # Assert
+        keystone_auth.assert_called_once_with()
+        for wrapper in ("HeatWrapper", "NovaWrapper"):
+            self.assertEqual(
+                self.mocks[wrapper].call_args.kwargs["keystone_auth"],
+                keystone_auth.return_value)
+
+        # Run
+        # Expired clients get a new session along with them.
+        Provider.init(self.provider_name)
+        with patch("hastexo.provider.time.monotonic",
+                   return_value=time.monotonic() + 3600):
+            Provider.init(self.provider_name)
+
+        # Assert
+        self.assertEqual(2, keystone_auth.call_count)
+
+    def test_init_rebuilds_clients(self):
+        # Setup
+        mock_heat = self.mocks["HeatWrapper"].return_value.get_client
+        Provider.init(self.provider_name)
+
+        # Run
+        # Changed credentials call for new clients.
+        self.mock_provider_config["os_password"] = "new_password"
+        Provider.init(self.provider_name)
+
+        # Assert
+        self.assertEqual(2, mock_heat.call_count)
+
+        # Run
+        # So do expired ones.
+        with patch("hastexo.provider.time.monotonic",
+                   return_value=time.monotonic() + 3600):
+            Provider.init(self.provider_name)
+
+        # Assert
+        self.assertEqual(3, mock_heat.call_count)
+
+    def test_init_without_client_pool(self):
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_client_ttl": 0}):
+            Provider.init(self.provider_name)
+            Provider.init(self.provider_name)
+
+        # Assert
+        self.assertEqual(
+            2, self.mocks["HeatWrapper"].return_value.get_client.call_count)
+        self.assertEqual(
+            2, self.mocks["OpenStackWrapper"].return_value
+            .get_keystone_auth.call_count)
+
     def test_init_missing_configuration(self):
         self.settings["providers"].pop(self.provider_name)
 
@@ -226,6 +311,56 @@ class TestOpenstackProvider(TestCase):
         self.assertEqual(mock_stacks[0].stack_status, stacks[0]["status"])
         self.assertEqual(mock_stacks[1].stack_status, stacks[1]["status"])
 
+    def test_get_stacks_status(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        heat.stacks.list.return_value = iter([
+            self.stacks["CREATE_COMPLETE"],
+            self.stacks["SUSPEND_COMPLETE"]
+        ])
+        names = [
+            self.stacks["CREATE_COMPLETE"].stack_name,
+            self.stacks["SUSPEND_COMPLETE"].stack_name,
+            "deleted_stack"
+        ]
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        statuses = provider.get_stacks_status(names)
+
+        # Assert
+        heat.stacks.list.assert_called_once_with(filters={"name": names})
+        heat.stacks.get.assert_not_called()
+        self.assertEqual(statuses, {
+            names[0]: "CREATE_COMPLETE",
+            names[1]: "SUSPEND_COMPLETE",
+            "deleted_stack": "DELETE_COMPLETE"
+        })
+
+    def test_get_stacks_status_chunks(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        heat.stacks.list.return_value = []
+        names = ["stack%d" % i for i in range(120)]
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        statuses = provider.get_stacks_status(names)
+
+        # Assert
+        self.assertEqual(heat.stacks.list.call_count, 3)
+        self.assertEqual(len(statuses), 120)
+
+    def test_get_stacks_status_exception(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        heat.stacks.list.side_effect = heat_exc.HTTPBadRequest
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        with self.assertRaises(ProviderException):
+            provider.get_stacks_status(["stack"])
+
     def test_list_existing_stacks_empty(self):
         # Setup
         heat = self.get_heat_client_mock()
@@ -422,6 +557,27 @@ class TestOpenstackProvider(TestCase):
             parameters={"run": self.stack_run}
         )
 
+    def test_create_stack_no_wait(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        self.get_nova_client_mock()
+        heat.stacks.create.side_effect = [
+            {"stack": {"id": self.stack_name}}
+        ]
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        provider.set_template(self.stack_template)
+        provider.set_environment(self.stack_environment)
+        stack = provider.create_stack(
+            self.stack_name, self.stack_run, key_type="ed25519", wait=False)
+
+        # Assertions
+        self.assertEqual("CREATE_IN_PROGRESS", stack["status"])
+        self.assertEqual(stack["outputs"], {})
+        self.assertIn("PRIVATE KEY", stack["private_key"])
+        heat.stacks.get.assert_not_called()
+
     @ddt.data(*HEAT_EXCEPTIONS)
     def test_create_stack_exception_on_create(self, heat_exception):
         # Setup
@@ -562,6 +718,33 @@ class TestOpenstackProvider(TestCase):
             call(servers[1], 'HARD')
         ])
 
+    def test_resume_stack_no_wait(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        nova = self.get_nova_client_mock()
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        stack = provider.resume_stack(self.stack_name, wait=False)
+
+        # Assertions
+        self.assertEqual("RESUME_IN_PROGRESS", stack["status"])
+        heat.actions.resume.assert_called_with(stack_id=self.stack_name)
+        heat.stacks.get.assert_not_called()
+        nova.servers.reboot.assert_not_called()
+
+    def test_finish_resume(self):
+        # Setup
+        nova = self.get_nova_client_mock()
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        provider.finish_resume(self.stack_name,
+                               {"reboot_on_resume": ["server1"]})
+
+        # Assertions
+        nova.servers.reboot.assert_called_once_with("server1", 'HARD')
+
     @ddt.data(*NOVA_EXCEPTIONS)
     def test_resume_stack_with_nova_exceptions(self, nova_exception):
         # Setup
@@ -660,6 +843,245 @@ class TestOpenstackProvider(TestCase):
         self.assertRaises(KeyError, lambda: provider_stack["outputs"])
         heat.actions.suspend.assert_called_with(stack_id=self.stack_name)
 
+    def test_suspend_stack_polling(self):
+        # Setup
+        cache.clear()
+        heat = self.get_heat_client_mock()
+        heat.stacks.get.side_effect = [
+            self.stacks["SUSPEND_IN_PROGRESS"],
+            self.stacks["SUSPEND_IN_PROGRESS"],
+            self.stacks["SUSPEND_COMPLETE"],
+        ]
+        polling = {
+            "initial": 10,
+            "multiplier": 2,
+            "cap": 30,
+            "operations": {
+                "suspend": {"initial": 1, "cap": 3}
+            }
+        }
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_polling": polling}):
+            with patch("hastexo.provider.time.sleep") as mock_sleep:
+                provider.suspend_stack(self.stack_name)
+
+        # Assert
+        # The wait between polls backs off, up to the cap.
+        mock_sleep.assert_has_calls([call(1), call(2), call(3)])
+        self.assertEqual(
+            get_poll_counts(self.provider_name, "suspend"),
+            {"operations": 1, "polls": 3, "seconds": 6})
+
+    def test_polling_strategy_jitter(self):
+        strategy = PollingStrategy(10, multiplier=1.5, cap=20, jitter=0.1)
+        delays = strategy.delays()
+        for expected in (10, 15, 20, 20):
+            delay = next(delays)
+            self.assertGreaterEqual(delay, expected * 0.9)
+            self.assertLessEqual(delay, expected * 1.1)
+
+    def test_polling_strategy_jitter_clamped(self):
+        # Jitter over 1 would make waits negative.
+        strategy = PollingStrategy(10, jitter=2)
+        self.assertEqual(strategy.jitter, 1)
+        for delay in itertools.islice(strategy.delays(), 100):
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, 20)
+
+        self.assertEqual(PollingStrategy(10, jitter=-0.5).jitter, 0)
+
+    def test_async_get_stack(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        heat_stacks = {
+            "stack1": self.stacks["CREATE_COMPLETE"],
+            "stack2": self.stacks["SUSPEND_COMPLETE"],
+        }
+
+        def get_heat_stack(stack_id):
+            if stack_id not in heat_stacks:
+                raise heat_exc.HTTPNotFound
+            return heat_stacks[stack_id]
+
+        heat.stacks.get.side_effect = get_heat_stack
+        provider = AsyncProvider(self.provider_name)
+
+        async def get_stacks():
+            return await asyncio.gather(
+                *[provider.get_stack(name)
+                  for name in ("stack1", "stack2", "stack3")])
+
+        # Run
+        stacks = asyncio.run(get_stacks())
+
+        # Assert
+        # The statuses are the same as the provider driver's.
+        self.assertEqual(
+            [s["status"] for s in stacks],
+            ["CREATE_COMPLETE", "SUSPEND_COMPLETE", "DELETE_COMPLETE"])
+        self.assertEqual(stacks[0]["outputs"]["public_ip"], self.stack_ip)
+
+    def test_async_suspend_stack(self):
+        # Setup
+        cache.clear()
+        heat = self.get_heat_client_mock()
+        heat.stacks.get.side_effect = [
+            self.stacks["SUSPEND_IN_PROGRESS"],
+            self.stacks["SUSPEND_COMPLETE"],
+        ]
+        provider = AsyncProvider(self.provider_name)
+
+        # Run
+        with patch("hastexo.provider.asyncio.sleep",
+                   new_callable=AsyncMock) as mock_sleep:
+            with patch("hastexo.provider.time.sleep") as mock_time_sleep:
+                result = asyncio.run(provider.suspend_stack(self.stack_name))
+
+        # Assert
+        # Polls wait in the event loop, not in the executor.
+        heat.actions.suspend.assert_called_once_with(
+            stack_id=self.stack_name)
+        self.assertEqual(result, {"status": "SUSPEND_COMPLETE"})
+        self.assertEqual(mock_sleep.await_count, 2)
+        mock_time_sleep.assert_not_called()
+        self.assertEqual(
+            get_poll_counts(self.provider_name, "suspend"),
+            {"operations": 1, "polls": 2, "seconds": 0})
+
+    def test_async_delete_stack_failed(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        heat.stacks.get.side_effect = [
+            self.stacks["DELETE_IN_PROGRESS"],
+            self.stacks["DELETE_FAILED"],
+        ]
+        provider = AsyncProvider(self.provider_name)
+
+        # Run
+        with patch("hastexo.provider.asyncio.sleep", new_callable=AsyncMock):
+            with self.assertRaises(ProviderException):
+                asyncio.run(provider.delete_stack(self.stack_name))
+
+        # Assert
+        heat.stacks.delete.assert_called_once_with(stack_id=self.stack_name)
+
+    def test_async_delete_stack_nowait(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        provider = AsyncProvider(self.provider_name)
+
+        # Run
+        result = asyncio.run(provider.delete_stack(self.stack_name,
+                                                   wait=False))
+
+        # Assert
+        self.assertEqual(result, {"status": "DELETE_IN_PROGRESS"})
+        heat.stacks.get.assert_not_called()
+
+    def test_async_create_stack(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        heat.stacks.create.return_value = {"stack": {"id": self.stack_name}}
+        heat.stacks.get.side_effect = [
+            self.stacks["CREATE_IN_PROGRESS"],
+            self.stacks["CREATE_COMPLETE"],
+        ]
+        provider = AsyncProvider(self.provider_name)
+        provider.set_template(self.stack_template)
+        provider.set_environment(self.stack_environment)
+
+        # Run
+        with patch("hastexo.provider.asyncio.sleep",
+                   new_callable=AsyncMock) as mock_sleep:
+            with patch("hastexo.provider.time.sleep") as mock_time_sleep:
+                result = asyncio.run(provider.create_stack(
+                    self.stack_name, self.stack_run, key_type="rsa"))
+
+        # Assert
+        # The executor only starts the creation, and polls wait in the
+        # event loop.
+        self.assertEqual(result["status"], "CREATE_COMPLETE")
+        self.assertEqual(result["outputs"]["public_ip"], self.stack_ip)
+        self.assertIn("private_key", result)
+        self.assertEqual(mock_sleep.await_count, 2)
+        mock_time_sleep.assert_not_called()
+
+    def test_async_create_stack_disappeared(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        heat.stacks.create.return_value = {"stack": {"id": self.stack_name}}
+        heat.stacks.get.side_effect = heat_exc.HTTPNotFound
+        provider = AsyncProvider(self.provider_name)
+        provider.set_template(self.stack_template)
+
+        # Run
+        with patch("hastexo.provider.asyncio.sleep", new_callable=AsyncMock):
+            with self.assertRaises(ProviderException):
+                asyncio.run(provider.create_stack(self.stack_name,
+                                                  self.stack_run))
+
+    def test_async_resume_stack(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        nova = self.get_nova_client_mock()
+        self.stacks["RESUME_COMPLETE"].outputs[3]["output_value"] = [
+            "server1"]
+        heat.stacks.get.side_effect = [
+            self.stacks["RESUME_IN_PROGRESS"],
+            self.stacks["RESUME_COMPLETE"],
+        ]
+        provider = AsyncProvider(self.provider_name)
+
+        # Run
+        with patch("hastexo.provider.asyncio.sleep",
+                   new_callable=AsyncMock) as mock_sleep:
+            with patch("hastexo.provider.time.sleep") as mock_time_sleep:
+                result = asyncio.run(provider.resume_stack(self.stack_name))
+
+        # Assert
+        self.assertEqual(result["status"], "RESUME_COMPLETE")
+        heat.actions.resume.assert_called_once_with(stack_id=self.stack_name)
+        nova.servers.reboot.assert_called_once_with("server1", 'HARD')
+        self.assertEqual(mock_sleep.await_count, 2)
+        mock_time_sleep.assert_not_called()
+
+    def test_async_resume_stack_not_started(self):
+        # Setup
+        heat = self.get_heat_client_mock()
+        heat.stacks.get.side_effect = [
+            self.stacks["SUSPEND_COMPLETE"],
+            self.stacks["RESUME_COMPLETE"],
+        ]
+        provider = AsyncProvider(self.provider_name)
+
+        # Run
+        with patch("hastexo.provider.asyncio.sleep", new_callable=AsyncMock):
+            result = asyncio.run(provider.resume_stack(self.stack_name))
+
+        # Assert
+        # Servers that haven't started yet are waited for.
+        self.assertEqual(result["status"], "RESUME_COMPLETE")
+        self.assertEqual(heat.stacks.get.call_count, 2)
+
+    def test_async_provider_reuses_provider(self):
+        # Setup
+        self.get_heat_client_mock()
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        provider = AsyncProvider(self.provider_name, executor)
+
+        # Run
+        with patch("hastexo.provider.Provider.init",
+                   wraps=Provider.init) as mock_init:
+            asyncio.run(provider.delete_stack(self.stack_name, wait=False))
+            asyncio.run(provider.delete_stack(self.stack_name, wait=False))
+
+        # Assert
+        mock_init.assert_called_once_with(self.provider_name)
+
     def test_suspend_stack_disappeared(self):
         # Setup
         heat = self.get_heat_client_mock()
@@ -844,6 +1266,21 @@ class TestOpenstackProvider(TestCase):
         heat.stacks.delete.assert_called_with(stack_id=self.stack_name)
         nova.keypairs.delete.assert_called_with(self.stack_name)
 
+    @ddt.data(heat_exc.HTTPOverLimit(),
+              nova_exc.OverLimit(413),
+              nova_exc.RateLimit(429),
+              keystone_exc.RequestEntityTooLarge())
+    def test_exception_throttled(self, exception):
+        self.assertTrue(ProviderException(exception).throttled)
+
+    @ddt.data(heat_exc.HTTPBadRequest(),
+              nova_exc.BadRequest(400),
+              keystone_exc.ServiceUnavailable(),
+              "error message")
+    def test_exception_not_throttled(self, exception):
+        self.assertFalse(ProviderException(exception).throttled)
+        self.assertFalse(ProviderException().throttled)
+
 
 @ddt.ddt
 class TestGcloudProvider(TestCase):
@@ -860,6 +1297,12 @@ class TestGcloudProvider(TestCase):
         resp.status = status
         return gcloud_exc.HttpError(resp, b(content))
 
+    def test_exception_throttled(self):
+        self.assertTrue(
+            ProviderException(self.mock_exception(429)).throttled)
+        self.assertFalse(
+            ProviderException(self.mock_exception(404)).throttled)
+
     def mock_operation(self, optype, opstate, name="operation", error=False):
         op = {
             "name": name,
@@ -917,6 +1360,9 @@ class TestGcloudProvider(TestCase):
             "zone": zone
         }
 
+    def mock_servers(self, *servers):
+        return {"items": list(servers)}
+
     def setUp(self):
         self.stack_name = "bogus_stack_name"
         self.deployment_name = "s-825a4c28f75f7988620732428c09a19b0adb291e"
@@ -972,6 +1418,17 @@ class TestGcloudProvider(TestCase):
             self.mocks[mock_name] = patcher.start()
             self.addCleanup(patcher.stop)
 
+        # Run batch requests one by one
+        self.mock_batch(self.mock_compute_service())
+
+        # Don't reuse deployment outputs across tests
+        manifest_outputs.clear()
+        self.addCleanup(manifest_outputs.clear)
+
+        # Don't reuse clients across tests
+        client_pool.clear()
+        self.addCleanup(client_pool.clear)
+
     def test_init(self):
         # Run
         provider = Provider.init(self.provider_name)
@@ -1018,10 +1475,12 @@ class TestGcloudProvider(TestCase):
             self.mock_resources(1),
             self.mock_resources(2)
         ]
-        cs.instances().get.return_value.execute.side_effect = [
-            self.mock_server("RUNNING"),
-            self.mock_server("RUNNING"),
-            self.mock_server("RUNNING")
+        cs.instances().list.return_value.execute.side_effect = [
+            self.mock_servers(self.mock_server("RUNNING")),
+            self.mock_servers(
+                self.mock_server("RUNNING"),
+                self.mock_server("RUNNING")
+            )
         ]
         ds.manifests().get.return_value.execute.side_effect = [
             self.mock_manifest(),
@@ -1039,6 +1498,108 @@ class TestGcloudProvider(TestCase):
         self.assertEqual("CREATE_COMPLETE", stacks[0]["status"])
         self.assertEqual("CREATE_COMPLETE", stacks[1]["status"])
 
+    def mock_batch(self, service):
+        def new_batch_http_request(callback):
+            requests = []
+            batch = Mock()
+            batch.add.side_effect = lambda request, request_id=None: \
+                requests.append((request_id, request))
+
+            def execute():
+                for request_id, request in requests:
+                    try:
+                        response = request.execute()
+                    except Exception as e:
+                        callback(request_id, None, e)
+                    else:
+                        callback(request_id, response, None)
+
+            batch.execute.side_effect = execute
+            return batch
+
+        service.new_batch_http_request.side_effect = new_batch_http_request
+
+    def test_get_stacks_status(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        cs = self.mock_compute_service()
+        self.mock_batch(ds)
+        provider = Provider.init(self.provider_name)
+        names = ["running", "suspended", "deleting", "deleted"]
+        deployment_names = [provider._encode_name(n) for n in names]
+        deployments = [
+            self.mock_deployment("insert", "DONE",
+                                 name=deployment_names[0],
+                                 description=names[0]),
+            self.mock_deployment("insert", "DONE",
+                                 name=deployment_names[1],
+                                 description=names[1]),
+            self.mock_deployment("delete", "RUNNING",
+                                 name=deployment_names[2],
+                                 description=names[2]),
+        ]
+        ds.deployments().list.return_value.execute.return_value = {
+            "deployments": deployments
+        }
+        ds.resources().list.return_value.execute.side_effect = [
+            self.mock_resources(2, name="running"),
+            self.mock_resources(1, name="suspended")
+        ]
+        cs.instances().aggregatedList.return_value.execute.return_value = {
+            "items": {
+                "zones/zone": {"instances": [
+                    self.mock_server("RUNNING", name="running0",
+                                     zone="zones/zone"),
+                    self.mock_server("RUNNING", name="running1",
+                                     zone="zones/zone"),
+                    self.mock_server("TERMINATED", name="suspended0",
+                                     zone="zones/zone")
+                ]},
+                "zones/otherzone": {"instances": [
+                    self.mock_server("STOPPING", name="running0",
+                                     zone="zones/otherzone")
+                ]},
+                "zones/emptyzone": {"warning": {}}
+            }
+        }
+        cs.instances().aggregatedList_next.return_value = None
+
+        # Run
+        statuses = provider.get_stacks_status(names)
+
+        # Assert
+        self.assertEqual(statuses, {
+            "running": "CREATE_COMPLETE",
+            "suspended": "SUSPEND_COMPLETE",
+            "deleting": "DELETE_IN_PROGRESS",
+            "deleted": "DELETE_COMPLETE"
+        })
+        ds.deployments().list.assert_called_once_with(
+            project=self.provider_conf["gc_project_id"],
+            filter="name eq '(%s)'" % "|".join(deployment_names))
+        self.assertEqual(ds.new_batch_http_request.call_count, 1)
+        cs.instances().aggregatedList.assert_called_once_with(
+            project=self.provider_conf["gc_project_id"],
+            filter='(name = "running0") OR (name = "running1") OR '
+                   '(name = "suspended0")')
+        cs.instances().get.assert_not_called()
+        ds.deployments().get.assert_not_called()
+
+    def test_get_stacks_status_batch_exception(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        self.mock_batch(ds)
+        provider = Provider.init(self.provider_name)
+        ds.deployments().list.return_value.execute.return_value = {
+            "deployments": [self.mock_deployment("insert", "DONE")]
+        }
+        ds.resources().list.return_value.execute.side_effect = \
+            self.mock_exception(500)
+
+        # Run
+        with self.assertRaises(ProviderException):
+            provider.get_stacks_status([self.stack_name])
+
     def test_list_stacks_empty(self):
         # Setup
         ds = self.mock_deployment_service()
@@ -1089,9 +1650,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list.return_value.execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get.return_value.execute.side_effect = [
-            self.mock_server("RUNNING"),
-            self.mock_server("RUNNING")
+        cs.instances().list.return_value.execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("RUNNING"),
+                self.mock_server("RUNNING")
+            )
         ]
         ds.manifests().get.return_value.execute.side_effect = [
             self.mock_manifest()
@@ -1112,6 +1675,60 @@ class TestGcloudProvider(TestCase):
         }
         self.assertEqual(stack["outputs"], expected_outputs)
 
+    def test_get_stack_caches_outputs(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        cs = self.mock_compute_service()
+        ds.deployments().get.return_value.execute.side_effect = [
+            self.mock_deployment("insert", "DONE"),
+            self.mock_deployment("insert", "DONE"),
+            self.mock_deployment("update", "DONE", manifest_name="updated")
+        ]
+        ds.resources().list.return_value.execute.return_value = \
+            self.mock_resources(1)
+        cs.instances().list.return_value.execute.return_value = \
+            self.mock_servers(self.mock_server("RUNNING"))
+        ds.manifests().get.return_value.execute.return_value = \
+            self.mock_manifest()
+        ds.manifests().get.reset_mock()
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        stack1 = provider.get_stack(self.stack_name)
+        stack1["outputs"]["public_ip"] = "modified"
+        stack2 = Provider.init(self.provider_name).get_stack(self.stack_name)
+        stack3 = provider.get_stack(self.stack_name)
+
+        # Assert
+        # The manifest is only fetched again once it changes.
+        self.assertEqual(stack2["outputs"]["public_ip"], self.stack_ip)
+        self.assertEqual(stack3["outputs"]["public_ip"], self.stack_ip)
+        self.assertEqual(ds.manifests().get.call_count, 2)
+        ds.manifests().get.assert_called_with(
+            project=self.provider_conf["gc_project_id"],
+            deployment=self.deployment_name,
+            manifest="updated")
+
+    def test_get_stack_in_progress_doesnt_cache_outputs(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        ds.deployments().get.return_value.execute.return_value = \
+            self.mock_deployment("insert", "RUNNING")
+        ds.manifests().get.return_value.execute.side_effect = [
+            {},
+            self.mock_manifest()
+        ]
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        stack1 = provider.get_stack(self.stack_name)
+        stack2 = provider.get_stack(self.stack_name)
+
+        # Assert
+        self.assertEqual(stack1["status"], "CREATE_IN_PROGRESS")
+        self.assertEqual(stack1["outputs"], {})
+        self.assertEqual(stack2["outputs"]["public_ip"], self.stack_ip)
+
     @ddt.data(
         ("RUNNING", "STOPPING"),
         ("STOPPING", "RUNNING"),
@@ -1132,9 +1749,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list.return_value.execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get.return_value.execute.side_effect = [
-            self.mock_server(server_states[0]),
-            self.mock_server(server_states[1])
+        cs.instances().list.return_value.execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0]),
+                self.mock_server(server_states[1])
+            )
         ]
         ds.manifests().get.return_value.execute.side_effect = [
             self.mock_manifest()
@@ -1173,9 +1792,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list.return_value.execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get.return_value.execute.side_effect = [
-            self.mock_server(server_states[0]),
-            self.mock_server(server_states[1])
+        cs.instances().list.return_value.execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0]),
+                self.mock_server(server_states[1])
+            )
         ]
         ds.manifests().get.return_value.execute.side_effect = [
             self.mock_manifest()
@@ -1207,9 +1828,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list.return_value.execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get.return_value.execute.side_effect = [
-            self.mock_server("TERMINATED"),
-            self.mock_server("TERMINATED")
+        cs.instances().list.return_value.execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("TERMINATED"),
+                self.mock_server("TERMINATED")
+            )
         ]
         ds.manifests().get.return_value.execute.side_effect = [
             self.mock_manifest()
@@ -1315,7 +1938,7 @@ class TestGcloudProvider(TestCase):
             provider = Provider.init(self.provider_name)
             provider.get_stack(self.stack_name)
 
-    def test_exception_on_instances_get(self):
+    def test_exception_on_instances_list(self):
         # Setup
         ds = self.mock_deployment_service()
         cs = self.mock_compute_service()
@@ -1326,8 +1949,7 @@ class TestGcloudProvider(TestCase):
         ds.resources().list.return_value.execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get.return_value.execute.side_effect = [
-            self.mock_server("RUNNING"),
+        cs.instances().list.return_value.execute.side_effect = [
             self.mock_exception(500)
         ]
 
@@ -1347,9 +1969,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list.return_value.execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get.return_value.execute.side_effect = [
-            self.mock_server("RUNNING"),
-            self.mock_server("RUNNING")
+        cs.instances().list.return_value.execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("RUNNING"),
+                self.mock_server("RUNNING")
+            )
         ]
         ds.manifests().get.return_value.execute.side_effect = [
             self.mock_exception(500)
@@ -1396,9 +2020,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list().execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server("RUNNING"),
-            self.mock_server("RUNNING")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("RUNNING"),
+                self.mock_server("RUNNING")
+            )
         ]
         ds.manifests().get().execute.side_effect = [
             self.mock_manifest()
@@ -1468,6 +2094,24 @@ class TestGcloudProvider(TestCase):
             body=expected_body
         )
 
+    def test_create_stack_no_wait(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        ds.deployments().insert().execute.side_effect = [
+            self.mock_deployment("insert", "RUNNING")
+        ]
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        provider.set_template(self.stack_template)
+        provider.set_environment(self.stack_environment)
+        stack = provider.create_stack(self.stack_name, self.stack_run,
+                                      wait=False)
+
+        # Assertions
+        self.assertEqual("CREATE_IN_PROGRESS", stack["status"])
+        ds.operations().get().execute.assert_not_called()
+
     def test_create_stack_exception_with_no_environment(self):
         # Setup
         ds = self.mock_deployment_service()
@@ -1657,13 +2301,19 @@ class TestGcloudProvider(TestCase):
             self.mock_resources(2),
             self.mock_resources(2),
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2"),
-            self.mock_server("STOPPING", name="server1"),
-            self.mock_server("STOPPING", name="server2"),
-            self.mock_server("TERMINATED", name="server1"),
-            self.mock_server("TERMINATED", name="server2"),
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("STOPPING", name="server1"),
+                self.mock_server("STOPPING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("TERMINATED", name="server1"),
+                self.mock_server("TERMINATED", name="server2")
+            )
         ]
 
         # Run
@@ -1674,16 +2324,118 @@ class TestGcloudProvider(TestCase):
         self.assertIsInstance(provider_stack, dict)
         self.assertEqual("SUSPEND_COMPLETE", provider_stack["status"])
         self.assertRaises(KeyError, lambda: provider_stack["outputs"])
+        # The servers are stopped with a single batch request.
         cs.instances().stop.assert_has_calls([
             call(project=self.provider_conf["gc_project_id"],
                  zone="zone",
                  instance="server1"),
-            call().execute(),
             call(project=self.provider_conf["gc_project_id"],
                  zone="zone",
                  instance="server2"),
             call().execute(),
+            call().execute(),
+        ])
+        cs.new_batch_http_request.assert_called_once()
+
+    def test_suspend_wait_lists_servers_by_zone(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        cs = self.mock_compute_service()
+        resources = self.mock_resources(2)
+        resources["resources"] += self.mock_resources(
+            1, name="other", zone="zones/otherzone")["resources"]
+        ds.resources().list().execute.side_effect = [resources]
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("RUNNING", name="other0",
+                                 zone="otherzone")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server0"),
+                self.mock_server("RUNNING", name="server1")
+            ),
+            self.mock_servers(
+                self.mock_server("TERMINATED", name="other0",
+                                 zone="otherzone")
+            ),
+            self.mock_servers(
+                self.mock_server("TERMINATED", name="server0"),
+                self.mock_server("TERMINATED", name="server1")
+            ),
+        ]
+        cs.instances().list.reset_mock()
+        ds.resources().list.reset_mock()
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        provider_stack = provider.suspend_stack(self.stack_name)
+
+        # Assert
+        # The deployment's resources are only listed once, and its
+        # servers once per zone and poll.
+        self.assertEqual("SUSPEND_COMPLETE", provider_stack["status"])
+        ds.resources().list.assert_called_once_with(
+            project=self.provider_conf["gc_project_id"],
+            deployment=self.deployment_name,
+            filter='type = "compute.v1.instance"')
+        cs.instances().list.assert_has_calls([
+            call(project=self.provider_conf["gc_project_id"],
+                 zone="otherzone",
+                 filter='(name = "other0")'),
+            call().execute(),
+            call(project=self.provider_conf["gc_project_id"],
+                 zone="zone",
+                 filter='(name = "server0") OR (name = "server1")'),
+            call().execute(),
         ])
+        self.assertEqual(cs.instances().stop.call_count, 3)
+
+    def test_suspend_stack_missing_server(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        cs = self.mock_compute_service()
+        ds.resources().list().execute.return_value = self.mock_resources(2)
+        cs.instances().list().execute.return_value = self.mock_servers(
+            self.mock_server("RUNNING", name="server0")
+        )
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        with self.assertRaises(ProviderException) as cm:
+            provider.suspend_stack(self.stack_name)
+
+        # Assert
+        # Instance lists leave out missing servers, which mustn't go
+        # unnoticed.
+        self.assertIn("server1", str(cm.exception))
+        cs.instances().stop.assert_not_called()
+
+    def test_deployment_zones_not_cached_when_empty(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        cs = self.mock_compute_service()
+        ds.resources().list().execute.side_effect = [
+            {"resources": []},
+            self.mock_resources(2),
+            self.mock_resources(2),
+        ]
+        cs.instances().list().execute.return_value = self.mock_servers(
+            self.mock_server("RUNNING", name="server0"),
+            self.mock_server("RUNNING", name="server1")
+        )
+        provider = Provider.init(self.provider_name)
+
+        # Run
+        empty = provider._get_deployment_servers(self.deployment_name)
+        servers = provider._get_deployment_servers(self.deployment_name)
+        provider._get_deployment_servers(self.deployment_name)
+
+        # Assert
+        # A deployment whose servers don't show up yet is looked up again,
+        # and only remembered once they do.
+        self.assertEqual(empty, [])
+        self.assertEqual(len(servers), 2)
+        self.assertEqual(ds.resources().list().execute.call_count, 2)
 
     @ddt.data(
         ("RUNNING", "RUNNING")
@@ -1695,9 +2447,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list().execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0], name="server1"),
-            self.mock_server(server_states[1], name="server2")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0], name="server1"),
+                self.mock_server(server_states[1], name="server2")
+            )
         ]
 
         # Run
@@ -1708,16 +2462,18 @@ class TestGcloudProvider(TestCase):
         self.assertIsInstance(provider_stack, dict)
         self.assertEqual("SUSPEND_IN_PROGRESS", provider_stack["status"])
         self.assertRaises(KeyError, lambda: provider_stack["outputs"])
+        # The servers are stopped with a single batch request.
         cs.instances().stop.assert_has_calls([
             call(project=self.provider_conf["gc_project_id"],
                  zone="zone",
                  instance="server1"),
-            call().execute(),
             call(project=self.provider_conf["gc_project_id"],
                  zone="zone",
                  instance="server2"),
             call().execute(),
+            call().execute(),
         ])
+        cs.new_batch_http_request.assert_called_once()
 
     @ddt.data(
         ("RUNNING", "STOPPING"),
@@ -1730,9 +2486,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list().execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0], name="server1"),
-            self.mock_server(server_states[1], name="server2")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0], name="server1"),
+                self.mock_server(server_states[1], name="server2")
+            )
         ]
 
         # Run
@@ -1758,9 +2516,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list().execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0], name="server1"),
-            self.mock_server(server_states[1], name="server2")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0], name="server1"),
+                self.mock_server(server_states[1], name="server2")
+            )
         ]
 
         # Run
@@ -1788,9 +2548,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list().execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0], name="server1"),
-            self.mock_server(server_states[1], name="server2")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0], name="server1"),
+                self.mock_server(server_states[1], name="server2")
+            )
         ]
 
         # Run
@@ -1807,9 +2569,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list().execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server("RUNNING"),
-            self.mock_server("RUNNING")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("RUNNING"),
+                self.mock_server("RUNNING")
+            )
         ]
         cs.instances().stop().execute.side_effect = [
             self.mock_operation("stop", "RUNNING"),
@@ -1829,10 +2593,11 @@ class TestGcloudProvider(TestCase):
             self.mock_resources(2),
             self.mock_resources(2),
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server("RUNNING"),
-            self.mock_server("RUNNING"),
-            self.mock_server("STOPPING"),
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("RUNNING"),
+                self.mock_server("RUNNING")
+            ),
             self.mock_exception(500),
         ]
 
@@ -1858,9 +2623,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list().execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0]),
-            self.mock_server(server_states[1])
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0]),
+                self.mock_server(server_states[1])
+            )
         ]
 
         # Run
@@ -1880,13 +2647,19 @@ class TestGcloudProvider(TestCase):
             self.mock_resources(2),
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0], name="server1"),
-            self.mock_server(server_states[1], name="server2"),
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2"),
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0], name="server1"),
+                self.mock_server(server_states[1], name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            )
         ]
         ds.deployments().get.return_value.execute.side_effect = [
             self.mock_deployment("insert", "DONE")
@@ -1900,16 +2673,18 @@ class TestGcloudProvider(TestCase):
         stack = provider.resume_stack(self.stack_name)
 
         # Assert
+        # The servers are started with a single batch request.
         cs.instances().start.assert_has_calls([
             call(project=self.provider_conf["gc_project_id"],
                  zone="zone",
                  instance="server1"),
-            call().execute(),
             call(project=self.provider_conf["gc_project_id"],
                  zone="zone",
                  instance="server2"),
             call().execute(),
+            call().execute(),
         ])
+        cs.new_batch_http_request.assert_called_once()
         self.assertIsInstance(stack, dict)
         self.assertEqual("CREATE_COMPLETE", stack["status"])
         self.assertIsInstance(stack["outputs"], dict)
@@ -1933,13 +2708,19 @@ class TestGcloudProvider(TestCase):
             self.mock_resources(2),
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0], name="server1"),
-            self.mock_server(server_states[1], name="server2"),
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2"),
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0], name="server1"),
+                self.mock_server(server_states[1], name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            )
         ]
         ds.deployments().get.return_value.execute.side_effect = [
             self.mock_deployment("insert", "DONE")
@@ -1973,13 +2754,19 @@ class TestGcloudProvider(TestCase):
             self.mock_resources(2),
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0], name="server1"),
-            self.mock_server(server_states[1], name="server2"),
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2"),
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0], name="server1"),
+                self.mock_server(server_states[1], name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            )
         ]
         ds.deployments().get.return_value.execute.side_effect = [
             self.mock_deployment("insert", "DONE")
@@ -2015,13 +2802,19 @@ class TestGcloudProvider(TestCase):
             self.mock_resources(2),
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server(server_states[0], name="server1"),
-            self.mock_server(server_states[1], name="server2"),
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2"),
-            self.mock_server("RUNNING", name="server1"),
-            self.mock_server("RUNNING", name="server2")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server(server_states[0], name="server1"),
+                self.mock_server(server_states[1], name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            )
         ]
         ds.deployments().get.return_value.execute.side_effect = [
             self.mock_deployment("insert", "DONE")
@@ -2037,6 +2830,102 @@ class TestGcloudProvider(TestCase):
         # Assert
         cs.instances().start.assert_not_called()
 
+    def test_resume_stack_no_wait(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        cs = self.mock_compute_service()
+        ds.resources().list().execute.side_effect = [
+            self.mock_resources(2)
+        ]
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("TERMINATED", name="server1"),
+                self.mock_server("TERMINATED", name="server2")
+            )
+        ]
+
+        # Run
+        provider = Provider.init(self.provider_name)
+        stack = provider.resume_stack(self.stack_name, wait=False)
+
+        # Assert
+        self.assertEqual("RESUME_IN_PROGRESS", stack["status"])
+        self.assertEqual(cs.instances().start.call_count, 2)
+        ds.deployments().get.assert_not_called()
+
+    def test_async_resume_stack_mixed_states(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        cs = self.mock_compute_service()
+        ds.resources().list().execute.return_value = self.mock_resources(2)
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("TERMINATED", name="server1"),
+                self.mock_server("TERMINATED", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("STAGING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            )
+        ]
+        ds.deployments().get.return_value.execute.return_value = \
+            self.mock_deployment("insert", "DONE")
+        ds.manifests().get.return_value.execute.return_value = \
+            self.mock_manifest()
+        provider = AsyncProvider(self.provider_name)
+
+        # Run
+        with patch("hastexo.provider.asyncio.sleep",
+                   new_callable=AsyncMock) as mock_sleep:
+            stack = asyncio.run(provider.resume_stack(self.stack_name))
+
+        # Assert
+        # A deployment with one server still starting isn't resumed yet.
+        self.assertEqual(mock_sleep.await_count, 2)
+        self.assertEqual(cs.instances().list().execute.call_count, 4)
+        self.assertEqual("CREATE_COMPLETE", stack["status"])
+        self.assertEqual(stack["outputs"]["public_ip"], self.stack_ip)
+
+    def test_async_suspend_stack_mixed_states(self):
+        # Setup
+        ds = self.mock_deployment_service()
+        cs = self.mock_compute_service()
+        ds.resources().list().execute.return_value = self.mock_resources(2)
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("RUNNING", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("TERMINATED", name="server1"),
+                self.mock_server("RUNNING", name="server2")
+            ),
+            self.mock_servers(
+                self.mock_server("TERMINATED", name="server1"),
+                self.mock_server("TERMINATED", name="server2")
+            )
+        ]
+        provider = AsyncProvider(self.provider_name)
+
+        # Run
+        with patch("hastexo.provider.asyncio.sleep",
+                   new_callable=AsyncMock) as mock_sleep:
+            stack = asyncio.run(provider.suspend_stack(self.stack_name))
+
+        # Assert
+        # A deployment with one server still running isn't suspended yet.
+        self.assertEqual(mock_sleep.await_count, 2)
+        self.assertEqual(cs.instances().list().execute.call_count, 3)
+        self.assertEqual({"status": "SUSPEND_COMPLETE"}, stack)
+
     def test_resume_stack_exception_on_start(self):
         # Setup
         ds = self.mock_deployment_service()
@@ -2044,9 +2933,11 @@ class TestGcloudProvider(TestCase):
         ds.resources().list().execute.side_effect = [
             self.mock_resources(2)
         ]
-        cs.instances().get().execute.side_effect = [
-            self.mock_server("TERMINATED"),
-            self.mock_server("TERMINATED")
+        cs.instances().list().execute.side_effect = [
+            self.mock_servers(
+                self.mock_server("TERMINATED"),
+                self.mock_server("TERMINATED")
+            )
         ]
         cs.instances().start().execute.side_effect = [
             self.mock_operation("start", "RUNNING"),
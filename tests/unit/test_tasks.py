@@ -1,16 +1,21 @@
 import copy
+import time
 import socket
+import threading
 
 from unittest import TestCase
 from unittest.mock import Mock, patch
 
-from hastexo.models import Stack
+from hastexo.models import LabUsage, ProviderOccupancy, Stack
 from hastexo.provider import ProviderException
 from hastexo.common import (
     get_stack,
+    get_suspend_times,
     update_stack,
     update_stack_fields,
     RemoteExecException,
+    RemoteExecTimeout,
+    ssh_pool,
 )
 from hastexo.tasks import (
     LaunchStackTask,
@@ -19,8 +24,12 @@ from hastexo.tasks import (
     CheckStudentProgressTask,
 )
 from celery.exceptions import SoftTimeLimitExceeded
+from heatclient.exc import HTTPOverLimit
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.db.utils import OperationalError
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 
@@ -70,6 +79,7 @@ class HastexoTestCase(TestCase):
         self.settings = {
             "sleep_timeout": 0,
             "delete_attempts": 2,
+            "ssh_pool_size": 16,
         }
 
         # Create a set of mock stacks to be returned by the provider mock.
@@ -102,6 +112,9 @@ class HastexoTestCase(TestCase):
         # Clear database
         Stack.objects.all().delete()
 
+        # Clear pooled SSH connections
+        ssh_pool.clear()
+
         self.learner, _ = User.objects.get_or_create(
             username="fake_user",
             email="user@example.com"
@@ -221,6 +234,287 @@ class TestLaunchStackTask(HastexoTestCase):
         )
         self.assertFalse(self.mocks["remote_exec"].called)
 
+    def test_create_stack_nonblocking(self):
+        # Setup
+        self.mocks["Provider"].init.side_effect = self.mock_providers * 3
+        provider = self.mock_providers[0]
+        provider.get_poller.return_value.next_delay.return_value = 10
+        provider.get_stack.side_effect = [
+            self.stacks["DELETE_COMPLETE"],
+            self.stacks["CREATE_IN_PROGRESS"],
+            self.stacks["CREATE_COMPLETE"]
+        ]
+        provider.create_stack.side_effect = [{
+            "status": "CREATE_IN_PROGRESS",
+            "outputs": {},
+            "private_key": "generated_key"
+        }]
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True}):
+            with patch.object(LaunchStackTask,
+                              "apply_async") as mock_apply_async:
+                LaunchStackTask.run(**self.kwargs)
+
+                # Assertions
+                # The creation was issued, but not waited for.
+                provider.create_stack.assert_called_once_with(
+                    self.stack_name, self.stack_run, key_type="",
+                    wait=False)
+                self.assertEqual(self.get_stack("status"), "LAUNCH_PENDING")
+                kwargs = mock_apply_async.call_args[1]
+                self.assertEqual(kwargs["countdown"], 10)
+                self.assertEqual(kwargs["kwargs"]["step"], "create")
+                self.assertEqual(kwargs["kwargs"]["polls"], 1)
+                self.assertFalse(kwargs["kwargs"]["reset"])
+
+                # Run the checks
+                LaunchStackTask.run(**kwargs["kwargs"])
+                self.assertEqual(self.get_stack("status"), "LAUNCH_PENDING")
+                kwargs = mock_apply_async.call_args[1]
+                self.assertEqual(kwargs["kwargs"]["polls"], 2)
+                LaunchStackTask.run(**kwargs["kwargs"])
+
+        # Assertions
+        self.assertEqual(mock_apply_async.call_count, 2)
+        provider.get_poller.assert_called_with("create", 1)
+        stack = self.get_stack()
+        self.assertEqual(stack.status, "CREATE_COMPLETE")
+        self.assertEqual(stack.provider, self.providers[0]["name"])
+        self.assertEqual(stack.key, "generated_key")
+        self.mocks["ssh_to"].assert_called_once_with(
+            self.stack_user_name,
+            self.STACK_IP,
+            "generated_key",
+            attempts=1
+        )
+
+    def test_resume_stack_nonblocking(self):
+        # Setup
+        self.update_stack({"provider": self.providers[0]["name"]})
+        self.mocks["Provider"].init.side_effect = self.mock_providers * 4
+        provider = self.mock_providers[0]
+        provider.get_poller.return_value.next_delay.return_value = 10
+        provider.get_stack.side_effect = [
+            self.stacks["SUSPEND_COMPLETE"],
+            self.stacks["SUSPEND_COMPLETE"],
+            self.stacks["RESUME_COMPLETE"],
+            self.stacks["RESUME_COMPLETE"]
+        ]
+        provider.resume_stack.side_effect = [{
+            "status": "RESUME_IN_PROGRESS",
+            "outputs": {}
+        }]
+        ssh = Mock()
+        self.mocks["ssh_to"].side_effect = [None, ssh]
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True}):
+            with patch.object(LaunchStackTask,
+                              "apply_async") as mock_apply_async:
+                LaunchStackTask.run(**self.kwargs)
+                provider.resume_stack.assert_called_once_with(
+                    self.stack_name, wait=False)
+
+                # The servers haven't started yet.
+                kwargs = mock_apply_async.call_args[1]["kwargs"]
+                LaunchStackTask.run(**kwargs)
+                provider.finish_resume.assert_not_called()
+
+                # The stack resumed, but isn't reachable yet.
+                kwargs = mock_apply_async.call_args[1]["kwargs"]
+                self.assertEqual(kwargs["step"], "resume")
+                self.assertEqual(kwargs["polls"], 2)
+                LaunchStackTask.run(**kwargs)
+                provider.finish_resume.assert_called_once_with(
+                    self.stack_name,
+                    self.stacks["RESUME_COMPLETE"]["outputs"])
+                self.mocks["remote_exec"].assert_not_called()
+
+                kwargs = mock_apply_async.call_args[1]["kwargs"]
+                self.assertEqual(kwargs["step"], "ssh")
+                self.assertEqual(kwargs["polls"], 1)
+                self.assertTrue(kwargs["was_resumed"])
+                LaunchStackTask.run(**kwargs)
+
+        # Assertions
+        self.assertEqual(mock_apply_async.call_count, 3)
+        self.assertEqual(self.get_stack("status"), "RESUME_COMPLETE")
+        provider.finish_resume.assert_called_once()
+        self.mocks["remote_exec"].assert_called_once_with(
+            ssh,
+            self.read_from_contentstore,
+            params="resume"
+        )
+
+    def test_launch_nonblocking_timeout(self):
+        # Setup
+        self.update_stack({"provider": self.providers[0]["name"]})
+        provider = self.mock_providers[0]
+        provider.get_stack.side_effect = [
+            self.stacks["CREATE_IN_PROGRESS"]
+        ]
+        kwargs = dict(self.kwargs,
+                      started=time.time() - 1000,
+                      polls=10,
+                      step="create",
+                      launch_task_id="")
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True,
+                         "launch_timeout": 900}):
+            with patch.object(LaunchStackTask,
+                              "apply_async") as mock_apply_async:
+                LaunchStackTask.run(**kwargs)
+
+        # Assertions
+        mock_apply_async.assert_not_called()
+        self.assertEqual(self.get_stack("status"), "LAUNCH_TIMEOUT")
+        provider.delete_stack.assert_called_once_with(self.stack_name, False)
+
+    def test_launch_nonblocking_relaunched(self):
+        # Setup
+        self.update_stack({
+            "provider": self.providers[0]["name"],
+            "launch_task_id": "new_task_id"
+        })
+        kwargs = dict(self.kwargs,
+                      started=time.time(),
+                      polls=1,
+                      step="create",
+                      launch_task_id="old_task_id")
+
+        # Run
+        LaunchStackTask.run(**kwargs)
+
+        # Assertions
+        self.mock_providers[0].get_stack.assert_not_called()
+        self.assertEqual(self.get_stack("status"), "LAUNCH_PENDING")
+
+    def test_launch_nonblocking_block_timeout(self):
+        # Setup
+        self.update_stack({"provider": self.providers[0]["name"]})
+        provider = self.mock_providers[0]
+        provider.get_stack.side_effect = [
+            self.stacks["CREATE_IN_PROGRESS"]
+        ]
+        kwargs = dict(self.kwargs,
+                      started=time.time() - 100,
+                      polls=1,
+                      step="create",
+                      launch_task_id="",
+                      launch_timeout=60)
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True,
+                         "launch_timeout": 900}):
+            with patch.object(LaunchStackTask,
+                              "apply_async") as mock_apply_async:
+                LaunchStackTask.run(**kwargs)
+
+        # Assertions
+        # The block's launch timeout overrides the global one.
+        mock_apply_async.assert_not_called()
+        self.assertEqual(self.get_stack("status"), "LAUNCH_TIMEOUT")
+
+    def test_launch_nonblocking_time_limits(self):
+        # Setup
+        provider = self.mock_providers[0]
+        provider.get_poller.return_value.next_delay.return_value = 10
+        provider.get_stack.side_effect = [
+            self.stacks["DELETE_COMPLETE"]
+        ]
+        provider.create_stack.side_effect = [{
+            "status": "CREATE_IN_PROGRESS",
+            "outputs": {}
+        }]
+        LaunchStackTask.push_request(timelimit=(330, 300))
+        self.addCleanup(LaunchStackTask.pop_request)
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True}):
+            with patch.object(LaunchStackTask,
+                              "apply_async") as mock_apply_async:
+                LaunchStackTask.run(**dict(self.kwargs, launch_timeout=300))
+
+        # Assertions
+        # The following run gets the same limits, and the block's timeout.
+        kwargs = mock_apply_async.call_args[1]
+        self.assertEqual(kwargs["time_limit"], 330)
+        self.assertEqual(kwargs["soft_time_limit"], 300)
+        self.assertEqual(kwargs["expires"], 310)
+        self.assertEqual(kwargs["kwargs"]["launch_timeout"], 300)
+
+    def test_launch_nonblocking_error(self):
+        # Setup
+        self.update_stack({"provider": self.providers[0]["name"]})
+        provider = self.mock_providers[0]
+        provider.get_stack.side_effect = RuntimeError("bogus error")
+        kwargs = dict(self.kwargs,
+                      started=time.time(),
+                      polls=1,
+                      step="create",
+                      launch_task_id="")
+
+        # Run
+        with self.assertRaises(RuntimeError):
+            LaunchStackTask.run(**kwargs)
+
+        # Assertions
+        # The XBlock doesn't see the result of this run, so the error is
+        # recorded in the stack.
+        stack = self.get_stack()
+        self.assertEqual(stack.status, "LAUNCH_ERROR")
+        self.assertIn("bogus error", stack.error_msg)
+
+    def test_launch_nonblocking_reset(self):
+        # Setup
+        self.update_stack({"provider": self.providers[0]["name"]})
+        self.mocks["Provider"].init.side_effect = self.mock_providers * 2
+        provider = self.mock_providers[0]
+        provider.get_poller.return_value.next_delay.return_value = 10
+        provider.get_stack.side_effect = [
+            self.stacks["CREATE_COMPLETE"],
+            self.stacks["DELETE_COMPLETE"]
+        ]
+        provider.delete_stack.side_effect = [
+            self.stacks["DELETE_COMPLETE"]
+        ]
+        provider.create_stack.side_effect = [{
+            "status": "CREATE_IN_PROGRESS",
+            "outputs": {}
+        }]
+        kwargs = dict(self.kwargs,
+                      started=time.time(),
+                      polls=1,
+                      step="wait",
+                      reset=True,
+                      launch_task_id="")
+
+        # Run
+        with patch.object(LaunchStackTask,
+                          "apply_async") as mock_apply_async:
+            LaunchStackTask.run(**kwargs)
+
+        # Assertions
+        # The stack that was in the middle of changing state is reset, and
+        # created anew through the provider capacity checks.
+        provider.delete_stack.assert_called_once_with(self.stack_name,
+                                                      wait=False)
+        provider.create_stack.assert_called_once_with(
+            self.stack_name, self.stack_run, key_type="", wait=False)
+        self.assertEqual(
+            ProviderOccupancy.objects.get(course_id=self.course_id,
+                                          provider=provider.name).count, 1)
+        kwargs = mock_apply_async.call_args[1]["kwargs"]
+        self.assertEqual(kwargs["step"], "create")
+        self.assertFalse(kwargs["reset"])
+
     def test_create_failed_long_error_msg(self):
         # Setup
         for m in self.mock_providers:
@@ -257,15 +551,16 @@ class TestLaunchStackTask(HastexoTestCase):
             self.stacks["CREATE_COMPLETE"]
         ]
 
-        # Mock OperationalError 2 times with Stack.objects.filter()
-        with patch("hastexo.models.Stack.objects.filter") as filter_patch:
+        # Mock OperationalError 2 times when reserving the provider
+        with patch("hastexo.models.ProviderOccupancy.objects."
+                   "select_for_update") as filter_patch:
             filter_patch.side_effect = [OperationalError,
                                         OperationalError,
-                                        Stack.objects]
+                                        ProviderOccupancy.objects]
             # Run
             LaunchStackTask.run(**self.kwargs)
 
-        # The filter() method would have to be called 3 times
+        # The select_for_update() method would have to be called 3 times
         # (2 failures with an OperationalError, then 1 success).
         self.assertEqual(filter_patch.call_count, 3)
 
@@ -304,8 +599,9 @@ class TestLaunchStackTask(HastexoTestCase):
             self.stacks["CREATE_FAILED"]
         ]
 
-        # Mock OperationalError 3 times with Stack.objects.filter()
-        with patch("hastexo.models.Stack.objects.filter") as filter_patch:
+        # Mock OperationalError 3 times when reserving the provider
+        with patch("hastexo.models.ProviderOccupancy.objects."
+                   "select_for_update") as filter_patch:
             filter_patch.side_effect = [OperationalError,
                                         OperationalError,
                                         OperationalError]
@@ -313,7 +609,8 @@ class TestLaunchStackTask(HastexoTestCase):
             with self.assertRaises(OperationalError):
                 LaunchStackTask.run(**self.kwargs)
 
-            # The filter() method would have to be called 3 times.
+            # The select_for_update() method would have to be called 3
+            # times.
             self.assertEqual(filter_patch.call_count, 3)
 
     def test_create_stack_has_no_ip(self):
@@ -663,6 +960,33 @@ class TestLaunchStackTask(HastexoTestCase):
             key_type=""
         )
 
+    def test_reserve_provider(self):
+        # Setup
+        provider = self.mock_providers[1]
+        provider.capacity = 2
+        data = {
+            "provider": provider.name,
+            "status": "CREATE_COMPLETE"
+        }
+        self.create_stack("stack_0", self.course_id, "student_0", data)
+        self.update_stack({"status": "LAUNCH_PENDING"})
+
+        # Run
+        with patch.multiple(LaunchStackTask, create=True,
+                            stack_id=self.kwargs["stack_id"]):
+            first_count = LaunchStackTask.reserve_provider(provider)
+            second_count = LaunchStackTask.reserve_provider(provider)
+
+        # Assertions
+        # The stack takes up the last slot in the provider, and doesn't
+        # count against itself when reserving it again.
+        self.assertEqual(first_count, 1)
+        self.assertEqual(second_count, 1)
+        self.assertEqual(self.get_stack("provider"), provider.name)
+        occupancy = ProviderOccupancy.objects.get(course_id=self.course_id,
+                                                  provider=provider.name)
+        self.assertEqual(occupancy.count, 2)
+
     def test_all_providers_full(self):
         # Setup
         capacity = 2
@@ -1585,6 +1909,63 @@ class TestLaunchStackTask(HastexoTestCase):
         self.assertEqual(stack.status, "SUSPEND_COMPLETE")
         provider.resume_stack.assert_not_called()
 
+    def test_lab_usage_lookup_does_not_scale_with_history(self):
+        # Setup
+        LabUsage.objects.filter(learner=self.learner).delete()
+        now = timezone.now()
+        task = LaunchStackTask
+        task.learner_id = self.learner.id
+
+        def add_history(count):
+            for i in range(count):
+                stack = Stack.objects.create(
+                    student_id=self.student_id,
+                    course_id="history_course_%d_%d" % (count, i),
+                    name=self.stack_name,
+                    learner=self.learner,
+                    launch_timestamp=now - timezone.timedelta(
+                        days=i, seconds=600),
+                    suspend_timestamp=now - timezone.timedelta(
+                        days=i, seconds=500)
+                )
+                stack.status = "SUSPEND_COMPLETE"
+                stack.save()
+
+        # Run
+        add_history(2)
+        with CaptureQueriesContext(connection) as small_history:
+            small_usage = task.get_learner_lab_usage()
+        add_history(50)
+        with CaptureQueriesContext(connection) as large_history:
+            large_usage = task.get_learner_lab_usage()
+
+        # Assertions
+        # The time spent is the sum over all sessions, and the number of
+        # queries does not depend on the size of the learner's history.
+        self.assertEqual(small_usage, 2 * 100)
+        self.assertEqual(large_usage, 52 * 100)
+        self.assertEqual(len(small_history), 1)
+        self.assertEqual(len(large_history), 1)
+
+    def test_lab_usage_ignores_sessions_older_than_a_year(self):
+        # Setup
+        LabUsage.objects.filter(learner=self.learner).delete()
+        today = timezone.now().date()
+        LabUsage.objects.create(learner=self.learner,
+                                date=today,
+                                seconds=100)
+        LabUsage.objects.create(learner=self.learner,
+                                date=today - timezone.timedelta(days=400),
+                                seconds=1000)
+        task = LaunchStackTask
+        task.learner_id = self.learner.id
+
+        # Run
+        usage = task.get_learner_lab_usage()
+
+        # Assertions
+        self.assertEqual(usage, 100)
+
 
 class TestSuspendStackTask(HastexoTestCase):
     def test_suspend_up_stack(self):
@@ -1618,6 +1999,185 @@ class TestSuspendStackTask(HastexoTestCase):
             params="suspend"
         )
 
+    def test_suspend_closes_pooled_connections(self):
+        # Setup
+        self.update_stack({
+            "ip": self.STACK_IP,
+            "provider": self.providers[0]["name"],
+            "status": "SUSPEND_PENDING"
+        })
+        provider = self.mock_providers[0]
+        provider.get_stack.side_effect = [
+            self.stacks["RESUME_COMPLETE"]
+        ]
+        provider.suspend_stack.side_effect = [
+            self.stacks["SUSPEND_COMPLETE"]
+        ]
+        ssh = self.mocks["ssh_to"].return_value
+
+        # Run
+        CheckStudentProgressTask.run(tests=["test pass"],
+                                     stack_ip=self.STACK_IP,
+                                     stack_key=self.stack_key,
+                                     stack_user_name=self.stack_user_name)
+        SuspendStackTask.run(**self.kwargs)
+
+        # Assertions
+        # The pre-suspend hook reused the connection opened by the check,
+        # which was then closed before suspending.
+        self.mocks["ssh_to"].assert_called_once()
+        ssh.close.assert_called_once_with()
+        self.assertEqual(self.get_stack("status"), "SUSPEND_COMPLETE")
+
+    def test_suspend_records_suspend_time(self):
+        # Setup
+        cache.clear()
+        self.update_stack({
+            "provider": self.providers[0]["name"],
+            "status": "SUSPEND_PENDING"
+        })
+        provider = self.mock_providers[0]
+        self.mocks["Provider"].init.side_effect = None
+        self.mocks["Provider"].init.return_value = provider
+        provider.get_stack.side_effect = [
+            self.stacks["RESUME_COMPLETE"],
+            self.stacks["RESUME_COMPLETE"]
+        ]
+        provider.suspend_stack.side_effect = [
+            self.stacks["SUSPEND_COMPLETE"],
+            ProviderException(HTTPOverLimit())
+        ]
+
+        # Run
+        SuspendStackTask.run(**self.kwargs)
+        SuspendStackTask.run(**self.kwargs)
+
+        # Assertions
+        samples = get_suspend_times(self.providers[0]["name"])
+        self.assertEqual(len(samples), 2)
+        self.assertFalse(samples[0][2])
+        self.assertTrue(samples[1][2])
+        self.assertEqual(get_suspend_times(self.providers[1]["name"]), [])
+
+    def test_suspend_nonblocking(self):
+        # Setup
+        self.update_stack({
+            "provider": self.providers[0]["name"],
+            "status": "SUSPEND_PENDING"
+        })
+        provider = self.mock_providers[0]
+        self.mocks["Provider"].init.side_effect = None
+        self.mocks["Provider"].init.return_value = provider
+        provider.get_poller.return_value.next_delay.return_value = 10
+        provider.get_stack.side_effect = [
+            self.stacks["RESUME_COMPLETE"],
+            self.stacks["SUSPEND_IN_PROGRESS"],
+            self.stacks["SUSPEND_COMPLETE"]
+        ]
+        provider.suspend_stack.side_effect = [
+            self.stacks["SUSPEND_IN_PROGRESS"]
+        ]
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True}):
+            with patch.object(SuspendStackTask,
+                              "apply_async") as mock_apply_async:
+                SuspendStackTask.run(**self.kwargs)
+
+                # Assertions
+                # The suspension was issued, but not waited for.
+                provider.suspend_stack.assert_called_once_with(
+                    self.stack_name, wait=False)
+                self.assertEqual(self.get_stack("status"), "SUSPEND_PENDING")
+                mock_apply_async.assert_called_once()
+                kwargs = mock_apply_async.call_args[1]
+                self.assertEqual(kwargs["countdown"], 10)
+                self.assertEqual(kwargs["kwargs"]["polls"], 1)
+
+                # Run the checks
+                SuspendStackTask.run(**kwargs["kwargs"])
+                self.assertEqual(self.get_stack("status"), "SUSPEND_PENDING")
+                kwargs = mock_apply_async.call_args[1]
+                self.assertEqual(kwargs["kwargs"]["polls"], 2)
+                SuspendStackTask.run(**kwargs["kwargs"])
+
+        # Assertions
+        self.assertEqual(mock_apply_async.call_count, 2)
+        provider.get_poller.assert_called_with("suspend", 1)
+        stack = self.get_stack()
+        self.assertEqual(stack.status, "SUSPEND_COMPLETE")
+        self.assertIsNotNone(stack.delete_by)
+
+    def test_suspend_blocking_doesnt_reschedule(self):
+        # Setup
+        self.update_stack({
+            "provider": self.providers[0]["name"],
+            "status": "SUSPEND_PENDING"
+        })
+        provider = self.mock_providers[0]
+        provider.get_stack.side_effect = [
+            self.stacks["RESUME_IN_PROGRESS"]
+        ]
+
+        # Run
+        with patch.object(SuspendStackTask,
+                          "apply_async") as mock_apply_async:
+            SuspendStackTask.run(**self.kwargs)
+
+        # Assertions
+        # The stack can't be suspended, which is recorded as before.
+        mock_apply_async.assert_not_called()
+        provider.suspend_stack.assert_not_called()
+        self.assertEqual(self.get_stack("status"), "RESUME_IN_PROGRESS")
+
+    def test_suspend_nonblocking_doesnt_track_other_operations(self):
+        # Setup
+        self.update_stack({
+            "provider": self.providers[0]["name"],
+            "status": "SUSPEND_PENDING"
+        })
+        provider = self.mock_providers[0]
+        provider.get_stack.side_effect = [
+            self.stacks["RESUME_IN_PROGRESS"]
+        ]
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True}):
+            with patch.object(SuspendStackTask,
+                              "apply_async") as mock_apply_async:
+                SuspendStackTask.run(**self.kwargs)
+
+        # Assertions
+        mock_apply_async.assert_not_called()
+        self.assertEqual(self.get_stack("status"), "RESUME_IN_PROGRESS")
+
+    def test_suspend_nonblocking_timeout(self):
+        # Setup
+        self.update_stack({
+            "provider": self.providers[0]["name"],
+            "status": "SUSPEND_PENDING"
+        })
+        provider = self.mock_providers[0]
+        provider.get_stack.side_effect = [
+            self.stacks["SUSPEND_IN_PROGRESS"]
+        ]
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True,
+                         "suspend_task_timeout": 900}):
+            with patch.object(SuspendStackTask,
+                              "apply_async") as mock_apply_async:
+                SuspendStackTask.run(stack_id=self.kwargs["stack_id"],
+                                     started=time.time() - 1000,
+                                     polls=10)
+
+        # Assertions
+        mock_apply_async.assert_not_called()
+        self.assertEqual(self.get_stack("status"), "SUSPEND_FAILED")
+
     def test_suspend_suspend_failed_stack(self):
         # Setup
         self.update_stack({
@@ -1892,6 +2452,84 @@ class TestDeleteStackTask(HastexoTestCase):
         )
         provider.delete_stack.assert_called()
 
+    def test_delete_blocking_doesnt_reschedule(self):
+        # Setup
+        self.hook_events["delete"] = False
+        self.update_stack({
+            "provider": self.providers[0]["name"],
+            "status": "DELETE_PENDING",
+            "hook_events": self.hook_events
+        })
+        provider = self.mock_providers[0]
+        provider.get_stack.side_effect = [
+            self.stacks["CREATE_COMPLETE"]
+        ]
+        provider.delete_stack.side_effect = [
+            self.stacks["DELETE_IN_PROGRESS"]
+        ]
+
+        # Run
+        with patch.object(DeleteStackTask,
+                          "apply_async") as mock_apply_async:
+            DeleteStackTask.run(**self.kwargs)
+
+        # Assertions
+        mock_apply_async.assert_not_called()
+        self.assertEqual(self.get_stack("status"), "DELETE_IN_PROGRESS")
+
+    def test_delete_nonblocking(self):
+        # Setup
+        self.hook_events["delete"] = False
+        self.update_stack({
+            "provider": self.providers[0]["name"],
+            "status": "DELETE_PENDING",
+            "hook_events": self.hook_events
+        })
+        provider = self.mock_providers[0]
+        self.mocks["Provider"].init.side_effect = None
+        self.mocks["Provider"].init.return_value = provider
+        provider.get_poller.return_value.next_delay.return_value = 10
+        provider.get_stack.side_effect = [
+            self.stacks["CREATE_COMPLETE"],
+            self.stacks["DELETE_FAILED"],
+            self.stacks["DELETE_FAILED"],
+            self.stacks["DELETE_COMPLETE"]
+        ]
+        provider.delete_stack.side_effect = [
+            self.stacks["DELETE_IN_PROGRESS"],
+            self.stacks["DELETE_IN_PROGRESS"]
+        ]
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"provider_nonblocking": True}):
+            with patch.object(DeleteStackTask,
+                              "apply_async") as mock_apply_async:
+                DeleteStackTask.run(**self.kwargs)
+
+                # Assertions
+                provider.delete_stack.assert_called_once_with(
+                    self.stack_name, wait=False)
+                self.assertEqual(self.get_stack("status"), "DELETE_PENDING")
+                kwargs = mock_apply_async.call_args[1]
+                self.assertEqual(kwargs["kwargs"]["attempt"], 0)
+
+                # The first check finds the deletion failed, so it's
+                # attempted again.
+                DeleteStackTask.run(**kwargs["kwargs"])
+                self.assertEqual(provider.delete_stack.call_count, 2)
+                self.assertEqual(self.get_stack("status"), "DELETE_PENDING")
+                kwargs = mock_apply_async.call_args[1]
+                self.assertEqual(kwargs["kwargs"]["attempt"], 1)
+
+                DeleteStackTask.run(**kwargs["kwargs"])
+
+        # Assertions
+        self.assertEqual(mock_apply_async.call_count, 2)
+        stack = self.get_stack()
+        self.assertEqual(stack.status, "DELETE_COMPLETE")
+        self.assertEqual(stack.provider, "")
+
     def test_delete_failed_long_error_msg(self):
         # Setup
         self.update_stack({
@@ -2222,6 +2860,202 @@ class TestCheckStudentProgressTask(HastexoTestCase):
         self.assertEqual(res["total"], 4)
         self.assertEqual(res["errors"], ["single line", "line 1\nline 2"])
 
+    def test_check_student_progress_reuses_connection(self):
+        # Setup
+        kwargs = {
+            "tests": ["test pass"],
+            "stack_ip": self.STACK_IP,
+            "stack_key": self.stack_key,
+            "stack_user_name": self.stack_user_name
+        }
+
+        # Run
+        CheckStudentProgressTask.run(**kwargs)
+        res = CheckStudentProgressTask.run(**kwargs)
+
+        # Assertions
+        self.assertEqual(res["pass"], 1)
+        self.mocks["ssh_to"].assert_called_once_with(self.stack_user_name,
+                                                     self.STACK_IP,
+                                                     self.stack_key)
+        self.mocks["ssh_to"].return_value.close.assert_not_called()
+
+    def test_check_student_progress_without_pool(self):
+        # Setup
+        kwargs = {
+            "tests": ["test pass"],
+            "stack_ip": self.STACK_IP,
+            "stack_key": self.stack_key,
+            "stack_user_name": self.stack_user_name
+        }
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"ssh_pool_size": 0}):
+            CheckStudentProgressTask.run(**kwargs)
+            CheckStudentProgressTask.run(**kwargs)
+
+        # Assertions
+        self.assertEqual(self.mocks["ssh_to"].call_count, 2)
+        self.assertEqual(
+            self.mocks["ssh_to"].return_value.close.call_count, 2)
+
+    def test_check_student_progress_batched(self):
+        # Setup
+        tests = [
+            "test pass",
+            "test fail",
+            "test fail",
+            "test pass"
+        ]
+        kwargs = {
+            "tests": tests,
+            "stack_ip": self.STACK_IP,
+            "stack_key": self.stack_key,
+            "stack_user_name": self.stack_user_name
+        }
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"check_batched": True}):
+            with patch("hastexo.tasks.remote_exec_batch") as mock_batch:
+                mock_batch.return_value = [
+                    (0, b""),
+                    (1, b"line 1\nline 2"),
+                    (2, b""),
+                    (0, b"warning")
+                ]
+                res = CheckStudentProgressTask.run(**kwargs)
+
+        # Assertions
+        mock_batch.assert_called_once_with(self.mocks["ssh_to"].return_value,
+                                           tests)
+        self.mocks["remote_exec"].assert_not_called()
+        self.assertEqual(res["status"], "CHECK_PROGRESS_COMPLETE")
+        self.assertEqual(res["pass"], 2)
+        self.assertEqual(res["total"], 4)
+        self.assertEqual(res["errors"], ["line 1\nline 2"])
+
+    def test_check_student_progress_batched_timeout(self):
+        # Setup
+        kwargs = {
+            "tests": ["test pass"],
+            "stack_ip": self.STACK_IP,
+            "stack_key": self.stack_key,
+            "stack_user_name": self.stack_user_name
+        }
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"check_batched": True}):
+            with patch("hastexo.tasks.remote_exec_batch") as mock_batch:
+                mock_batch.side_effect = RemoteExecTimeout()
+                res = CheckStudentProgressTask.run(**kwargs)
+
+        # Assertions
+        self.assertEqual(res["status"], "CHECK_PROGRESS_TIMEOUT")
+        self.assertTrue(res["error"])
+
+    def test_check_student_progress_parallel(self):
+        # Setup
+        # Each pair of tests has to run at the same time to get past the
+        # barrier.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def remote_exec(ssh, test, reuse_sftp=None):
+            barrier.wait()
+            if test.startswith("test fail"):
+                raise RemoteExecException(test.encode())
+            return 0
+
+        self.mocks["remote_exec"].side_effect = remote_exec
+        ssh = self.mocks["ssh_to"].return_value
+        sftp = ssh.open_sftp.return_value
+        tests = [
+            "test pass",
+            "test fail 1",
+            "test fail 2",
+            "test pass"
+        ]
+        kwargs = {
+            "tests": tests,
+            "tests_parallel": True,
+            "stack_ip": self.STACK_IP,
+            "stack_key": self.stack_key,
+            "stack_user_name": self.stack_user_name
+        }
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"check_concurrency": 2}):
+            res = CheckStudentProgressTask.run(**kwargs)
+
+        # Assertions
+        self.assertEqual(res["status"], "CHECK_PROGRESS_COMPLETE")
+        self.assertEqual(res["pass"], 2)
+        self.assertEqual(res["total"], 4)
+        self.assertEqual(res["errors"], ["test fail 1", "test fail 2"])
+        self.assertEqual(ssh.open_sftp.call_count, 2)
+        self.assertEqual(sftp.close.call_count, 2)
+
+    def test_check_student_progress_parallel_timeout(self):
+        # Setup
+        self.mocks["remote_exec"].side_effect = [
+            0,
+            RemoteExecTimeout()
+        ]
+        kwargs = {
+            "tests": ["test pass", "test timeout"],
+            "tests_parallel": True,
+            "stack_ip": self.STACK_IP,
+            "stack_key": self.stack_key,
+            "stack_user_name": self.stack_user_name
+        }
+
+        # Run
+        res = CheckStudentProgressTask.run(**kwargs)
+
+        # Assertions
+        self.assertEqual(res["status"], "CHECK_PROGRESS_TIMEOUT")
+        self.assertTrue(res["error"])
+
+    def test_check_student_progress_parallel_time_limit(self):
+        # Setup
+        # The second test is still running when the task hits its soft time
+        # limit.
+        started = threading.Event()
+        finish = threading.Event()
+        finished = threading.Event()
+        self.addCleanup(finish.set)
+
+        def remote_exec(ssh, test, reuse_sftp=None):
+            if test == "test hang":
+                started.set()
+                finish.wait(5)
+                finished.set()
+                return 0
+            started.wait(5)
+            raise SoftTimeLimitExceeded()
+
+        self.mocks["remote_exec"].side_effect = remote_exec
+        kwargs = {
+            "tests": ["test limit", "test hang"],
+            "tests_parallel": True,
+            "stack_ip": self.STACK_IP,
+            "stack_key": self.stack_key,
+            "stack_user_name": self.stack_user_name
+        }
+
+        # Run
+        with patch.dict("hastexo.common.DEFAULT_SETTINGS",
+                        {"check_concurrency": 2}):
+            res = CheckStudentProgressTask.run(**kwargs)
+
+        # Assertions
+        # The task didn't wait for the hanging test.
+        self.assertEqual(res["status"], "CHECK_PROGRESS_TIMEOUT")
+        self.assertFalse(finished.is_set())
+
     def test_check_student_progress_success(self):
         # Setup
         self.mocks["remote_exec"].return_value = 0